@@ -1,11 +1,16 @@
 """Simple handling of backup of media files.
 
 Creates a file with _bup ending if not already avaliable.
+For in-place edits, a PatchJournal with _jrnl ending records only the
+original bytes of the changed ranges.
 """
 import os
+import struct
 from shutil import copy2
 
 BACKUP_FILE_SUFFIX = "_bup"
+JOURNAL_FILE_SUFFIX = "_jrnl"
+JOURNAL_RECORD_HEADER = ">QI"  # offset, length
 
 
 class BackupError(Exception):
@@ -22,3 +27,61 @@ def make_backup(filepath):
         copy2(filepath, backup_path)
     except IOError as err:
         raise BackupError("IOError %s" % err)
+
+
+class PatchJournal(object):
+    """Journal of the original bytes of in-place changes to a file.
+
+    Each record is written and flushed before the file itself is changed,
+    so restore_from_journal() can undo an interrupted run."""
+
+    def __init__(self, filepath):
+        self.journal_path = filepath + JOURNAL_FILE_SUFFIX
+        if os.path.exists(self.journal_path):
+            raise BackupError("Journal file %s already exists" %
+                              self.journal_path)
+        try:
+            self.fh = open(self.journal_path, "wb")
+        except IOError as err:
+            raise BackupError("IOError %s" % err)
+        self.nr_records = 0
+
+    def record(self, offset, old_data):
+        "Save old_data at offset before it is overwritten."
+        self.fh.write(struct.pack(JOURNAL_RECORD_HEADER, offset, len(old_data)))
+        self.fh.write(old_data)
+        self.fh.flush()
+        self.nr_records += 1
+
+    def close(self):
+        "Close the journal. An empty journal is removed."
+        self.fh.close()
+        if self.nr_records == 0:
+            os.unlink(self.journal_path)
+
+    def discard(self):
+        "Close and remove the journal after its changes have been undone."
+        self.fh.close()
+        os.unlink(self.journal_path)
+
+
+def restore_from_journal(filepath):
+    "Undo the changes recorded in the journal of filepath and remove the journal."
+    journal_path = filepath + JOURNAL_FILE_SUFFIX
+    with open(journal_path, "rb") as jfh:
+        journal = jfh.read()
+    records = []
+    header_size = struct.calcsize(JOURNAL_RECORD_HEADER)
+    pos = 0
+    while pos + header_size <= len(journal):
+        offset, length = struct.unpack_from(JOURNAL_RECORD_HEADER, journal, pos)
+        pos += header_size
+        if pos + length > len(journal):
+            break  # Record was not completely written, so not applied
+        records.append((offset, journal[pos:pos + length]))
+        pos += length
+    with open(filepath, "r+b") as ofh:
+        for offset, old_data in reversed(records):
+            ofh.seek(offset)
+            ofh.write(old_data)
+    os.unlink(journal_path)
@@ -54,12 +54,8 @@ def main():
             infile_name = "%d.m4s" % in_nr
             outfile_name = "%d.m4s" % out_nr
             if os.path.exists(infile_name):
-                tfilter = mp4filter.TfdtFilter(infile_name, offset)
-                tfilter.filter_top_boxes()
-                ofh = open(outfile_name, "wb")
-                data = tfilter.output
-                ofh.write(data)
-                ofh.close()
+                tfilter = mp4filter.TfdtFilter(None, offset)
+                tfilter.filter_file(infile_name, outfile_name)
                 in_nr += 1
                 out_nr += 1
                 nr_files_processed += 1
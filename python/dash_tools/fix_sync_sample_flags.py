@@ -34,7 +34,8 @@ import os
 import argparse
 
 import mp4filter
-from structops import str_to_uint32, uint32_to_str
+from structops import str_to_uint32
+from mp4_writer import BoxWriter
 
 
 class TrunFilter(mp4filter.MP4Filter):
@@ -51,50 +52,45 @@ class TrunFilter(mp4filter.MP4Filter):
             path = box_type
         else:
             path = "%s.%s" % (path, box_type)
-        output = ""
         if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size],
-                                         file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.trun":
-            output = self.process_trun(data, output)
+            output = self.process_trun(data)
         else:
             output = data
         return output
 
-    def process_trun(self, data, output):
-        """Adjust time of tfdt if offset set."""
+    def process_trun(self, data):
+        """Set the non-sync flag on all samples that depend on others."""
         version_and_flags = str_to_uint32(data[8:12])
         # version = version_and_flags >> 24
         flags = version_and_flags & 0xffffff
+        if not flags & 0x400:  # No sample_flags to change
+            return data
         sample_count = str_to_uint32(data[12:16])
-        offset = 16
+        header_size = 16
         if flags & 0x1:  # data_offset_present
-            offset += 4
+            header_size += 4
         if flags & 0x4:  # first_sample_flags
-            offset += 4
-        output += data[:offset]
-        for i in range(sample_count):
-            if flags & 0x100:  # sample_duration present
-                output += data[offset:offset + 4]
-                offset += 4
-            if flags & 0x200:  # sample_size present
-                output += data[offset:offset + 4]
-                offset += 4
-            if flags & 0x400:  # sample_flags present
-                sample_flags = str_to_uint32(data[offset:offset + 4])
-                if sample_flags != 0x2000000:  # Depends on other samples
-                    sample_flags |= 0x10000
-                output += uint32_to_str(sample_flags)
-                offset += 4
-            if flags & 0x800:  # composition_time_offset present
-                output += data[offset:offset + 4]
-                offset += 4
-        return output
+            header_size += 4
+        flags_pos = 0  # Position of sample_flags in a sample row
+        if flags & 0x100:  # sample_duration present
+            flags_pos += 4
+        if flags & 0x200:  # sample_size present
+            flags_pos += 4
+        sample_row_size = flags_pos + 4
+        if flags & 0x800:  # composition_time_offset present
+            sample_row_size += 4
+        # Copy the box and patch the sample_flags fields in place
+        writer = BoxWriter(len(data))
+        writer.write(data[:header_size + sample_count * sample_row_size])
+        offset = header_size + flags_pos
+        for _ in range(sample_count):
+            sample_flags = str_to_uint32(data[offset:offset + 4])
+            if sample_flags != 0x2000000:  # Depends on other samples
+                writer.patch_uint32(offset, sample_flags | 0x10000)
+            offset += sample_row_size
+        return writer.getvalue()
 
 
 def main():
@@ -107,14 +103,11 @@ def main():
     args = parser.parse_args()
 
     for filepath in args.infile:
-        tfilter = TrunFilter(filepath)
-        tfilter.filter_top_boxes()
-        output = tfilter.output
+        tfilter = TrunFilter(None)
         filename = os.path.split(filepath)[1]
         outpath = os.path.join(args.outputdir, filename)
-        print('%s -> %s  %dB' % (filepath, outpath, len(output)))
-        with open(outpath, 'wb') as ofh:
-            ofh.write(output)
+        size = tfilter.filter_file(filepath, outpath)
+        print('%s -> %s  %dB' % (filepath, outpath, size))
 
 
 if __name__ == "__main__":
@@ -35,7 +35,7 @@ import os
 
 from structops import uint32_to_str, str_to_uint32
 from mp4filter import MP4Filter
-from backup_handler import make_backup, BackupError
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
 
 class InitCleanFilter(MP4Filter):
     """Process an init file and clean it.
@@ -61,12 +61,7 @@ class InitCleanFilter(MP4Filter):
         if path in ("skip", "free"):
             print "Removing %s box" % box_type # Just let output="" to drop these boxes
         elif path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos + size], file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moov.mvhd": # Set movie duration
             output = self.process_mvhd(data)
         elif path == "moov.trak.tkhd": # Set trak duration
@@ -147,14 +142,11 @@ def main():
         try:
             make_backup(file_name)
         except BackupError:
-            print "Backup-file already exists. Skipping file %s" % file_name)
+            print("Backup-file already exists. Skipping file %s" % file_name)
             continue
-        init_cleaner = InitCleanFilter(file_name, new_track_id=options.track_id)
+        init_cleaner = InitCleanFilter(new_track_id=options.track_id)
         print "Processing %s" % file_name
-        output = init_cleaner.filter_top_boxes()
-        os.rename(file_name, bup_name)
-        with open(file_name, "wb") as ofh:
-            ofh.write(output)
+        init_cleaner.filter_file(file_name + BACKUP_FILE_SUFFIX, file_name)
 
 
 if __name__ == "__main__":
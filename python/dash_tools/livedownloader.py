@@ -41,9 +41,11 @@ import signal
 import urllib2
 import urlparse
 
+import mp4
 import mpdparser
 
 CREATE_DIRS = True
+CHUNK_SIZE = 16384
 
 
 class FileWriter(object):
@@ -79,11 +81,49 @@ class FileWriter(object):
             ofh.write(data)
 
 
-def fetch_file(url):
-    "Fetch a specific file via http and return as string."
+def parse_boxes(url, parser, chunk, box_callback):
+    """Feed chunk to parser, or close it if chunk is None, and call
+    box_callback with the completed top-level boxes.
+
+    Return the parser, or None after a parse error, which is logged, so
+    that printing the boxes never stops a download."""
+    try:
+        if chunk is None:
+            top_boxes = parser.close()
+        else:
+            top_boxes = parser.feed(chunk)
+        for top_box in top_boxes:
+            box_callback(url, top_box)
+    except Exception, exc:
+        print "ERROR parsing boxes of %s: %s: %s" % (url, exc.__class__.__name__, exc)
+        return None
+    return parser
+
+
+def fetch_file(url, box_callback=None):
+    """Fetch a specific file via http and return as string.
+
+    If box_callback is given, the response is read in chunks and the
+    callback is called with each top-level mp4 box as soon as it is
+    complete, while the rest of the file is still downloading."""
     try:
         start_time = time.time()
-        data = urllib2.urlopen(url).read()
+        response = urllib2.urlopen(url)
+        if box_callback is None:
+            data = response.read()
+        else:
+            parser = mp4.IncrementalParser()
+            chunks = []
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                if parser is not None:
+                    parser = parse_boxes(url, parser, chunk, box_callback)
+            if parser is not None:
+                parse_boxes(url, parser, None, box_callback)
+            data = "".join(chunks)
         size = len(data)
         end_time = time.time()
         start_time_tuple = time.gmtime(start_time)
@@ -98,11 +138,12 @@ def fetch_file(url):
 class Fetcher(object):
     "Fetching a complete live DASH session. Must be stopped with interrupt."
 
-    def __init__(self, mpd, base_url=None, file_writer=None, verbose=False):
+    def __init__(self, mpd, base_url=None, file_writer=None, verbose=False, box_callback=None):
         self.mpd = mpd
         self.base_url = base_url
         self.file_writer = file_writer
         self.verbose = verbose
+        self.box_callback = box_callback
         self.fetches = None
         self.threads = []
         self.interrupted = False
@@ -154,7 +195,8 @@ class Fetcher(object):
             init_url = os.path.join(fetch['base_url'], fetch['init'])
             data = fetch_file(init_url)
             self.file_writer.write_file(fetch['init'], data)
-            thread = FetchThread("SegmentFetcher_%s" % fetch['id'], fetch, self.file_writer, number_segments, self)
+            thread = FetchThread("SegmentFetcher_%s" % fetch['id'], fetch, self.file_writer, number_segments, self,
+                                 self.box_callback)
             self.threads.append(thread)
             thread.start()
         self.keep_running()
@@ -170,13 +212,14 @@ class Fetcher(object):
 class FetchThread(Thread):
     "Thread that fetches media segments."
 
-    def __init__(self, name, fetch, file_writer, nr_segments_to_fetch=-1, fetcher=None):
+    def __init__(self, name, fetch, file_writer, nr_segments_to_fetch=-1, fetcher=None, box_callback=None):
         self.fetch = fetch
         Thread.__init__(self, name=name)
         self.interrupted = False
         self.file_writer = file_writer
         self.nr_segment_to_fetch = nr_segments_to_fetch
         self.parent = fetcher
+        self.box_callback = box_callback
 
     def interrupt(self):
         "Interrupt this thread."
@@ -201,7 +244,7 @@ class FetchThread(Thread):
     def fetch_media_segment(self, number):
         "Fetch a media segment given its number."
         media_url = self.make_media_url(number)
-        return fetch_file(media_url)
+        return fetch_file(media_url, self.box_callback)
 
     def store_segment(self, data, number):
         "Store the segment to file."
@@ -231,7 +274,13 @@ class FetchThread(Thread):
                 break
 
 
-def download(mpd_url=None, mpd_str=None, base_url=None, base_dst="", number_segments=-1, verbose=False):
+def print_box(url, top_box):
+    "Print a top-level box as soon as it has been downloaded."
+    print "%s @%d: %s" % (url, top_box.stream_offset, top_box.description().rstrip('\n'))
+
+
+def download(mpd_url=None, mpd_str=None, base_url=None, base_dst="", number_segments=-1, verbose=False,
+             box_callback=None):
     "Download MPD if url specified and then start downloading segments."
     if mpd_url:
         mpd_str = fetch_file(mpd_url)
@@ -239,7 +288,7 @@ def download(mpd_url=None, mpd_str=None, base_url=None, base_dst="", number_segm
         file_writer = FileWriter(base_dst)
         file_writer.write_file(file_name, mpd_str)
     mpd_parser = mpdparser.ManifestParser(mpd_str)
-    fetcher = Fetcher(mpd_parser.mpd, base_url, file_writer, verbose)
+    fetcher = Fetcher(mpd_parser.mpd, base_url, file_writer, verbose, box_callback)
     if verbose:
         print fetcher.fetches
     fetcher.start_fetch(number_segments)
@@ -253,6 +302,8 @@ def main():
     parser.add_option("-v", "--verbose", action="store_true", dest="verbose")
     parser.add_option("-b", "--base_url", dest="baseURLForced")
     parser.add_option("-n", "--number", dest="numberSegments", type="int")
+    parser.add_option("-p", "--print-boxes", action="store_true", dest="printBoxes",
+                      help="print top-level boxes of media segments while downloading")
     (options, args) = parser.parse_args()
     number_segments = -1
     if options.numberSegments:
@@ -263,7 +314,11 @@ def main():
     base_dst = ""
     if len(args) >= 2:
         base_dst = args[1]
-    download(mpd_url, base_dst=base_dst, number_segments=number_segments, verbose=options.verbose)
+    box_callback = None
+    if options.printBoxes:
+        box_callback = print_box
+    download(mpd_url, base_dst=base_dst, number_segments=number_segments, verbose=options.verbose,
+             box_callback=box_callback)
 
 
 if __name__ == "__main__":
@@ -34,7 +34,7 @@ import sys
 import os
 from structops import uint32_to_str, str_to_uint32
 from mp4filter import MP4Filter
-from backup_handler import make_backup, BackupError
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
 
 
 class MediaCleanFilter(MP4Filter):
@@ -58,27 +58,13 @@ class MediaCleanFilter(MP4Filter):
         if path in ("skip", "free", "sidx"):
             print "Removing %s box" % box_type # Just let output="" to drop these boxes
         elif path in self.composite_boxes:
-            output = self.process_composite_box(path, data)
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.tfhd": # Set movie duration
             output = self.process_tfhd(data)
         else:
             output = data
         return output
 
-    def process_composite_box(self, path, data):
-        "Process a composite box."
-        #pylint: disable=unused-variable
-        container_size, container_box_type = self.check_box(data[0:8])
-        inner_data = ""
-        pos = 8
-        while pos < len(data):
-            size, box_type = self.check_box(data[pos:pos + 8])
-            inner_data += self.filterbox(box_type, data[pos:pos+size], None, path)
-            pos += size
-        new_container_size = 8 + len(inner_data)
-        #Note. If this has changed, make sure that offsets are changes appropriately
-        return uint32_to_str(new_container_size) + container_box_type + inner_data
-
     def process_tfhd(self, data):
         "Process the mvhd box and set timescale."
         tf_flags = str_to_uint32(data[8:12]) & 0xffffff
@@ -110,13 +96,11 @@ def main():
         try:
             make_backup(file_name)
         except BackupError:
-            print "Backup-file already exists. Skipping file %s" % file_name)
+            print("Backup-file already exists. Skipping file %s" % file_name)
             continue
-        init_cleaner = MediaCleanFilter(file_name, new_track_id=options.track_id)
+        media_cleaner = MediaCleanFilter(new_track_id=options.track_id)
         print "Processing %s" % file_name
-        output = init_cleaner.filter_top_boxes()
-        with open(file_name, "wb") as ofh:
-            ofh.write(output)
+        media_cleaner.filter_file(file_name + BACKUP_FILE_SUFFIX, file_name)
 
 if __name__ == "__main__":
     main()
@@ -40,16 +40,57 @@ MP4 box parser
 #pylint: disable=expression-not-assigned
 #pylint: disable=unused-variable
 
+import __builtin__
+import array
 import base64
 import binascii
 import bisect
+import collections
 import functools
+import mmap
+import os
+import sys
 
 import struct
-from struct import unpack
+from struct import unpack, unpack_from
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 VERBOSE = 0
 REGISTERED_BOXES = {}
+BOX_CLASSES = {}  # Raw 4-byte box type -> box class, filled in at the end of the module
+
+# Box types renamed to be valid in class names and find() paths
+BOX_TYPE_NAMES = {'ac-3': 'ac_3', 'ec-3': 'ec_3'}
+
+CONTAINER_BOXES = frozenset(['root',
+                             'moov',
+                             'moof',
+                             'trak',
+                             'traf',
+                             'tfad',
+                             'mvex',
+                             'mdia',
+                             'minf',
+                             'dinf',
+                             'stbl',
+                             'mfra',
+                             'udta',
+                             #'meta',
+                             'stsd',
+                             'sinf',
+                             'schi',
+                             'encv',
+                             'enca',
+                             'avc1',
+                             'hev1',
+                             'hvc1',
+                             'mp4a',
+                             'ec_3',
+                             'vttc'])
 
 FILTER = ''.join([(len(repr(chr(character))) == 3) and chr(character) or '.' for character in range(256)])
 
@@ -70,14 +111,20 @@ def dump_hex(src, length=8):
     return ''.join(result)
 
 
-def parse_generator(data, fmt=''):
-    """ parse_generator """
-    offset = 0
+def parse_generator(data, fmt='', offset=0, end=None):
+    """ parse_generator
+
+    Unpacks fields in place from data[offset:end] without copying it."""
+    if end is None:
+        end = len(data)
     ret = None
-    while offset < len(data):
+    while offset < end:
         if fmt:
+            size = struct.calcsize(fmt)
+            if offset + size > end:
+                raise struct.error('unpack_from requires a buffer of at least %d bytes' % size)
             ret = struct.unpack_from(fmt, data, offset)
-            offset += struct.calcsize(fmt)
+            offset += size
         fmt = (yield ret) or fmt
 
 
@@ -99,18 +146,116 @@ def match_box(obj, criteria='xxxx'):
         return obj.type == criteria[:4] and match_attribute(obj, criteria[5:-1])
 
 
+class PathQuery(object):
+    """Compiled box path for box.find().
+
+    The path is split once into steps. A step is a box type, a box type with
+    an attribute criterion 'atom[attr=val]', or empty for the parent.
+    Use compile_path() to get cached instances."""
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = [self._compile_step(part) for part in path.split('.')]
+        self.is_plain = all(step is not None and step[1] is None for step in self.steps)
+
+    @staticmethod
+    def _compile_step(part):
+        if not part:
+            return None
+        if len(part) != 4 and part.find('[') != -1:
+            # assume 'atom[attr=val]' notation
+            key, value = part[5:-1].split('=')
+            return part[:4], key, value
+        return part, None, None
+
+    def find(self, start, return_first=True):
+        index = getattr(start, '_index', None)
+        if index is not None and self.is_plain:
+            matches = self._find_in_index(start, index)
+            if return_first:
+                return matches and matches[0] or []
+            return matches
+
+        steps = self.steps
+        last_step = len(steps) - 1
+        queue = collections.deque([(start, 0)])
+        matches = []
+        while queue:
+            obj, depth = queue.popleft()
+            # check if children are parsed
+            if obj.is_unparsed:
+                obj.parse_children(recurse=False)
+
+            step = steps[depth]
+            if step is None:
+                matching_children = [obj.parent]
+            else:
+                box_type, key, value = step
+                matching_children = [child for child in obj._children if child.type == box_type and
+                                     (key is None or str(getattr(child, key)) == value)]
+
+            if matching_children:
+                if depth == last_step:
+                    if return_first:
+                        return matching_children[0]
+                    matches += matching_children
+                else:
+                    queue.extendleft([(child, depth + 1) for child in reversed(matching_children)])
+
+        return matches
+
+    def _find_in_index(self, start, index):
+        parent_types = [step[0] for step in reversed(self.steps[:-1])]
+        matches = []
+        for candidate in index.get(self.steps[-1][0], []):
+            obj = candidate.parent
+            for box_type in parent_types:
+                if obj is None or obj.type != box_type:
+                    break
+                obj = obj.parent
+            else:
+                if obj is start:
+                    matches.append(candidate)
+        return matches
+
+
+COMPILED_PATHS = {}
+
+
+def compile_path(path):
+    "Return the cached PathQuery for path."
+    query = COMPILED_PATHS.get(path)
+    if query is None:
+        query = COMPILED_PATHS[path] = PathQuery(path)
+    return query
+
+
 class box(object):
+    __slots__ = ('fmap', 'type', 'size', 'offset', '_children', 'parent', 'decoration', 'stream_offset',
+                 '_index')
+
     def __init__(self, fmap, box_type, size, offset, parent=None):
         self.fmap = fmap
         self.type = box_type
         self.size = size
         self.offset = offset
         # self.size, self.type = struct.unpack('>i4s', fmap[offset:offset+8])
-        self.children = []
+        self._children = []
         self.parent = parent
         if VERBOSE > 2:
             print ' - parsed \'%s\' offset:%d size:%d' % (box_type, offset, size)
 
+    @property
+    def children(self):
+        # None marks a lazy box whose children are parsed on first access
+        if self._children is None:
+            self.parse_children(recurse=False)
+        return self._children
+
+    @children.setter
+    def children(self, value):
+        self._children = value
+
     @property
     def endpos(self):
         return self.offset + self.size
@@ -121,35 +266,13 @@ class box(object):
 
     @property
     def is_container(self):
-        return self.type in ['root',
-                             'moov',
-                             'moof',
-                             'trak',
-                             'traf',
-                             'tfad',
-                             'mvex',
-                             'mdia',
-                             'minf',
-                             'dinf',
-                             'stbl',
-                             'mfra',
-                             'udta',
-                             #'meta',
-                             'stsd',
-                             'sinf',
-                             'schi',
-                             'encv',
-                             'enca',
-                             'avc1',
-                             'hev1',
-                             'hvc1',
-                             'mp4a',
-                             'ec_3',
-                             'vttc'] or self.__class__ == mp4
+        return self.type in CONTAINER_BOXES or self.__class__ == mp4
 
     @property
     def is_unparsed(self):
-        return self.is_container and not self.children and self.size >= 16
+        if self._children is None:
+            return True
+        return self.is_container and not self._children and self.size >= 16
 
     @property
     def root(self):
@@ -175,39 +298,29 @@ class box(object):
 
     def find(self, path, return_first=True):
         # print('%s Searching for: %s\n' % (str(self), path))
-        queue = [(self, path.split('.'))]
-        matches = []
-        while queue:
-            obj, parts = queue.pop(0)
-            # print('testing %s[%d:%d]' % (obj.path, obj.offset, obj.endpos))
-            # check if children are parsed
-            if obj.is_unparsed:
-                # print(' - parsing children')
-                obj.parse_children(recurse=False)
-
-            # matching child?
-            if parts[0]:
-                matching_children = filter(functools.partial(match_box, criteria=parts[0]), obj.children)
-            else:
-                matching_children = [obj.parent]
-
-            if matching_children:
-                # print('found %d matching children' % (len(matching_children)))
-                if len(parts) == 1:
-                    matches += matching_children
-
-                    if return_first:
-                        return matches[0]
-                else:
-                    new_items = [(child, parts[1:]) for child in matching_children]
-                    queue = new_items + queue
-                    # for child in matching_children:
-                    #     queue.append((child, parts[1:]))
-
-        # print(' = matches [%s]' % (', '.join([obj.path for obj in matches])))
-        return matches
+        if not isinstance(path, PathQuery):
+            path = compile_path(path)
+        return path.find(self, return_first)
+
+    def build_index(self):
+        """Index all boxes below this one by type, in document order.
+
+        The whole tree is parsed in one pass. Afterwards find() and find_all()
+        on this box answer plain type paths from the index instead of
+        walking the tree."""
+        index = {}
+        stack = list(reversed(self.children))
+        while stack:
+            obj = stack.pop()
+            index.setdefault(obj.type, []).append(obj)
+            stack.extend(reversed(obj.children))
+        self._index = index
+        return index
 
     def parse_children(self, stops=None, recurse=True):
+        if self._children is None:
+            self._children = []
+
         if not self.is_container:
             return
 
@@ -217,41 +330,33 @@ class box(object):
         next_offset = self.childpos
         end_offset = self.offset + self.size
 
+        fmap = self.fmap
         while next_offset < end_offset:
-            box_class = box
-            size, box_type = struct.unpack('>i4s', self.fmap[next_offset:next_offset+8])
+            size, raw_type = unpack_from('>i4s', fmap, next_offset)
 
-            #print 'type=', box_type, 'len=', size
+            #print 'type=', raw_type, 'len=', size
 
-            # Need to set allowed characters for some boxes
-            if box_type == 'ac-3':
-                box_type = 'ac_3'
-            elif box_type == 'ec-3':
-                box_type = 'ec_3'
+            box_class = BOX_CLASSES.get(raw_type, box)
+            box_type = BOX_TYPE_NAMES.get(raw_type, raw_type)
 
             if size == 1:   # Extended size
-                size = struct.unpack('>Q', self.fmap[next_offset+8:next_offset+16])[0]
+                size = unpack_from('>Q', fmap, next_offset+8)[0]
             if size > self.size or size < 8:
                 print 'WARNING: Box \'%s\' in \'%s\' at offset %d has faulty size %d (> %d or < 8)' % \
                     (box_type, self.path, next_offset, size, self.size - 7)
                 #raise Exception
                 return
 
-            box_class_name = '%s_box' % box_type.replace(' ', '_')
-            if box_class_name in REGISTERED_BOXES.keys():
-                box_class = REGISTERED_BOXES[box_class_name]
-                # debug_msg_exit('%s_box' % box_type + ':' + globals()['%s_box' % box_type].__name__)
-            else:
-                #print 'no box:', box_class_name
-                pass
-
-            new_box = box_class(self.fmap, box_type, size, next_offset, self)
-            self.children += [new_box]
+            new_box = box_class(fmap, box_type, size, next_offset, self)
+            self._children.append(new_box)
             #next_offset = new_box.endpos
             next_offset += size
 
-            if recurse and new_box.is_container:
-                new_box.parse_children(stops, recurse)
+            if new_box.is_container:
+                if recurse:
+                    new_box.parse_children(stops, recurse)
+                else:
+                    new_box._children = None
 
             for stop in stops:
                 # print 'Testing box.type == "moov": %s (%s)' % (str(stop(new_box)), new_box.type)
@@ -272,15 +377,17 @@ class box(object):
 
 
 class full_box(box):
+    __slots__ = ('version', 'flags', 'extended_type')
+
     def __init__(self, *args):
         box.__init__(self, *args)
         if self.type == 'uuid':
             self.extended_type = self.fmap[self.offset+8:self.offset+24]
-            self.version = struct.unpack('B', self.fmap[self.offset+24:self.offset+25])[0]
-            self.flags = struct.unpack('>i', '\x00'+self.fmap[self.offset+25:self.offset+28])[0]
+            version_and_flags = struct.unpack_from('>I', self.fmap, self.offset+24)[0]
         else:
-            self.version = struct.unpack('B', self.fmap[self.offset+8:self.offset+9])[0]
-            self.flags = struct.unpack('>i', '\x00'+self.fmap[self.offset+9:self.offset+12])[0]
+            version_and_flags = struct.unpack_from('>I', self.fmap, self.offset+8)[0]
+        self.version = version_and_flags >> 24
+        self.flags = version_and_flags & 0xffffff
 
     def description(self):
         return '\'%s\' [%d:%d] ver:%d flags:0x%x %s\n' % \
@@ -313,6 +420,8 @@ class mp4(box):
         box.__init__(self, fmap, 'root', size, offset)
         if recurse:
             self.parse_children(stops=stops, recurse=recurse)
+        else:
+            self._children = None
 
     def get_video_info(self):
         box_ = self.find('moov.trak.mdia.minf.vmhd')
@@ -343,6 +452,91 @@ class mp4(box):
         return self.offset
 
 
+def open(path, lazy=False, writable=False, **kwargs):
+    """Memory-map the file at path and return its mp4 root.
+
+    With lazy=True no boxes are parsed up front. The children of a container
+    are parsed the first time children or find() touches it, so only the
+    pages of the visited boxes are read from disk.
+
+    With writable=True the file is mapped read-write, and changes written
+    to root.fmap go straight to the file."""
+    with __builtin__.open(path, writable and 'r+b' or 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            access = writable and mmap.ACCESS_WRITE or mmap.ACCESS_READ
+            fmap = mmap.mmap(f.fileno(), 0, access=access)
+        else:
+            fmap = ''
+    return mp4(fmap, size, recurse=not lazy, **kwargs)
+
+
+class IncrementalParser(object):
+    """Push parser for top-level boxes that arrive in chunks.
+
+    feed() returns the top-level boxes (styp, prft, emsg, moof, mdat, ...)
+    completed by the new data. Only the unfinished tail is buffered. Each
+    returned box is parsed in its own root, and stream_offset gives its
+    position in the stream. A box of size 0 extends to the end of the
+    stream and is returned by close()."""
+
+    def __init__(self, offset=0):
+        self.buffer = bytearray()
+        self.offset = offset  # Stream offset of the start of buffer
+
+    def _next_size(self):
+        """Return the size of the box at the start of the buffer, 0 if it
+        extends to the end of the stream or None if its header is incomplete."""
+        size, box_type = struct.unpack_from('>I4s', buffer(self.buffer))
+        if size == 1:
+            if len(self.buffer) < 16:
+                return None
+            size = struct.unpack_from('>Q', buffer(self.buffer), 8)[0]
+        elif size == 0:
+            return 0
+        if size < 8:
+            raise ValueError('Box \'%s\' at offset %d has faulty size %d' % (box_type, self.offset, size))
+        return size
+
+    def feed(self, data):
+        self.buffer.extend(data)
+        boxes = []
+        while len(self.buffer) >= 8:
+            try:
+                size = self._next_size()
+            except ValueError:
+                if boxes:
+                    break  # Return the completed boxes, the next call raises
+                raise
+            if not size or len(self.buffer) < size:
+                break
+            box_data = str(self.buffer[:size])
+            del self.buffer[:size]
+            root = mp4(box_data, size)
+            for new_box in root.children:
+                new_box.stream_offset = self.offset
+                boxes.append(new_box)
+            self.offset += size
+        return boxes
+
+    @property
+    def pending(self):
+        "Number of buffered bytes belonging to a not yet completed box."
+        return len(self.buffer)
+
+    def close(self):
+        "Return the last box if it has size 0, i.e. extends to the end of the stream."
+        boxes = []
+        if len(self.buffer) >= 8 and self._next_size() == 0:
+            struct.pack_into('>I', self.buffer, 0, len(self.buffer))
+            boxes = self.feed('')
+        if self.buffer:
+            print 'WARNING: Stream ended with %d bytes of an incomplete box at offset %d' % \
+                (len(self.buffer), self.offset)
+        self.buffer = bytearray()
+        return boxes
+
+
 class moov_box(box):
     def __init__(self, fmap, box_type, size, offset, parent=None):
         box.__init__(self, fmap, box_type, size, offset, parent)
@@ -351,7 +545,7 @@ class moov_box(box):
 class mvhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -371,14 +565,14 @@ class pssh_box(full_box):
 
         self.kids = []
         if self.version > 0:
-            KID_count = struct.unpack('>I', self.fmap[self.offset+o:self.offset+o+4])[0]
+            KID_count = struct.unpack_from('>I', self.fmap, self.offset+o)[0]
             o += 4
             for k in range(KID_count):
                 kid = ''.join(["%02X"%ord(x) for x in self.fmap[self.offset+o:self.offset+o+16]])
                 o += 16
                 self.kids.append(kid)
 
-        self.data_size = struct.unpack('>I', self.fmap[self.offset+o:self.offset+o+4])[0]
+        self.data_size = struct.unpack_from('>I', self.fmap, self.offset+o)[0]
         o += 4
 
     @property
@@ -408,7 +602,7 @@ class saiz_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>B', self.fmap[self.offset+offset:self.offset+offset+1])[0]
+        return struct.unpack_from('>B', self.fmap, self.offset+offset)[0]
 
     @property
     def sample_count(self):
@@ -416,7 +610,7 @@ class saiz_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     def sample_info_size(self, index):
         if self.default_sample_info_size != 0:
@@ -428,7 +622,7 @@ class saiz_box(full_box):
 
         sample_offset = self.offset + info_offset_base + index
 
-        return struct.unpack('>B', self.fmap[sample_offset:sample_offset+1])[0]
+        return struct.unpack_from('>B', self.fmap, sample_offset)[0]
 
     @property
     def decoration(self):
@@ -455,17 +649,17 @@ class saio_box(full_box):
         if self.flags and 1:
             offset += 8
 
-        return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     def entry_offset(self, index):
         offset = 16
         if self.flags and 1:
             offset += 8
             offset += index * 8
-            return struct.unpack('>Q', self.fmap[self.offset+offset:self.offset+offset+8])[0]
+            return struct.unpack_from('>Q', self.fmap, self.offset+offset)[0]
         else:
             offset += index * 4
-            return struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            return struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
 
     @property
     def decoration(self):
@@ -492,7 +686,7 @@ class sbgp_box(full_box):
 
     @property
     def entries(self):
-        return struct.unpack('>I', self.fmap[self.offset+16:self.offset+20])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+16)[0]
 
     def group_entry(self, index):
         base_offset = 20 + (self.version and 4 or 0)
@@ -501,8 +695,8 @@ class sbgp_box(full_box):
             return 0, 0
 
         offset = self.offset + entry_offset
-        sample_count = struct.unpack('>I', self.fmap[offset:offset+4])[0]
-        group_description_index = struct.unpack('>I', self.fmap[offset+4:offset+8])[0]
+        sample_count = struct.unpack_from('>I', self.fmap, offset)[0]
+        group_description_index = struct.unpack_from('>I', self.fmap, offset+4)[0]
 
         return sample_count, group_description_index
 
@@ -532,7 +726,7 @@ class sgpd_box(full_box):
     @property
     def entries(self):
         o = (self.version and 4 or 0)
-        return struct.unpack('>I', self.fmap[self.offset+o+16:self.offset+o+20])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+o+16)[0]
 
     def entry(self, index):
         base_offset = 20 + (self.version and 4 or 0)
@@ -542,8 +736,8 @@ class sgpd_box(full_box):
 
         offset = self.offset + entry_offset
 
-        is_encrypted = struct.unpack('>i', '\x00'+self.fmap[offset:offset+3])[0]
-        iv_size = struct.unpack('>b', self.fmap[offset+3:offset+4])[0]
+        is_encrypted = struct.unpack_from('>I', self.fmap, offset)[0] >> 8
+        iv_size = struct.unpack_from('>b', self.fmap, offset+3)[0]
 
         kid = self.fmap[offset+4:offset+20]
 
@@ -577,7 +771,7 @@ class sgpd_box(full_box):
 class senc_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.sample_count = i.send('>I')[0]
         self.samples = []
@@ -708,13 +902,13 @@ class genc_box(full_box):
                     if sample_info_size > iv_size:
                         a = sample_offset + iv_size
                         b = a + 2
-                        sub_sample_count = struct.unpack('>h', self.fmap[a : b])[0]
+                        sub_sample_count = struct.unpack_from('>h', self.fmap, a)[0]
                         entry = entry + ' #sub samples:{0}'.format(sub_sample_count)
                         for s in range(sub_sample_count):
                             sub_sample_offset = sample_offset+iv_size+2+s*6
                             off = sub_sample_offset
-                            clear_data_size = struct.unpack('>H', self.fmap[off:off + 2])[0]
-                            encrypted_data_size = struct.unpack('>I', self.fmap[off + 2 : off + 6])[0]
+                            clear_data_size = struct.unpack_from('>H', self.fmap, off)[0]
+                            encrypted_data_size = struct.unpack_from('>I', self.fmap, off + 2)[0]
                             entry = entry + '\n - - sub sample:{0:03d} clear chunk:{1} encrypted chunk:{2}'\
                                 .format(s, clear_data_size, encrypted_data_size)
                 entries.append(entry + '\n')
@@ -729,7 +923,7 @@ class SampleEntry(box):
 
     @property
     def data_reference_index(self):
-        return struct.unpack('>H', self.fmap[self.offset+14:self.offset+16])[0]
+        return struct.unpack_from('>H', self.fmap, self.offset+14)[0]
 
 
 def getDescriptorLen(i):
@@ -750,7 +944,7 @@ class esds_box(box):
 
         self.cfg = ''
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
         vf = i.send('>I')[0]
         tag1 = i.send('>B')[0]
@@ -796,9 +990,9 @@ class esds_box(box):
 class mp4a_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        self.channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        self.sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        self.sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        self.channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        self.sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        self.sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, self.channels, self.sample_size, self.sample_rate)
 
@@ -810,9 +1004,9 @@ class mp4a_box(SampleEntry):
 class ac_3_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, channels, sample_size, sample_rate)
 
@@ -824,9 +1018,9 @@ class ac_3_box(SampleEntry):
 class ec_3_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        channels = struct.unpack('>h', self.fmap[self.offset+24:self.offset+26])[0]
-        sample_size = struct.unpack('>h', self.fmap[self.offset+26:self.offset+28])[0]
-        sample_rate = struct.unpack('>I', self.fmap[self.offset+32:self.offset+36])[0] >> 16
+        channels = struct.unpack_from('>h', self.fmap, self.offset+24)[0]
+        sample_size = struct.unpack_from('>h', self.fmap, self.offset+26)[0]
+        sample_rate = struct.unpack_from('>I', self.fmap, self.offset+32)[0] >> 16
         self.decoration = 'index:{0} channels:{1} sample size:{2} sample rate:{3}'\
             .format(self.data_reference_index, channels, sample_size, sample_rate)
 
@@ -880,8 +1074,8 @@ class enca_box(mp4a_box):
 class mp4v_box(SampleEntry):
     def __init__(self, *args):
         SampleEntry.__init__(self, *args)
-        width = struct.unpack('>h', self.fmap[self.offset+32:self.offset+34])[0]
-        height = struct.unpack('>h', self.fmap[self.offset+34:self.offset+36])[0]
+        width = struct.unpack_from('>h', self.fmap, self.offset+32)[0]
+        height = struct.unpack_from('>h', self.fmap, self.offset+34)[0]
         self.decoration = 'index:{0} width:{1} height:{2}'\
             .format(self.data_reference_index, width, height)
 
@@ -891,13 +1085,13 @@ class avcx_box(SampleEntry):
         SampleEntry.__init__(self, *args)
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
 
-        self.width = struct.unpack('>h', self.fmap[self.offset+32:self.offset+34])[0]
-        self.height = struct.unpack('>h', self.fmap[self.offset+34:self.offset+36])[0]
-        res_hori = struct.unpack('>I', self.fmap[self.offset+36:self.offset+40])[0]
-        res_vert = struct.unpack('>I', self.fmap[self.offset+40:self.offset+44])[0]
-        frame_count = struct.unpack('>h', self.fmap[self.offset+48:self.offset+50])[0]
+        self.width = struct.unpack_from('>h', self.fmap, self.offset+32)[0]
+        self.height = struct.unpack_from('>h', self.fmap, self.offset+34)[0]
+        res_hori = struct.unpack_from('>I', self.fmap, self.offset+36)[0]
+        res_vert = struct.unpack_from('>I', self.fmap, self.offset+40)[0]
+        frame_count = struct.unpack_from('>h', self.fmap, self.offset+48)[0]
         compressor = str(self.fmap[self.offset+50:self.offset+82])
-        depth = struct.unpack('>h', self.fmap[self.offset+82:self.offset+84])[0]
+        depth = struct.unpack_from('>h', self.fmap, self.offset+82)[0]
 
         self.decoration = 'index:{0} width:{1} height:{2} hori_res:{3:x} vert_res:{4:x} compressor:{5} depth={6:x}'\
             .format(self.data_reference_index, self.width, self.height, res_hori, res_vert, compressor, depth)
@@ -937,7 +1131,7 @@ class encv_box(avc1_box):
 class avcC_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.version = i.send('>B')[0]
@@ -996,7 +1190,7 @@ def read_hex(reader, bytes):
 class hvcC_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.c = {}
@@ -1083,7 +1277,7 @@ class stsd_box(full_box):
 
     @property
     def entry_count(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def childpos(self):
@@ -1111,8 +1305,8 @@ class schm_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
         type = self.fmap[self.offset+12:self.offset+16]
-        major_version = struct.unpack('>H', self.fmap[self.offset+16:self.offset+18])[0]
-        minor_version = struct.unpack('>H', self.fmap[self.offset+18:self.offset+20])[0]
+        major_version = struct.unpack_from('>H', self.fmap, self.offset+16)[0]
+        minor_version = struct.unpack_from('>H', self.fmap, self.offset+18)[0]
         self.decoration = 'type:{0} version:{1}.{2}'.format(type, major_version, minor_version)
 
 
@@ -1127,11 +1321,11 @@ class tenc_box(full_box):
 
     @property
     def is_encrypted(self):
-        return struct.unpack('>i', '\x00'+self.fmap[self.offset+12:self.offset+15])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0] >> 8
 
     @property
     def iv_size(self):
-        return struct.unpack('>b', self.fmap[self.offset+15:self.offset+16])[0]
+        return struct.unpack_from('>b', self.fmap, self.offset+15)[0]
 
     @property
     def key_id(self):
@@ -1150,7 +1344,7 @@ class tenc_box(full_box):
 class tkhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1176,7 +1370,7 @@ class tkhd_box(full_box):
 class mdhd_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         self.creation_time = i.send(self.version and '>Q' or '>I')[0]
         self.modification_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1197,7 +1391,7 @@ class mdhd_box(full_box):
 class hdlr_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
         i.send('>I')[0] # pre_defined
         handler_type = ''
@@ -1240,7 +1434,7 @@ class moof_box(box):
 class trex_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size], '>I')
+        i = parse_generator(self.fmap, '>I', offset=self.offset+12, end=self.offset+self.size)
         self.track_id = i.next()[0]
         self.default_sample_description_index = i.next()[0]
         self.default_sample_duration = i.next()[0]
@@ -1253,7 +1447,7 @@ class trex_box(full_box):
 class mfhd_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
-        self.seqno = struct.unpack('>i', self.fmap[self.offset+12:self.offset+16])[0]
+        self.seqno = struct.unpack_from('>i', self.fmap, self.offset+12)[0]
 
     def get_track_duration(self, track_id, timescale):
         truns = self.find('.traf.tfhd[track_id=%d]..trun' % track_id, return_first=False)
@@ -1290,6 +1484,11 @@ class mfhd_box(box):
 
 
 class tfhd_box(full_box):
+    __slots__ = ('has_base_data_offset', 'has_sample_description_index', 'has_default_sample_duration',
+                 'has_default_sample_size', 'has_default_sample_flags', 'base_data_offset',
+                 'sample_description_index', 'default_sample_duration', 'default_sample_size',
+                 'default_sample_flags', 'msg')
+
     def __init__(self, *args):
         full_box.__init__(self, *args)
 
@@ -1310,28 +1509,28 @@ class tfhd_box(full_box):
         offset = 16
 
         if self.has_base_data_offset:
-            self.base_data_offset = struct.unpack('>Q', self.fmap[self.offset + offset : self.offset + offset + 8])[0]
+            self.base_data_offset = struct.unpack_from('>Q', self.fmap, self.offset + offset)[0]
             msg = msg + ' base_data_offset:%d' % self.base_data_offset
             offset = offset + 8
 
         if self.has_sample_description_index:
             self.sample_description_index = \
-                struct.unpack('>I', self.fmap[self.offset + offset : self.offset + offset + 4])[0]
+                struct.unpack_from('>I', self.fmap, self.offset + offset)[0]
             msg = msg + ' sample_description_index:%d' % self.sample_description_index
             offset = offset + 4
 
         if self.has_default_sample_duration:
-            self.default_sample_duration = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_duration = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_duration:%d' % self.default_sample_duration
             offset = offset + 4
 
         if self.has_default_sample_size:
-            self.default_sample_size = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_size = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_size:%d' % self.default_sample_size
             offset = offset + 4
 
         if self.has_default_sample_flags:
-            self.default_sample_flags = struct.unpack('>I', self.fmap[self.offset+offset:self.offset+offset+4])[0]
+            self.default_sample_flags = struct.unpack_from('>I', self.fmap, self.offset+offset)[0]
             msg = msg + ' default_sample_flags:%d' % self.default_sample_flags
             offset = offset + 4
 
@@ -1339,7 +1538,7 @@ class tfhd_box(full_box):
 
     @property
     def track_id(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def decoration(self):
@@ -1347,6 +1546,10 @@ class tfhd_box(full_box):
 
 
 class trun_box(full_box):
+    __slots__ = ('has_data_offset', 'has_first_sample_flags', 'has_sample_duration', 'has_sample_size',
+                 'has_sample_flags', 'has_sample_composition_time_offset', 'first_cto', 'data_offset',
+                 'first_sample_flags', 'sample_array_offset', 'sample_row_size', 'total_duration', '_samples')
+
     def __init__(self, *args):
         full_box.__init__(self, *args)
 
@@ -1358,7 +1561,7 @@ class trun_box(full_box):
         self.has_sample_composition_time_offset = self.flags & 0x0800
         self.first_cto = 0  # Can be used to calculate first presentation time
 
-        # self.sample_count = struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        # self.sample_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.data_offset = 0
         self.first_sample_flags = 0
         self.decoration = 'size:%d' % self.sample_count
@@ -1366,36 +1569,108 @@ class trun_box(full_box):
 
         self.sample_array_offset = 16
         if self.has_data_offset:
-            self.data_offset = struct.unpack('>i', \
-                self.fmap[self.offset+self.sample_array_offset:self.offset + self.sample_array_offset + 4])[0]
+            self.data_offset = struct.unpack_from('>i', self.fmap, self.offset + self.sample_array_offset)[0]
             self.sample_array_offset += 4
             self.decoration += ' offset:%d' % self.data_offset
 
         if self.has_first_sample_flags:
-            self.first_sample_flags = struct.unpack('>I', \
-                self.fmap[self.offset+self.sample_array_offset:self.offset+self.sample_array_offset+4])[0]
+            self.first_sample_flags = struct.unpack_from('>I', self.fmap, self.offset + self.sample_array_offset)[0]
             self.sample_array_offset += 4
             self.decoration += ' fs_flags:%d' % self.first_sample_flags
 
         self.sample_row_size = (self.has_sample_duration and 4) + \
             (self.has_sample_size and 4) + (self.has_sample_flags and 4) + \
             (self.has_sample_composition_time_offset and 4)
+        self._samples = None
         if self.has_sample_duration:
-            self.total_duration = sum([struct.unpack_from('>I', self.fmap, self.offset + self.sample_array_offset + i * self.sample_row_size)[0] for i in range(self.sample_count)])
+            if np is not None:
+                self.total_duration = int(self.samples['duration'].sum())
+            else:
+                self.total_duration = sum(self._sample_column('duration'))
         else:
             self.total_duration = self.parent.find('tfhd').default_sample_duration * self.sample_count
         # Note. One may need to go all the way to trex to find the default
         # values
 
-        if self.has_sample_composition_time_offset:
-            offset = (self.offset + self.sample_array_offset +
-                      (self.has_sample_duration and 4) +
-                      (self.has_sample_size and 4) +
-                      (self.has_sample_flags and 4))
-            self.first_cto = struct.unpack_from('>i', self.fmap, offset)[0]  # Interpret as signed (works for version 0 (unsigned) as well)
+        if self.has_sample_composition_time_offset and self.sample_count:
+            # Interpret as signed (works for version 0 (unsigned) as well)
+            if np is not None:
+                self.first_cto = int(self.samples['cto'][:1].astype(np.int32)[0])
+            else:
+                self.first_cto = struct.unpack('>i', struct.pack('>I', self._sample_column('cto')[0] & 0xffffffff))[0]
 
         self.decoration += ' tdur:%d' % self.total_duration
 
+    @property
+    def sample_dtype(self):
+        "Column names and big-endian struct codes of one sample row."
+        names = []
+        codes = []
+        if self.has_sample_duration:
+            names.append('duration')
+            codes.append('I')
+        if self.has_sample_size:
+            names.append('size')
+            codes.append('I')
+        if self.has_sample_flags:
+            names.append('flags')
+            codes.append('I')
+        if self.has_sample_composition_time_offset:
+            names.append('cto')
+            codes.append(self.version and 'i' or 'I')
+        return names, codes
+
+    def _sample_column(self, name):
+        "One column of all sample rows as a list, decoded with struct."
+        names, codes = self.sample_dtype
+        fmt = '>' + ''.join(codes) * self.sample_count
+        values = struct.unpack_from(fmt, self.fmap, self.offset + self.sample_array_offset)
+        return list(values[names.index(name)::len(names)])
+
+    @property
+    def samples(self):
+        """All sample rows as a NumPy structured array.
+
+        The columns are the fields present according to the flags, out of
+        duration, size, flags and cto. The array is decoded with a single
+        numpy.frombuffer call and cached."""
+        if self._samples is None:
+            names, codes = self.sample_dtype
+            dtype = np.dtype([(name, {'I': '>u4', 'i': '>i4'}[code])
+                              for name, code in zip(names, codes)])
+            if dtype.itemsize and self.sample_count:
+                self._samples = np.frombuffer(self.fmap, dtype, self.sample_count,
+                                              self.offset + self.sample_array_offset)
+            else:
+                self._samples = np.zeros(self.sample_count, dtype)
+        return self._samples
+
+    @property
+    def sample_sizes(self):
+        """Sample sizes as an array (a list without NumPy), falling back to
+        the tfhd default size."""
+        if np is None:
+            if self.has_sample_size:
+                return self._sample_column('size')
+            return [self.parent.find('tfhd').default_sample_size] * self.sample_count
+        if self.has_sample_size:
+            return self.samples['size'].astype(np.int64)
+        default_size = self.parent.find('tfhd').default_sample_size
+        return np.full(self.sample_count, default_size, np.int64)
+
+    @property
+    def sample_offsets(self):
+        "Sample data offsets relative to the data_offset of the trun."
+        if np is None:
+            offsets = [0] * self.sample_count
+            sizes = self.sample_sizes
+            for i in xrange(1, self.sample_count):
+                offsets[i] = offsets[i - 1] + sizes[i - 1]
+            return offsets
+        offsets = np.zeros(self.sample_count, np.int64)
+        np.cumsum(self.sample_sizes[:-1], out=offsets[1:])
+        return offsets
+
     #@property
     #def has_data_offset(self):
     #    return self.flags & 0x0001
@@ -1407,22 +1682,22 @@ class trun_box(full_box):
 
     @property
     def sample_count(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     def sample_entry(self, i):
         row = {}
         offset = self.offset + self.sample_array_offset + i * self.sample_row_size
         if self.has_sample_duration:
-            row['duration'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+            row['duration'] = struct.unpack_from('>I', self.fmap, offset)[0]
             offset += 4
         if self.has_sample_size:
-            row['size'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+            row['size'] = struct.unpack_from('>I', self.fmap, offset)[0]
             offset += 4
         if self.has_sample_flags:
-            row['flags'] = '0x%x' % struct.unpack('>I', self.fmap[offset:offset+4])[0]
+            row['flags'] = '0x%x' % struct.unpack_from('>I', self.fmap, offset)[0]
             offset += 4
         if self.has_sample_composition_time_offset:
-            row['time_offset'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+            row['time_offset'] = struct.unpack_from('>I', self.fmap, offset)[0]
             offset += 4
 
         return row
@@ -1447,16 +1722,16 @@ class trun_box(full_box):
                 row = {}
                 offset = self.offset + self.sample_array_offset + i * self.sample_row_size
                 if self.has_sample_duration:
-                    row['duration'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+                    row['duration'] = struct.unpack_from('>I', self.fmap, offset)[0]
                     offset += 4
                 if self.has_sample_size:
-                    row['size'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+                    row['size'] = struct.unpack_from('>I', self.fmap, offset)[0]
                     offset += 4
                 if self.has_sample_flags:
-                    row['flags'] = '0x%x' % struct.unpack('>I', self.fmap[offset:offset+4])[0]
+                    row['flags'] = '0x%x' % struct.unpack_from('>I', self.fmap, offset)[0]
                     offset += 4
                 if self.has_sample_composition_time_offset:
-                    row['time_offset'] = struct.unpack('>I', self.fmap[offset:offset+4])[0]
+                    row['time_offset'] = struct.unpack_from('>I', self.fmap, offset)[0]
                     offset += 4
 
                 ret += ' - ' + ' '.join(['%s:%s' % (k, v) for k, v in row.iteritems()]) + '\n'
@@ -1472,23 +1747,23 @@ class tfra_box(full_box):
 
     @property
     def track_id(self):
-        return struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
     @property
     def length_size_of_traf_num(self):
-        return (struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x30) >> 4
+        return (struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x30) >> 4
 
     @property
     def length_size_of_trun_num(self):
-        return (struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x0C) >> 2
+        return (struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x0C) >> 2
 
     @property
     def length_size_of_sample_num(self):
-        return struct.unpack('>B', self.fmap[self.offset+19])[0] & 0x03
+        return struct.unpack_from('>B', self.fmap, self.offset+19)[0] & 0x03
 
     @property
     def number_of_entry(self):
-        return struct.unpack('>I', self.fmap[self.offset+20:self.offset+24])[0]
+        return struct.unpack_from('>I', self.fmap, self.offset+20)[0]
 
     @property
     def end_time(self):
@@ -1511,7 +1786,7 @@ class tfra_box(full_box):
         # sys.stderr.write(str(locals())+'\n')
         # sys.stderr.write('start:{row_start} len:{row_length}\n'.format(**locals()))
 
-        p = parse_generator(self.fmap[row_start:row_start+row_length], intro_format)
+        p = parse_generator(self.fmap, intro_format, offset=row_start, end=row_start+row_length)
         time = p.next()[0]
         moof_offset = p.next()[0]
         traf = p.send(['>B', '>H', '>BH', '>I'][self.length_size_of_traf_num])[-1]
@@ -1531,7 +1806,7 @@ class tfra_box(full_box):
         self.random_access_moof_offset = []
         for i in range(self.number_of_entry):
             row_start = self.offset + 24 + (row_length * i)
-            time, moof_offset = struct.unpack(intro_format, self.fmap[row_start:row_start+intro_length])
+            time, moof_offset = struct.unpack_from(intro_format, self.fmap, row_start)
 
             if not self.random_access_moof_offset or self.random_access_moof_offset[-1] != moof_offset:
                 self.random_access_time.append(time)
@@ -1625,7 +1900,7 @@ class tfra_box(full_box):
 class mfro_box(full_box):
     @property
     def decoration(self):
-        return 'size:%d' % struct.unpack('>I', self.fmap[self.offset+12:self.offset+16])[0]
+        return 'size:%d' % struct.unpack_from('>I', self.fmap, self.offset+12)[0]
 
 
 class stbl_box(box):
@@ -1633,171 +1908,129 @@ class stbl_box(box):
         box.__init__(self, *args)
 
 
+def read_uint32_array(fmap, offset, count, typecode='I'):
+    "Read count big-endian 32-bit integers at offset into an array."
+    values = array.array(typecode)
+    values.fromstring(fmap[offset:offset + 4 * count])
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def first_sample_numbers(sample_counts):
+    "1-based number of the first sample of each run in a run-length table."
+    first_samples = []
+    sample_number = 1
+    for count in sample_counts:
+        first_samples.append(sample_number)
+        sample_number += count
+    return first_samples
+
+
 class stts_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_count' : i.send('>I')[0], 'sample_delta' : i.send('>I')[0]})
-
-        self.array = []
-        self.unroll()
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        table = read_uint32_array(self.fmap, self.offset+16, 2 * self.entry_count)
+        self.sample_counts = table[0::2]
+        self.sample_deltas = table[1::2]
+
+        # Cumulative indexes for binary search, one item per entry
+        self.first_samples = first_sample_numbers(self.sample_counts)
+        self.first_times = []
+        time = 0
+        for count, delta in zip(self.sample_counts, self.sample_deltas):
+            self.first_times.append(time)
+            time += count * delta
+        self.total_duration = time
 
     def entry(self, index):
-        return self._entries[index]
-
-    def unroll(self):
-        time = 0
-        self.array.append({'time' : 0, 'delta' : 0})
-        for entry in self._entries:
-            delta = entry['sample_delta']
-            for i in range(entry['sample_count']):
-                self.array.append({'time' : time, 'delta' : delta})
-                time = time + delta
+        return {'sample_count' : self.sample_counts[index], 'sample_delta' : self.sample_deltas[index]}
 
 
 class ctts_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_count' : i.send('>I')[0], 'sample_offset' : i.send('>I')[0]})
-
-        self.array = []
-        self.unroll()
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        table = read_uint32_array(self.fmap, self.offset+16, 2 * self.entry_count,
+                                  self.version and 'i' or 'I')
+        self.sample_counts = table[0::2]
+        self.sample_offsets = table[1::2]
+        self.first_samples = first_sample_numbers(self.sample_counts)
 
     def entry(self, index):
-        return self._entries[index]
-
-    def unroll(self):
-        self.array.append(0)
-        for entry in self._entries:
-            offset = entry['sample_offset']
-            for i in range(entry['sample_count']):
-                self.array.append(offset)
+        return {'sample_count' : self.sample_counts[index], 'sample_offset' : self.sample_offsets[index]}
 
 
 class stss_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
-        self._entries = []
-        for j in range(self.entry_count):
-            self._entries.append({'sample_number' : i.send('>I')[0]})
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
+        self.sample_numbers = read_uint32_array(self.fmap, self.offset+16, self.entry_count)
 
     def entry(self, index):
-        return self._entries[index]
+        return {'sample_number' : self.sample_numbers[index]}
+
     def has_index(self, index):
-        for i in self._entries:
-            if i['sample_number'] == index:
-                return True
-        return False
+        i = bisect.bisect_left(self.sample_numbers, index)
+        return i < self.entry_count and self.sample_numbers[i] == index
 
 
 class stsz_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.sample_size = i.send('>I')[0]
-        self.sample_count = i.send('>I')[0]
+        self.sample_size, self.sample_count = struct.unpack_from('>II', self.fmap, self.offset+12)
         self.decoration = 'sample_size=' + str(self.sample_size) + ' sample_count=' + str(self.sample_count)
-        self._entries = []
         if self.sample_size == 0:
-            for j in range(self.sample_count):
-                self._entries.append({'entry_size' : i.send('>I')[0]})
+            self.entry_sizes = read_uint32_array(self.fmap, self.offset+20, self.sample_count)
+        else:
+            self.entry_sizes = array.array('I')
 
     def entry(self, index):
-        return self._entries[index]
+        return {'entry_size' : self.entry_sizes[index]}
 
 
 class stsc_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.decoration = 'entry_count=' + str(self.entry_count)
-        self._entries = []
+        table = read_uint32_array(self.fmap, self.offset+16, 3 * self.entry_count)
+        self.first_chunks = table[0::3]
+        self.samples_per_chunk = table[1::3]
+        self.sample_description_indexes = table[2::3]
+
+        # Number of the first sample in each run of chunks. The last run
+        # extends over all remaining chunks.
+        self.first_samples = []
+        sample_number = 1
         for j in range(self.entry_count):
-            self._entries.append({'first_chunk' : i.send('>I')[0], \
-                                  'samples_per_chunk' : i.send('>I')[0], \
-                                  'sample_description_index' : i.send('>I')[0]})
-
-        self.array = []
-        self.unroll()
+            self.first_samples.append(sample_number)
+            if j + 1 < self.entry_count:
+                sample_number += (self.first_chunks[j + 1] - self.first_chunks[j]) * self.samples_per_chunk[j]
 
     def entry(self, index):
-        return self._entries[index]
-
-    def unroll(self):
-        self.array.append([0, 0, 0])
-        last_chunk = 0
-        last_num_samples = 0
-        for entry in self._entries:
-            first_chunk = entry['first_chunk']
-            samples_per_chunk = entry['samples_per_chunk']
-            sample_description_index = entry['sample_description_index']
-
-            for i in range(last_chunk + 1, first_chunk):
-                for j in range(last_num_samples):
-                    self.array.append([i, j, last_num_samples])
-
-            for i in range(samples_per_chunk):
-                self.array.append([first_chunk, i, samples_per_chunk])
-
-            last_chunk = first_chunk
-            last_num_samples = samples_per_chunk
-
-        #print self.array
-
-    def get_unrolled(self, idx):
-        if idx < len(self.array):
-            return self.array[idx][0], self.array[idx][1]
-        else:
-            while True:
-                #print 'add chunk'
-                self.add_chunk()
-                #print self.array
-                if idx < len(self.array):
-                    return self.array[idx][0], self.array[idx][1]
-
-    def add_chunk(self):
-        last_chunk = self.array[-1][0]
-        num_samples = self.array[-1][2]
-        for i in range(num_samples):
-            self.array.append([last_chunk + 1, i, num_samples])
+        return {'first_chunk' : self.first_chunks[index], \
+                'samples_per_chunk' : self.samples_per_chunk[index], \
+                'sample_description_index' : self.sample_description_indexes[index]}
 
 
 class stco_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
-        i.next() # prime
-        self.entry_count = i.send('>I')[0]
+        self.entry_count = struct.unpack_from('>I', self.fmap, self.offset+12)[0]
         self.decoration = 'entry_count=' + str(self.entry_count)
-        self._entries = []
-        for j in range(self.entry_count):
-            val = i.send('>I')
-            self._entries.append({'chunk_offset' : val[0]})
+        self.chunk_offsets = read_uint32_array(self.fmap, self.offset+16, self.entry_count)
 
     def entry(self, index):
-        return self._entries[index]
+        return {'chunk_offset' : self.chunk_offsets[index]}
 
 
 class ftyp_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.major_brand = i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0]
@@ -1818,7 +2051,7 @@ class styp_box(box):
     def __init__(self, *args):
         box.__init__(self, *args)
 
-        i = parse_generator(self.fmap[self.offset+8:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+8, end=self.offset+self.size)
         i.next() # prime
 
         self.major_brand = i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0] + i.send('>c')[0]
@@ -1838,7 +2071,7 @@ class styp_box(box):
 class tfma_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.entry_count = i.send('>I')[0]
@@ -1872,9 +2105,12 @@ class tfad_box(box):
 
 
 class sidx_box(full_box):
+    __slots__ = ('reference_track_id', 'timescale', 'first_pres_time', 'first_offset', 'reserved',
+                 'reference_count', '_references')
+
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.reference_track_id = i.send('>I')[0]
@@ -1943,9 +2179,11 @@ class meta_box(box):
 
 
 class tfdt_box(full_box):
+    __slots__ = ('decode_time',)
+
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.decode_time = i.send(self.version and '>Q' or '>I')[0]
@@ -1958,7 +2196,7 @@ class tfdt_box(full_box):
 class afra_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         byte1 = i.send('>B')[0]
@@ -2024,7 +2262,7 @@ class afra_box(full_box):
 class asrt_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.quality_entry_count = i.send('>B')[0]
@@ -2067,7 +2305,7 @@ class asrt_box(full_box):
 class afrt_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.time_scale = i.send('>I')[0]
@@ -2135,7 +2373,7 @@ def read_string(parser):
 class abst_box(full_box):
     def __init__(self, *args):
         full_box.__init__(self, *args)
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
@@ -2232,10 +2470,24 @@ class abst_box(full_box):
         return msg
 
 class mdat_box(box):
+    __slots__ = ()
+
     def __init__(self, *args):
         box.__init__(self, *args)
         #print dump_hex(self.fmap[self.offset:self.offset + 200])
 
+    @property
+    def payload_offset(self):
+        if struct.unpack_from('>I', self.fmap, self.offset)[0] == 1:  # Extended size
+            return self.offset + 16
+        return self.offset + 8
+
+    @property
+    def payload(self):
+        "Read-only view of the media data, sharing memory with fmap."
+        payload_offset = self.payload_offset
+        return buffer(self.fmap, payload_offset, self.offset + self.size - payload_offset)
+
     def print_base_data_offset(self):
         trafs = self.find_all('.moof.traf')
         for b in trafs:
@@ -2488,7 +2740,7 @@ class sdtp_box(full_box):
         msg = 'samples:{0}'.format(samples)
         base_offset = self.offset + 12
         for i in range(samples):
-            v = struct.unpack('>B', self.fmap[base_offset+i:base_offset + 1 + i])[0]
+            v = struct.unpack_from('>B', self.fmap, base_offset+i)[0]
             is_lead = (v & 0xc0) >> 6
             depends_on = (v & 0x30) >> 4
             dependend_on = (v & 0x0c) >> 2
@@ -2508,7 +2760,7 @@ class emsg_box(full_box):
         full_box.__init__(self, *args)
         #print dump_hex(self.fmap[self.offset:self.offset+self.size])
 
-        i = parse_generator(self.fmap[self.offset+12:self.offset+self.size])
+        i = parse_generator(self.fmap, offset=self.offset+12, end=self.offset+self.size)
         i.next() # prime
 
         self.scheme_id_uri = read_string(i)
@@ -2539,6 +2791,13 @@ for key in keys:
         #print 'adding: ', k
         REGISTERED_BOXES[key] = globals()[key]
 
+for key, box_class in REGISTERED_BOXES.items():
+    if isinstance(box_class, type) and issubclass(box_class, box) and len(key) == 8:
+        BOX_CLASSES[key[:4]] = box_class
+        BOX_CLASSES[key[:4].replace('_', ' ')] = box_class
+for raw_type, box_type in BOX_TYPE_NAMES.items():
+    BOX_CLASSES[raw_type] = REGISTERED_BOXES['%s_box' % box_type]
+
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+
+"""
+Parallel analysis of many MP4 media segments.
+
+Parses a directory tree (or list) of segments, typically $Number$-named
+files fetched by livedownloader, with a pool of worker processes.
+Each worker returns one compact FragmentSummary per traf instead of the
+box tree, so memory does not grow with the number of segments. The
+summaries are merged per track into a Timeline that reports gaps and
+overlaps in the tfdt sequence.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import sys
+import struct
+import multiprocessing
+from argparse import ArgumentParser
+from collections import namedtuple, defaultdict
+
+import mp4
+
+SAMPLE_IS_NON_SYNC = 0x00010000
+SEGMENT_EXTENSIONS = ('.m4s', '.mp4', '.m4v', '.m4a', '.cmfv', '.cmfa', '.cmft')
+NUMBER_PATTERN = re.compile(r'(\d+)\D*$')
+
+TRAF_PATH = mp4.compile_path('traf')
+TFHD_PATH = mp4.compile_path('tfhd')
+TFDT_PATH = mp4.compile_path('tfdt')
+TRUN_PATH = mp4.compile_path('trun')
+TREX_PATH = mp4.compile_path('moov.mvex.trex')
+
+FragmentSummary = namedtuple('FragmentSummary',
+                             'path moof_offset track_id sequence_number tfdt sample_count '
+                             'duration moof_size mdat_size data_size sap_count '
+                             'starts_with_sap')
+
+
+def sample_flags(trun, tfhd, default_flags=None):
+    """Return the flags of all samples in a trun as a list.
+
+    Falls back to first_sample_flags, the tfhd default flags and then
+    default_flags, those of the trex in the init segment. Flags that are
+    not known are None."""
+    if trun.has_sample_flags:
+        if mp4.np is not None:
+            flags = trun.samples['flags'].tolist()
+        else:
+            flags = [trun.sample_entry(i)['flags'] for i in xrange(trun.sample_count)]
+            flags = [int(f, 16) for f in flags]
+    elif tfhd.has_default_sample_flags:
+        flags = [tfhd.default_sample_flags] * trun.sample_count
+    else:
+        flags = [default_flags] * trun.sample_count
+    if trun.has_first_sample_flags and flags:
+        flags[0] = trun.first_sample_flags
+    return flags
+
+
+def trun_data_size(trun, tfhd):
+    "Return the number of media bytes referenced by a trun."
+    if trun.has_sample_size:
+        if mp4.np is not None:
+            return int(trun.samples['size'].sum())
+        return sum(trun.sample_entry(i)['size'] for i in xrange(trun.sample_count))
+    return tfhd.default_sample_size * trun.sample_count
+
+
+def read_trex_flags(init_paths):
+    "Return a dict with the trex default sample flags per track ID of init segments."
+    trex_flags = {}
+    for path in init_paths:
+        for trex in TREX_PATH.find(mp4.open(path), False):
+            trex_flags[trex.track_id] = trex.default_sample_flags
+    return trex_flags
+
+
+def summarize_moof(path, moof, trex_flags=None):
+    """Return a list of FragmentSummary, one per traf in moof.
+
+    trex_flags maps track IDs to the default sample flags of the init
+    segment. Without them, sap_count and starts_with_sap are None when the
+    sample flags are not in the fragment itself."""
+    mdat = moof.get_mdat()
+    mdat_size = mdat and mdat.size or 0
+    sequence_number = moof.find('mfhd').seqno
+    summaries = []
+    for traf in TRAF_PATH.find(moof, False):
+        tfhd = TFHD_PATH.find(traf, True)
+        tfdt = TFDT_PATH.find(traf, True)
+        sample_count = 0
+        duration = 0
+        data_size = 0
+        flags = []
+        for trun in TRUN_PATH.find(traf, False):
+            sample_count += trun.sample_count
+            duration += trun.total_duration
+            data_size += trun_data_size(trun, tfhd)
+            flags.extend(sample_flags(trun, tfhd, (trex_flags or {}).get(tfhd.track_id)))
+        sync_flags = [None if f is None else not (f & SAMPLE_IS_NON_SYNC) for f in flags]
+        sap_count = None if None in sync_flags else sum(sync_flags)
+        summaries.append(FragmentSummary(
+            path, moof.offset, tfhd.track_id, sequence_number,
+            tfdt and tfdt.decode_time or 0, sample_count, duration,
+            moof.size, mdat_size, data_size, sap_count,
+            sync_flags[0] if sync_flags else False))
+    return summaries
+
+
+def summarize_segment(path, trex_flags=None):
+    """Return FragmentSummary list for all moof boxes in the file at path.
+
+    The trex default flags of a moov in the file take precedence over
+    trex_flags."""
+    root = mp4.open(path, lazy=True)
+    summaries = []
+    for top_box in root.children:
+        if top_box.type == 'moov':
+            trex_flags = dict(trex_flags or {})
+            for trex in TREX_PATH.find(root, False):
+                trex_flags[trex.track_id] = trex.default_sample_flags
+        elif top_box.type == 'moof':
+            summaries.extend(summarize_moof(path, top_box, trex_flags))
+    return summaries
+
+
+def _summarize_worker(args):
+    "Pool worker. Return (path, summaries, error) so one bad file does not stop the run."
+    path, trex_flags = args
+    try:
+        return path, summarize_segment(path, trex_flags), None
+    except (IOError, ValueError, struct.error, AttributeError) as e:
+        return path, [], '%s: %s' % (e.__class__.__name__, e)
+
+
+def segment_number(path):
+    "Return the $Number$ part of a segment file name, or -1 if there is none."
+    match = NUMBER_PATTERN.search(os.path.splitext(os.path.basename(path))[0])
+    if match is None:
+        return -1
+    return int(match.group(1))
+
+
+def find_segments(paths):
+    """Expand files and directories into a sorted list of segment files.
+
+    Directories are walked recursively and files are ordered by directory
+    and then by segment number."""
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    if os.path.splitext(filename)[1].lower() in SEGMENT_EXTENSIONS:
+                        segments.append(os.path.join(dirpath, filename))
+        else:
+            segments.append(path)
+    segments.sort(key=lambda p: (os.path.dirname(p), segment_number(p), p))
+    return segments
+
+
+def summarize_segments(paths, processes=None, chunksize=8, trex_flags=None):
+    """Generate (path, summaries, error) for every segment path.
+
+    The files are parsed by a pool of processes (one per core by default)
+    and results are yielded as soon as they are ready, in completion order.
+    Only the summaries cross the process boundary. With processes=1 the
+    parsing is done in the calling process. trex_flags are the default
+    sample flags per track ID, see read_trex_flags."""
+    tasks = [(path, trex_flags) for path in paths]
+    if processes == 1:
+        for task in tasks:
+            yield _summarize_worker(task)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(_summarize_worker, tasks, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class Timeline(object):
+    """Per-track timeline merged from FragmentSummary entries.
+
+    Entries may be added in any order. Only the compact summaries are kept."""
+
+    def __init__(self):
+        self.tracks = defaultdict(list)
+        self.errors = []
+
+    def add(self, summary):
+        self.tracks[summary.track_id].append(summary)
+
+    def add_result(self, result):
+        "Add a (path, summaries, error) tuple from summarize_segments."
+        path, summaries, error = result
+        if error is not None:
+            self.errors.append((path, error))
+        for summary in summaries:
+            self.add(summary)
+
+    def fragments(self, track_id):
+        "Return the fragments of a track sorted by tfdt."
+        fragments = self.tracks[track_id]
+        fragments.sort(key=lambda s: (s.tfdt, s.sequence_number))
+        return fragments
+
+    def discontinuities(self, track_id):
+        """Return (previous, current, delta) for every place where a fragment
+        does not start where the previous one ended.
+
+        A positive delta is a gap and a negative one an overlap."""
+        result = []
+        previous = None
+        for current in self.fragments(track_id):
+            if previous is not None:
+                delta = current.tfdt - (previous.tfdt + previous.duration)
+                if delta != 0:
+                    result.append((previous, current, delta))
+            previous = current
+        return result
+
+    def track_totals(self, track_id):
+        "Return a dict with aggregate values for a track."
+        fragments = self.fragments(track_id)
+        first = fragments[0]
+        last = fragments[-1]
+        return {'fragments': len(fragments),
+                'samples': sum(s.sample_count for s in fragments),
+                'bytes': sum(s.data_size for s in fragments),
+                'start': first.tfdt,
+                'end': last.tfdt + last.duration,
+                'non_sap_starts': sum(1 for s in fragments if s.starts_with_sap is False),
+                'unknown_sap_starts': sum(1 for s in fragments if s.starts_with_sap is None)}
+
+    def report(self, output=sys.stdout):
+        for track_id in sorted(self.tracks):
+            totals = self.track_totals(track_id)
+            output.write('track %d: %d fragments, %d samples, %d bytes, time %d-%d, '
+                         '%d fragments not starting with SAP\n' %
+                         (track_id, totals['fragments'], totals['samples'], totals['bytes'],
+                          totals['start'], totals['end'], totals['non_sap_starts']))
+            if totals['unknown_sap_starts']:
+                output.write('  %d fragments with unknown sample flags, use --init\n' %
+                             totals['unknown_sap_starts'])
+            for previous, current, delta in self.discontinuities(track_id):
+                kind = delta > 0 and 'gap' or 'overlap'
+                output.write('  %s of %d between %s (tfdt=%d) and %s (tfdt=%d)\n' %
+                             (kind, abs(delta), previous.path, previous.tfdt,
+                              current.path, current.tfdt))
+        for path, error in self.errors:
+            output.write('ERROR %s: %s\n' % (path, error))
+
+
+def main():
+    parser = ArgumentParser(usage='usage: %(prog)s [options] path [path ...]')
+    parser.add_argument('paths', nargs='+', help='segment files or directories')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    parser.add_argument('-i', '--init', action='append', default=[],
+                        help='init segment with the trex default sample flags (repeatable)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='print a line per fragment as results arrive')
+    args = parser.parse_args()
+
+    timeline = Timeline()
+    trex_flags = read_trex_flags(args.init)
+    for result in summarize_segments(find_segments(args.paths), args.processes,
+                                     trex_flags=trex_flags):
+        if args.verbose:
+            for summary in result[1]:
+                print '%s track:%d seq:%d tfdt:%d samples:%d dur:%d size:%d sap:%s' % \
+                    (summary.path, summary.track_id, summary.sequence_number, summary.tfdt,
+                     summary.sample_count, summary.duration, summary.data_size,
+                     '?' if summary.sap_count is None else summary.sap_count)
+        timeline.add_result(result)
+    timeline.report()
+    if timeline.errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -44,9 +44,11 @@ import mp4
 
 def fetch(url, key=None):
     if not url.startswith('http'):
-        data = open(url, 'rb').read()
-        print 'read data of length: {0}'.format(len(data))
+        root = mp4.open(url, key=key)
+        print 'read data of length: {0}'.format(root.size)
         print '--'
+        print root.description()
+        return
     else:
         url_parts = urlparse.urlparse(url)
         conn = httplib.HTTPConnection(url_parts.netloc)
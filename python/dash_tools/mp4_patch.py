@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""Patch fixed-width fields of MP4 files in place.
+
+Changing tfdt decode times, sequence numbers, track IDs, sample flags or
+brands does not change any box size. InPlacePatcher memory-maps the file
+read-write, finds the boxes through the box index and writes only the
+bytes that change. Instead of a full backup copy, the original bytes can
+be saved in a PatchJournal (see backup_handler and restore_from_bup).
+If an error leaves the with block, all changes are written back.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import struct
+import sys
+from argparse import ArgumentParser
+
+import mp4
+from backup_handler import PatchJournal, make_backup, BackupError
+
+NON_SYNC_SAMPLE_FLAG = 0x10000
+INDEPENDENT_SAMPLE_FLAGS = 0x2000000  # sample_depends_on = 2
+
+
+class InPlacePatcher(object):
+    "Write changed fixed-width fields directly into a memory-mapped file."
+
+    def __init__(self, file_name, journal=False):
+        self.file_name = file_name
+        self.root = mp4.open(file_name, lazy=True, writable=True)
+        if not self.root.size:
+            raise ValueError("Cannot patch empty file %s" % file_name)
+        self.fmap = self.root.fmap
+        self.journal = None
+        if journal:
+            try:
+                self.journal = PatchJournal(file_name)
+            except BackupError:
+                self.fmap.close()
+                raise
+        self.index = self.root.build_index()
+        self.undo = []
+        self.nr_bytes_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.rollback()
+        self.close()
+
+    def boxes(self, box_type):
+        "Return all boxes of box_type in file order."
+        return self.index.get(box_type, [])
+
+    def patch(self, offset, fmt, *values):
+        "Write values packed with fmt at offset if they differ. Return True if written."
+        new_data = struct.pack(fmt, *values)
+        end = offset + len(new_data)
+        old_data = self.fmap[offset:end]
+        if old_data == new_data:
+            return False
+        if self.journal is not None:
+            self.journal.record(offset, old_data)
+        self.undo.append((offset, old_data))
+        self.fmap[offset:end] = new_data
+        self.nr_bytes_written += len(new_data)
+        return True
+
+    def shift_tfdt(self, offset):
+        """Add offset to the baseMediaDecodeTime of all tfdt boxes.
+
+        Raise ValueError if a version 0 tfdt would overflow 32 bits, since
+        the box would have to grow."""
+        changes = []
+        for tfdt in self.boxes('tfdt'):
+            decode_time = tfdt.decode_time + offset
+            if decode_time < 0:
+                raise ValueError("Negative tfdt %d at offset %d" % (decode_time, tfdt.offset))
+            if tfdt.version == 0 and decode_time > 0xffffffff:
+                raise ValueError("tfdt %d does not fit version 0 tfdt at offset %d" %
+                                 (decode_time, tfdt.offset))
+            changes.append((tfdt.offset + 12, tfdt.version and '>Q' or '>I', decode_time))
+        # All values are checked before anything is written
+        for pos, fmt, decode_time in changes:
+            self.patch(pos, fmt, decode_time)
+
+    def set_sequence_number(self, seq_nr):
+        "Set the sequence number in all mfhd boxes."
+        for mfhd in self.boxes('mfhd'):
+            self.patch(mfhd.offset + 12, '>I', seq_nr)
+
+    def set_track_id(self, track_id):
+        "Set the track ID in tkhd, trex and tfhd boxes."
+        for tkhd in self.boxes('tkhd'):
+            self.patch(tkhd.offset + (tkhd.version and 28 or 20), '>I', track_id)
+        for trex in self.boxes('trex'):
+            self.patch(trex.offset + 12, '>I', track_id)
+        for tfhd in self.boxes('tfhd'):
+            self.patch(tfhd.offset + 12, '>I', track_id)
+
+    def fix_sync_sample_flags(self):
+        """Set the non-sync flag on samples that depend on other samples.
+
+        Same rule as fix_sync_sample_flags.TrunFilter."""
+        for trun in self.boxes('trun'):
+            if not trun.has_sample_flags:
+                continue
+            flags_offset = (trun.offset + trun.sample_array_offset +
+                            (trun.has_sample_duration and 4) + (trun.has_sample_size and 4))
+            if mp4.np is not None:
+                flags = trun.samples['flags']
+                to_change = mp4.np.nonzero((flags != INDEPENDENT_SAMPLE_FLAGS) &
+                                           (flags & NON_SYNC_SAMPLE_FLAG == 0))[0]
+                for i in to_change.tolist():
+                    self.patch(flags_offset + i * trun.sample_row_size, '>I',
+                               int(flags[i]) | NON_SYNC_SAMPLE_FLAG)
+            else:
+                for i in xrange(trun.sample_count):
+                    pos = flags_offset + i * trun.sample_row_size
+                    sample_flags = struct.unpack_from('>I', self.fmap, pos)[0]
+                    if sample_flags != INDEPENDENT_SAMPLE_FLAGS:
+                        self.patch(pos, '>I', sample_flags | NON_SYNC_SAMPLE_FLAG)
+
+    def set_brands(self, major_brand=None, compatibility_brands=None, minor_version=None):
+        """Change brands in ftyp and styp boxes.
+
+        The number of compatibility brands must stay the same, and every
+        brand must be 4 bytes."""
+        brands = list(compatibility_brands or [])
+        if major_brand is not None:
+            brands.append(major_brand)
+        for brand in brands:
+            if len(brand) != 4:
+                raise ValueError("Brand %r is not 4 bytes" % brand)
+        changes = []
+        for brand_box in self.boxes('ftyp') + self.boxes('styp'):
+            if major_brand is not None:
+                changes.append((brand_box.offset + 8, '4s', major_brand))
+            if minor_version is not None:
+                changes.append((brand_box.offset + 12, '>I', minor_version))
+            if compatibility_brands is not None:
+                nr_brands = (brand_box.size - 16) // 4
+                if len(compatibility_brands) != nr_brands:
+                    raise ValueError("%s has %d compatibility brands, cannot write %d in place" %
+                                     (brand_box.type, nr_brands, len(compatibility_brands)))
+                changes.append((brand_box.offset + 16, '%ds' % (4 * nr_brands),
+                                ''.join(compatibility_brands)))
+        # All boxes are checked before anything is written
+        for pos, fmt, value in changes:
+            self.patch(pos, fmt, value)
+
+    def rollback(self):
+        "Write back the original bytes of all changes made so far."
+        for offset, old_data in reversed(self.undo):
+            self.fmap[offset:offset + len(old_data)] = old_data
+        self.undo = []
+        self.nr_bytes_written = 0
+        if self.journal is not None:
+            self.journal.discard()
+            self.journal = None
+
+    def close(self):
+        "Flush the changes to disk and close the journal."
+        if self.journal is not None:
+            self.journal.close()
+        self.fmap.flush()
+        self.fmap.close()
+
+
+def brand_list(brands):
+    "Parse a comma-separated list of four-character brands."
+    brands = brands.split(',')
+    for brand in brands:
+        if len(brand) != 4:
+            raise ValueError("Brand '%s' is not four characters" % brand)
+    return brands
+
+
+def main():
+    "Command-line function."
+    parser = ArgumentParser(description="Patch fixed-width fields of MP4 files in place.")
+    parser.add_argument('--tfdt-offset', type=int, help='add offset to tfdt')
+    parser.add_argument('--seq-nr', type=int, help='set mfhd sequence number')
+    parser.add_argument('--track-id', type=int, help='set track ID')
+    parser.add_argument('--fix-sync-flags', action='store_true',
+                        help='set non-sync flag on dependent samples')
+    parser.add_argument('--major-brand', help='set major brand')
+    parser.add_argument('--minor-version', type=int, help='set minor version')
+    parser.add_argument('--brands', type=brand_list,
+                        help='comma-separated compatibility brands')
+    backup_group = parser.add_mutually_exclusive_group()
+    backup_group.add_argument('-j', '--journal', action='store_true',
+                              help='save the changed bytes in a _jrnl file')
+    backup_group.add_argument('-b', '--backup', action='store_true',
+                              help='copy the file to a _bup file first')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        if args.backup:
+            try:
+                make_backup(file_name)
+            except BackupError as err:
+                print("%s. Skipping file %s" % (err, file_name))
+                continue
+        try:
+            with InPlacePatcher(file_name, args.journal) as patcher:
+                if args.tfdt_offset is not None:
+                    patcher.shift_tfdt(args.tfdt_offset)
+                if args.seq_nr is not None:
+                    patcher.set_sequence_number(args.seq_nr)
+                if args.track_id is not None:
+                    patcher.set_track_id(args.track_id)
+                if args.fix_sync_flags:
+                    patcher.fix_sync_sample_flags()
+                if (args.major_brand is not None or args.brands is not None or
+                        args.minor_version is not None):
+                    patcher.set_brands(args.major_brand, args.brands, args.minor_version)
+                print("%s: %d bytes changed" % (file_name, patcher.nr_bytes_written))
+        except (ValueError, BackupError) as err:
+            print("%s: %s" % (file_name, err))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
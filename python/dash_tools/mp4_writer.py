@@ -0,0 +1,156 @@
+"""Serialize MP4 boxes into a single preallocated buffer.
+
+BoxWriter replaces building boxes by string concatenation. Data is packed
+into one bytearray that grows geometrically, and box sizes are written as
+placeholders and back-patched when the box is closed, so the size of a
+box does not have to be known before its children are written.
+
+    writer = BoxWriter()
+    with writer.box('moof'):
+        with writer.full_box('mfhd', 0, 0):
+            writer.uint32(sequence_nr)
+    data = writer.getvalue()
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+from contextlib import contextmanager
+from struct import pack_into, calcsize
+
+MAX_UINT32 = 0xffffffff
+
+
+class BoxWriter(object):
+    "Write boxes and fields into a growing bytearray."
+
+    def __init__(self, size_hint=1024):
+        self.buf = bytearray(max(size_hint, 64))
+        self.pos = 0
+
+    def __len__(self):
+        return self.pos
+
+    def tell(self):
+        "Return the current write position."
+        return self.pos
+
+    def _reserve(self, nr_bytes):
+        "Make room for nr_bytes more and return the start position."
+        start = self.pos
+        end = start + nr_bytes
+        if end > len(self.buf):
+            new_size = max(end, 2 * len(self.buf))
+            self.buf.extend(bytearray(new_size - len(self.buf)))
+        self.pos = end
+        return start
+
+    def write(self, data):
+        "Write a string, buffer or bytearray."
+        nr_bytes = len(data)
+        start = self._reserve(nr_bytes)
+        self.buf[start:start + nr_bytes] = data
+
+    def pack(self, fmt, *values):
+        "Write values packed with struct format fmt."
+        start = self._reserve(calcsize(fmt))
+        pack_into(fmt, self.buf, start, *values)
+
+    def uint8(self, value):
+        self.pack('>B', value)
+
+    def uint16(self, value):
+        self.pack('>H', value)
+
+    def uint32(self, value):
+        self.pack('>I', value)
+
+    def sint32(self, value):
+        self.pack('>i', value)
+
+    def uint64(self, value):
+        self.pack('>Q', value)
+
+    def zeros(self, nr_bytes):
+        "Write nr_bytes zero bytes."
+        start = self._reserve(nr_bytes)
+        self.buf[start:start + nr_bytes] = bytearray(nr_bytes)
+
+    def patch(self, pos, fmt, *values):
+        "Overwrite already written bytes at pos."
+        pack_into(fmt, self.buf, pos, *values)
+
+    def patch_uint32(self, pos, value):
+        self.patch(pos, '>I', value)
+
+    def begin_box(self, box_type):
+        "Write a box header with a placeholder size and return its position."
+        start = self._reserve(8)
+        pack_into('>I4s', self.buf, start, 0, box_type)
+        return start
+
+    def begin_full_box(self, box_type, version=0, flags=0):
+        "Write a full box header and return its position."
+        start = self.begin_box(box_type)
+        self.uint32((version << 24) | flags)
+        return start
+
+    def end_box(self, start):
+        "Back-patch the size of the box starting at start and return the size."
+        size = self.pos - start
+        if size > MAX_UINT32:
+            raise ValueError("Box of size %d does not fit 32-bit size field" % size)
+        pack_into('>I', self.buf, start, size)
+        return size
+
+    @contextmanager
+    def box(self, box_type):
+        "Context manager writing a box. Yields the start position."
+        start = self.begin_box(box_type)
+        yield start
+        self.end_box(start)
+
+    @contextmanager
+    def full_box(self, box_type, version=0, flags=0):
+        "Context manager writing a full box. Yields the start position."
+        start = self.begin_full_box(box_type, version, flags)
+        yield start
+        self.end_box(start)
+
+    def getbuffer(self):
+        "Return a read-only view of the written data without copying."
+        return buffer(self.buf, 0, self.pos)
+
+    def getvalue(self):
+        "Return the written data as a string."
+        return str(self.buf[:self.pos])
+
+    def write_to(self, fileobj):
+        "Write the data to a file object in one call."
+        fileobj.write(self.getbuffer())
@@ -32,8 +32,13 @@ The filter is streamlined for DASH or other content with one track per file.
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
-from structops import str_to_uint32, str_to_sint32, uint32_to_str, sint32_to_str
+import struct
+
+from structops import str_to_uint32, str_to_sint32, uint32_to_str
 from structops import str_to_uint64, uint64_to_str
+from mp4_writer import BoxWriter
+
+COPY_CHUNK_SIZE = 1024 * 1024
 
 
 def get_timescale(file_name=None, data=None):
@@ -43,10 +48,55 @@ def get_timescale(file_name=None, data=None):
     return init_filter.get_track_timescale()
 
 
+def read_box_header(fileobj):
+    """Read a top-level box header from fileobj.
+
+    Return (size, box_type, header) or None at end of file. A size of 0
+    (box extends to end of file) is returned as None."""
+    header = fileobj.read(8)
+    if not header:
+        return None
+    if len(header) < 8:
+        raise ValueError("Truncated box header at end of file")
+    size, box_type = struct.unpack('>I4s', header)
+    if size == 1:
+        large_size = fileobj.read(8)
+        if len(large_size) < 8:
+            raise ValueError("Truncated box header at end of file")
+        header += large_size
+        size = struct.unpack('>Q', large_size)[0]
+    elif size == 0:
+        size = None
+    elif size < 8:
+        raise ValueError("Box '%s' has faulty size %d" % (box_type, size))
+    return size, box_type, header
+
+
+def copy_data(in_fh, out_fh, nr_bytes, chunk_size=COPY_CHUNK_SIZE):
+    "Copy nr_bytes (or all remaining if None) in chunks. Return number copied."
+    copied = 0
+    while nr_bytes is None or copied < nr_bytes:
+        to_read = chunk_size
+        if nr_bytes is not None:
+            to_read = min(chunk_size, nr_bytes - copied)
+        chunk = in_fh.read(to_read)
+        if not chunk:
+            break
+        out_fh.write(chunk)
+        copied += len(chunk)
+    if nr_bytes is not None and copied < nr_bytes:
+        raise ValueError("Truncated box: missing %d bytes" % (nr_bytes - copied))
+    return copied
+
+
 class MP4Filter(object):
     """Base class for filters.
 
-    Call filter_top_boxes() to get a filtered version of the file."""
+    Call filter_top_boxes() to get a filtered version of the file, or
+    filter_file() to stream from one file to another. Several filters can
+    be run in one pass with FilterChain."""
+
+    streamable = True  # False if finalize() rewrites self.output
 
     def __init__(self, file_name=None, data=None):
         if file_name is not None:
@@ -67,21 +117,37 @@ class MP4Filter(object):
 
     def filter_top_boxes(self):
         "Top level box parsing. The lower-level parsing is done in self.filterbox(). "
-        self.output = ""
+        writer = BoxWriter(len(self.data))
         pos = 0
         while pos < len(self.data):
             size, box_type = self.check_box(self.data[pos:pos + 8])
             self.top_level_boxes.append((size, box_type))
-            box_data = self.data[pos:pos+size]
             if box_type in self.relevant_boxes:
-                self.output += self.filterbox(box_type, box_data,
-                                              len(self.output))
+                writer.write(self.filterbox(box_type, self.data[pos:pos+size],
+                                            writer.tell()))
             else:
-                self.output += box_data
+                writer.write(buffer(self.data, pos, size))
             pos += size
+        self.output = writer.getvalue()
         self.finalize()
         return self.output
 
+    def filter_container(self, data, file_pos, path):
+        """Filter all children of the container box in data with filterbox().
+
+        The box is returned with its size field updated to the filtered
+        children."""
+        writer = BoxWriter(len(data))
+        writer.write(data[:8])
+        pos = 8
+        while pos < len(data):
+            size, box_type = self.check_box(data[pos:pos + 8])
+            writer.write(self.filterbox(box_type, data[pos:pos+size],
+                                        file_pos + writer.tell(), path))
+            pos += size
+        writer.end_box(0)
+        return writer.getvalue()
+
     def filterbox(self, box_type, data, file_pos, path=""):
         "Filter box or tree of boxes recursively. Override in subclass."
         #pylint: disable=unused-argument,no-self-use
@@ -91,6 +157,73 @@ class MP4Filter(object):
         "Hook to do final adjustments."
         pass
 
+    def filter_file(self, input_path, output_path):
+        "Filter input_path to output_path in one streaming pass. Return output size."
+        return FilterChain([self]).filter_file(input_path, output_path)
+
+
+class FilterChain(object):
+    """Apply a chain of MP4Filter objects in a single pass.
+
+    Top-level boxes are read from a file handle one at a time. A box that
+    is relevant to any of the filters is read into memory and passed
+    through the filters in order; other boxes (typically mdat) are copied
+    in chunks. Each output box is written immediately, so memory use is
+    bounded by the largest filtered box and not by the file size.
+
+    The filters should be created without file_name and data. Filters
+    that are not streamable are rejected."""
+
+    def __init__(self, filters, chunk_size=COPY_CHUNK_SIZE):
+        for mp4_filter in filters:
+            if not mp4_filter.streamable:
+                raise ValueError("%s cannot be used in a streaming chain" %
+                                 mp4_filter.__class__.__name__)
+        self.filters = filters
+        self.chunk_size = chunk_size
+        self.relevant_boxes = set()
+        for mp4_filter in filters:
+            self.relevant_boxes.update(mp4_filter.relevant_boxes)
+
+    def filter_stream(self, in_fh, out_fh):
+        "Filter from in_fh to out_fh. Return number of bytes written."
+        out_pos = 0
+        while True:
+            box_header = read_box_header(in_fh)
+            if box_header is None:
+                break
+            size, box_type, header = box_header
+            for mp4_filter in self.filters:
+                mp4_filter.top_level_boxes.append((size, box_type))
+            if box_type not in self.relevant_boxes:
+                payload_size = None
+                if size is not None:
+                    payload_size = size - len(header)
+                out_fh.write(header)
+                out_pos += len(header) + copy_data(in_fh, out_fh, payload_size,
+                                                   self.chunk_size)
+                continue
+            if size is None:
+                data = header + in_fh.read()
+            else:
+                data = header + in_fh.read(size - len(header))
+                if len(data) < size:
+                    raise ValueError("Truncated box '%s'" % box_type)
+            for mp4_filter in self.filters:
+                if box_type in mp4_filter.relevant_boxes:
+                    data = mp4_filter.filterbox(box_type, data, out_pos)
+                    if not data:  # Box dropped
+                        break
+            out_fh.write(data)
+            out_pos += len(data)
+        return out_pos
+
+    def filter_file(self, input_path, output_path):
+        "Filter input_path to output_path. Return the output size."
+        with open(input_path, "rb") as in_fh:
+            with open(output_path, "wb") as out_fh:
+                return self.filter_stream(in_fh, out_fh)
+
 
 class InitFilter(MP4Filter):
     "Filter init file and extract track timescale."
@@ -109,12 +242,7 @@ class InitFilter(MP4Filter):
             path = "%s.%s" % (path, box_type)
         output = ""
         if path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moov.trak.mdia.mdhd": # Find timescale
             self.track_timescale = str_to_uint32(data[20:24])
             #print "Found track_timescale=%d" % self.track_timescale
@@ -152,12 +280,7 @@ class InitLiveFilter(MP4Filter):
             path = "%s.%s" % (path, box_type)
         output = ""
         if path in ("moov", "moov.trak", "moov.trak.mdia"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos + size], file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moov.mvhd": # Set movie duration
             version = ord(data[8])
             if version == 1:
@@ -226,12 +349,7 @@ class ShiftCompositionTimeOffset(MP4Filter):
             path = "%s.%s" % (path, box_type)
         output = ""
         if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.trun": # Down at trun level
             output = self.process_trun(data, output)
         else:
@@ -249,8 +367,6 @@ class ShiftCompositionTimeOffset(MP4Filter):
         if not cto_present:
             return data   # Nothing to do
 
-        output = data[:8] + '\x01' + data[9:12]  # Full header version 1
-
         sample_count = str_to_uint32(data[12:16])
         offset = 16
 
@@ -260,9 +376,6 @@ class ShiftCompositionTimeOffset(MP4Filter):
         if flags & 0x000004:  # first-sample-flags-present
             offset += 4
 
-        output += data[12:offset]
-        cto_shift = None
-
         optional_bytes_before_cto = 0
         if flags & 0x000100:  # sample-duration-present
             optional_bytes_before_cto += 4
@@ -270,19 +383,23 @@ class ShiftCompositionTimeOffset(MP4Filter):
             optional_bytes_before_cto += 4
         if flags & 0x000400:  # sample-flags-present
             optional_bytes_before_cto += 4
+        sample_row_size = optional_bytes_before_cto + 4
 
-        for i in range(sample_count):
-            output += data[offset:offset + optional_bytes_before_cto]
-            offset += optional_bytes_before_cto
+        # Copy the box and patch version and the cto fields in place
+        writer = BoxWriter(len(data))
+        writer.write(data[:offset + sample_count * sample_row_size])
+        writer.patch(8, '>B', 1)  # Full header version 1
 
+        cto_shift = None
+        offset += optional_bytes_before_cto
+        for i in range(sample_count):
             cto = str_to_sint32(data[offset:offset + 4])
             if i == 0:
                 cto_shift = -cto
-            cto += cto_shift
-            output += sint32_to_str(cto)
-            offset += 4
+            writer.patch(offset, '>i', cto + cto_shift)
+            offset += sample_row_size
 
-        return output
+        return writer.getvalue()
 
 
 class TfdtFilter(MP4Filter):
@@ -306,12 +423,7 @@ class TfdtFilter(MP4Filter):
             path = "%s.%s" % (path, box_type)
         output = ""
         if path in ("moof", "moof.traf"):
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size], file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.tfdt": # Down at tfdt level
             output = self.process_tfdt(data, output)
         elif path == "moof.mfhd": # Down at mfhd
@@ -332,12 +444,11 @@ class TfdtFilter(MP4Filter):
                 output += data[:12] + uint32_to_str(tfdt) + data[16:]
             else:
                 output += data
-        else:
-            output = data[:12]
+        else: # 64-bit baseMediaDecodeTime
             tfdt = str_to_uint64(data[12:20])
             if self.offset != None:
                 tfdt += self.offset
-                output += uint64_to_str(tfdt)
+                output += data[:12] + uint64_to_str(tfdt) + data[20:]
             else:
                 output += data
         self.tfdt = tfdt
@@ -354,3 +465,47 @@ class TfdtFilter(MP4Filter):
     def get_tfdt_value(self):
         "Return tfdt value."
         return self.tfdt
+
+
+def main():
+    "Run one or more filters over media segments in a single pass per file."
+    # pylint: disable=cyclic-import
+    from argparse import ArgumentParser
+    import os
+    from mediacleaner import MediaCleanFilter
+    from fix_sync_sample_flags import TrunFilter
+
+    parser = ArgumentParser(description="Filter media segments with a chain of "
+                                        "filters in one streaming pass.")
+    parser.add_argument('-o', '--outputdir', required=True)
+    parser.add_argument('--clean', action='store_true',
+                        help='drop skip, free and sidx boxes')
+    parser.add_argument('--track-id', type=int, help='set new trackID (implies --clean)')
+    parser.add_argument('--tfdt-offset', type=int, help='add offset to tfdt')
+    parser.add_argument('--seq-nr', type=int, help='set mfhd sequence number')
+    parser.add_argument('--fix-sync-flags', action='store_true',
+                        help='set non-sync flag on dependent samples')
+    parser.add_argument('--shift-cto', action='store_true',
+                        help='shift composition time offsets to start at 0')
+    parser.add_argument('infile', nargs='+')
+    args = parser.parse_args()
+
+    for filepath in args.infile:
+        filters = []
+        if args.clean or args.track_id is not None:
+            filters.append(MediaCleanFilter(new_track_id=args.track_id))
+        if args.tfdt_offset is not None or args.seq_nr is not None:
+            filters.append(TfdtFilter(None, args.tfdt_offset, args.seq_nr))
+        if args.fix_sync_flags:
+            filters.append(TrunFilter(None))
+        if args.shift_cto:
+            filters.append(ShiftCompositionTimeOffset(None))
+        if not filters:
+            parser.error("No filter selected")
+        outpath = os.path.join(args.outputdir, os.path.basename(filepath))
+        size = FilterChain(filters).filter_file(filepath, outpath)
+        print('%s -> %s  %dB' % (filepath, outpath, size))
+
+
+if __name__ == "__main__":
+    main()
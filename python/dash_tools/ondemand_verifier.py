@@ -34,7 +34,7 @@ import xml.etree.ElementTree as ET
 from argparse import ArgumentParser
 from collections import defaultdict, namedtuple, Counter, OrderedDict
 
-from mp4 import mp4
+import mp4
 
 log = logging.getLogger('__name__')
 
@@ -51,6 +51,9 @@ TOTAL_DUR_DIFF_THRESHOLD = 0.3
 SEGMENT_DUR_DIFF_THRESHOLD = 0.05
 MAX_AVERAGE_DURATION_DIFF = 0.05
 
+TFDT_PATH = mp4.compile_path('traf.tfdt')
+TRUN_PATH = mp4.compile_path('traf.trun')
+
 
 def badness_string(badness):
     "Return badness string given value."
@@ -90,9 +93,9 @@ class MultipleTrunError(Exception):
 
 class CMAFTrack(object):
     "Check and possibly fix a CMAF track."
-    def __init__(self, name, data):
+    def __init__(self, name, path):
         self.name = name
-        self.root = mp4(data)
+        self.root = mp4.open(path, lazy=True)
         self.segment_data = self._find_subsegment_data(self.root)
         self.sidx_segment_data = self._get_sidx_segment_data(self.root)
 
@@ -112,9 +115,9 @@ class CMAFTrack(object):
             if segment:
                 segment['size'] += top_box.size
                 if top_box.type == 'moof':
-                    tfdt = top_box.find('traf.tfdt')
+                    tfdt = top_box.find(TFDT_PATH)
                     segment['decode_time'] = tfdt.decode_time
-                    truns = top_box.find_all('traf.trun')
+                    truns = top_box.find_all(TRUN_PATH)
                     if len(truns) != 1:
                         raise MultipleTrunError("Multiple trun boxes (%d) in "
                                                 "one segment is against "
@@ -287,11 +290,7 @@ def check_alignment(manifest_path, verbose):
         sidx_timescale = None
         for i, track_path in enumerate(track_group):
             name = os.path.basename(track_path)
-            try:
-                data = open(track_path, 'rb').read()
-            except IOError as e:
-                raise e
-            track = CMAFTrack(name, data)
+            track = CMAFTrack(name, track_path)
             segment_data = track.segment_data
             if i == 0:  # Take one segment timeline per group
                 tg_segment_data[name] = segment_data
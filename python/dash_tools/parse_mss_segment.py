@@ -72,10 +72,7 @@ def main():
     if len(sys.argv) == 3:
         key = binascii.unhexlify(sys.argv[2])
 
-    with open(segment_file, 'rb') as f:
-        segment = f.read()
-
-    root = mp4.mp4(segment)
+    root = mp4.open(segment_file)
     print root.description()
 
     # Parse some boxes
@@ -85,7 +82,9 @@ def main():
     trun = traf.find('trun')
     nr_samples = trun.sample_count
     sample_info = [trun.sample_entry(i) for i in range(nr_samples)]
-    sample_offset = moof.offset + trun.data_offset
+    mdat = moof.get_mdat()
+    payload = mdat.payload
+    sample_offset = moof.offset + trun.data_offset - mdat.payload_offset
     
     # Get IVs
     ivs = []
@@ -103,7 +102,7 @@ def main():
     cnt = 0
     for sample in sample_info:
         size = sample['size']
-        sample_data = segment[sample_offset:sample_offset + size]
+        sample_data = payload[sample_offset:sample_offset + size]
         
         # Decrypt if encrytped
         if ivs:
@@ -31,87 +31,56 @@ Utility file to handle sample table boxes in MP4 files
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import bisect
+
 import mp4
 
+
 def sample_to_chunk_and_index(stsc, idx):
-    #print 'idx=', idx
-    if stsc.array:
-        result = stsc.get_unrolled(idx)
-        #print result[0], result[1]
-        return result
-    
-    delta = 0
-    start_sample = 1
-    count = 0
-    for j in range(stsc.entry_count - 1):
-        if j + 1 == stsc.entry_count:
-            delta = 0
-            break
-        else:
-            delta = (stsc.entry(j + 1)['first_chunk'] - stsc.entry(j)['first_chunk']) * stsc.entry(j)['samples_per_chunk']
-        if idx >= start_sample and idx < start_sample + delta:
-            break
-        else:
-            start_sample += delta
-        count += 1
-    
-    chunk = stsc.entry(count)['first_chunk'] + (idx - start_sample) / stsc.entry(count)['samples_per_chunk']
-    index = (idx - start_sample) % stsc.entry(count)['samples_per_chunk']
-    #print chunk, index
+    "Return the chunk of 1-based sample idx and its 0-based index in the chunk."
+    entry = bisect.bisect_right(stsc.first_samples, idx) - 1
+    if entry < 0:
+        return 0, 0
+    samples_per_chunk = stsc.samples_per_chunk[entry]
+    delta = idx - stsc.first_samples[entry]
+    chunk = stsc.first_chunks[entry] + delta / samples_per_chunk
+    index = delta % samples_per_chunk
     return chunk, index
-    
+
 def chunk_offset(stco, chunk):
     if 0 == chunk or stco.entry_count < chunk:
         return 0
-    return stco.entry(chunk - 1)['chunk_offset']
+    return stco.chunk_offsets[chunk - 1]
 
 def sample_size(stsz, idx):
     if stsz.sample_size:
         return stsz.sample_size
     elif idx and idx <= stsz.sample_count:
-        return stsz.entry(idx - 1)['entry_size']
+        return stsz.entry_sizes[idx - 1]
     return 0
 
 def sample_time(stts, idx):
-    if stts.array:
-        return stts.array[idx]['time'], stts.array[idx]['delta']
-    
-    time = 0
-    duration = 0
-    last_sample = 0
-    for i in range(stts.entry_count):
-        duration = stts.entry(i)['sample_delta']
-        if idx <= last_sample + stts.entry(i)['sample_count']: 
-            time += (idx - last_sample - 1) * duration
-            last_sample += stts.entry(i)['sample_count']
-            return time, duration
-        else:
-            time += stts.entry(i)['sample_count'] * duration
-            last_sample += stts.entry(i)['sample_count']
-    return 0, 0
+    "Return decode time and duration of 1-based sample idx."
+    entry = bisect.bisect_right(stts.first_samples, idx) - 1
+    if entry < 0 or idx >= stts.first_samples[entry] + stts.sample_counts[entry]:
+        return 0, 0
+    delta = stts.sample_deltas[entry]
+    return stts.first_times[entry] + (idx - stts.first_samples[entry]) * delta, delta
 
 def sample_offset(ctts, idx):
+    "Return composition time offset of 1-based sample idx."
     if not ctts:
         return 0
-    if ctts.array:
-        return ctts.array[idx]
-    
-    offset = 0
-    last_sample = 0
-    for i in range(ctts.entry_count):
-        offset = ctts.entry(i)['sample_offset']
-        if idx <= last_sample + ctts.entry(i)['sample_count']: 
-            last_sample += ctts.entry(i)['sample_count']
-            return offset
-        else:
-            last_sample += ctts.entry(i)['sample_count']
-    return 0
+    entry = bisect.bisect_right(ctts.first_samples, idx) - 1
+    if entry < 0 or idx >= ctts.first_samples[entry] + ctts.sample_counts[entry]:
+        return 0
+    return ctts.sample_offsets[entry]
 
 def offset_from_sample(stbl, idx):
     chunk, index = sample_to_chunk_and_index(stbl.find('stsc'), idx)
     offset = chunk_offset(stbl.find('stco'), chunk)
+    stsz = stbl.find('stsz')
+    if stsz.sample_size:
+        return offset + index * stsz.sample_size
     #print 'chunk:', chunk, 'index:', index, 'offset:', offset
-    for i in range(idx - index, idx):
-        d = sample_size(stbl.find('stsz'), i)
-        offset += d
-    return offset
+    return offset + sum(stsz.entry_sizes[idx - index - 1:idx - 1])
@@ -31,33 +31,38 @@
 #  POSSIBILITY OF SUCH DAMAGE.
 
 import os
-import shutil
+import sys
+import filecmp
 from argparse import ArgumentParser
 
 from mp4filter import ShiftCompositionTimeOffset
-from backup_handler import make_backup, BackupError
+from backup_handler import make_backup, BackupError, BACKUP_FILE_SUFFIX
+
+TMP_FILE_SUFFIX = '_tmp'
 
 
 def process_files(files):
     for f in files:
-        f_backup = f + '_bup'
+        f_backup = f + BACKUP_FILE_SUFFIX
         if os.path.exists(f_backup):
             print("%s already exists, will not process %s" %
                   (f_backup, f))
             continue
-        sto = ShiftCompositionTimeOffset(f)
-        output = sto.filter_top_boxes()
-        input = open(f, 'rb').read()
-        if output != input:
-            assert len(output) == len(input)
-            print("Change in file %s. Make backup %s" % (f, f_backup))
-            try:
-                make_backup(f)
-            except BackupError:
-                print("Cannot make backup for %s. Skipping it" % f)
-                return
-            with open(f, 'wb') as ofh:
-                ofh.write(output)
+        f_tmp = f + TMP_FILE_SUFFIX
+        sto = ShiftCompositionTimeOffset(None)
+        size = sto.filter_file(f, f_tmp)
+        if filecmp.cmp(f, f_tmp, shallow=False):
+            os.remove(f_tmp)
+            continue
+        assert size == os.path.getsize(f)
+        print("Change in file %s. Make backup %s" % (f, f_backup))
+        try:
+            make_backup(f)
+        except BackupError:
+            print("Cannot make backup for %s. Skipping it" % f)
+            os.remove(f_tmp)
+            return
+        os.rename(f_tmp, f)
 
 
 def main():
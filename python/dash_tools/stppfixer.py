@@ -56,6 +56,8 @@ class STPPFixerFilter(MP4Filter):
     """Process a media segment file. Drop skip, free, and sidx boxes on top level.
     """
 
+    streamable = False  # finalize() patches the output
+
     def __init__(self, file_name=None, data=None, new_track_id=None, new_default_sample_duration=None):
         MP4Filter.__init__(self, file_name, data)
         self.new_track_id = new_track_id
@@ -74,7 +76,7 @@ class STPPFixerFilter(MP4Filter):
         if path in ("skip", "free", "sidx"):
             print "Removing %s box" % box_type # Just let output="" to drop these boxes
         elif path in self.composite_boxes:
-            output = self.process_composite_box(path, data)
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.tfhd": # Set movie duration
             output = self.process_tfhd(data)
         elif path == "moof.traf.trun": # Set sample count and offset
@@ -85,20 +87,6 @@ class STPPFixerFilter(MP4Filter):
             output = data
         return output
 
-    def process_composite_box(self, path, data):
-        "Process composite boxes."
-        container_size, container_box_type = self.check_box(data[0:8])
-        inner_data = ""
-        pos = 8
-        while pos < len(data):
-            size, box_type = self.check_box(data[pos:pos + 8])
-            inner_data += self.filterbox(box_type, data[pos:pos+size], None, path)
-            #print "Box:",box_type,", size:",size,", newsize:",len(inner_data)
-            pos += size
-        new_container_size = 8 + len(inner_data)
-        #TODO. If this has changed, make sure that offsets are changes appropriately
-        return uint32_to_str(new_container_size) + container_box_type + inner_data
-
     def process_tfhd(self, data):
         "Process the mvhd box and set timescale."
         tf_flags = str_to_uint32(data[8:12]) & 0xffffff
@@ -0,0 +1,68 @@
+"""
+Benchmark of the mp4 box parser.
+
+Parses the test segments repeatedly and prints boxes parsed per second.
+Run from the dash_tools directory: python test/benchmark_mp4.py [rounds]
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+
+import test_utils
+import mp4
+
+SEGMENTS = ['audio_init.mp4', 'audio_segment.m4s', 'video_init.mp4', 'video_segment.m4s']
+
+
+def count_boxes(box):
+    return 1 + sum(count_boxes(child) for child in box.children)
+
+
+def main():
+    rounds = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+    segments = []
+    for name in SEGMENTS:
+        with open(os.path.join(test_utils.TEST_PATH, 'data', name), 'rb') as f:
+            segments.append(f.read())
+
+    nr_boxes = sum(count_boxes(mp4.mp4(data)) - 1 for data in segments)
+    start = time.time()
+    for i in xrange(rounds):
+        for data in segments:
+            mp4.mp4(data)
+    elapsed = time.time() - start
+    print '%d boxes in %.3fs: %.0f boxes/s' % (nr_boxes * rounds, elapsed, nr_boxes * rounds / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark of the TS demultiplexer.
+
+Demultiplexes the muxed test segment repeated many times, once with the
+NumPy packet-array path and once packet by packet, and prints the
+throughput of each. PES packets are only collected, not decoded.
+The TS packet header parse is also timed with the bit reader against the
+bit-at-a-time reference reader from test_bitreader.
+Run from the dash_tools directory: python test/benchmark_ts.py [repeats]
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+
+import test_utils
+import ts
+from test_bitreader import reference_bitreader
+
+
+class pes_collector(ts.observer):
+    def __init__(self):
+        self.nr_pes = 0
+
+    def on_pmt(self, importer, pmt):
+        for stream in pmt.stream_list:
+            importer.observe_pid(stream.elementary_pid)
+
+    def on_pes(self, pid, pes):
+        self.nr_pes += 1
+
+
+def run(data, vectorized):
+    options = {'verbose': 0}
+    obs = pes_collector()
+    importer = ts.ts_importer(obs, options)
+    importer.preflight(data)
+    start = time.time()
+    if vectorized:
+        importer.add_data(data)
+    else:
+        importer._add_data_packets(data)
+    importer.flush()
+    return time.time() - start, importer.num_packets, obs.nr_pes
+
+
+def parse_headers(data, reader_class):
+    saved = ts.bitreader
+    ts.bitreader = reader_class
+    try:
+        start = time.time()
+        for i in xrange(0, len(data) - 187, 188):
+            ts.ts_packet(data[i:i + 188])
+        return time.time() - start
+    finally:
+        ts.bitreader = saved
+
+
+def main():
+    repeats = len(sys.argv) > 1 and int(sys.argv[1]) or 50
+    with open(os.path.join(test_utils.TEST_PATH, 'data', 'H1.ts'), 'rb') as f:
+        data = f.read() * repeats
+    for name, vectorized in (('packets', False), ('vectorized', True)):
+        if vectorized and ts.np is None:
+            print '%-10s: NumPy not available' % name
+            continue
+        elapsed, nr_packets, nr_pes = run(data, vectorized)
+        print '%-10s: %d packets, %d PES in %.3fs: %.0f packets/s, %.1f Mbit/s' % \
+            (name, nr_packets, nr_pes, elapsed, nr_packets / elapsed,
+             nr_packets * 188 * 8 / elapsed / 1e6)
+    nr_packets = len(data) // 188
+    for name, reader_class in (('reference', reference_bitreader), ('bitreader', ts.bitreader)):
+        elapsed = parse_headers(data, reader_class)
+        print '%-10s: %d packet headers in %.3fs: %.0f headers/s' % \
+            (name, nr_packets, elapsed, nr_packets / elapsed)
+
+
+if __name__ == '__main__':
+    main()
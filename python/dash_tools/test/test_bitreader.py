@@ -0,0 +1,159 @@
+"""
+Test the TS bit reader against a bit-by-bit reference reader
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import random
+import struct
+import sys
+import unittest
+
+import test_utils
+import ts
+
+
+class reference_bitreader(object):
+    "The original bit-at-a-time reader, kept as a reference and benchmark baseline."
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.bit_pos = 7
+        self.byte = struct.unpack("B", self.buffer[0])[0]
+        self.index = 1
+
+    def get_bits(self, num_bits):
+        num = 0
+        mask = 1 << self.bit_pos
+        while num_bits:
+            num_bits -= 1
+            num <<= 1
+            if self.byte & mask:
+                num |= 1
+            mask >>= 1
+            self.bit_pos -= 1
+            if self.bit_pos < 0:
+                self.bit_pos = 7
+                mask = 1 << self.bit_pos
+                if self.index < len(self.buffer):
+                    self.byte = struct.unpack("B", self.buffer[self.index])[0]
+                else:
+                    self.byte = 0
+                self.index += 1
+        return num
+
+    def step_bytes(self, bytes):
+        data = self.buffer[self.index - 1: self.index - 1 + bytes]
+        for i in range(bytes):
+            self.get_bits(8)
+        return data
+
+    def tell(self):
+        return self.index
+
+
+def reference_ue(reader):
+    leading_zero_bits = -1
+    b = 0
+    while not b:
+        leading_zero_bits += 1
+        b = reader.get_bits(1)
+    return 2**leading_zero_bits - 1 + reader.get_bits(leading_zero_bits)
+
+
+def random_data(rnd, size):
+    return ''.join(chr(rnd.randint(0, 255)) for _ in xrange(size))
+
+
+class TestBitReader(unittest.TestCase):
+
+    def test_get_bits(self):
+        rnd = random.Random(1)
+        for _ in xrange(50):
+            data = random_data(rnd, rnd.randint(1, 40))
+            new = ts.bitreader(data)
+            ref = reference_bitreader(data)
+            while ref.tell() <= len(data) + 2:
+                num_bits = rnd.choice((1, 2, 3, 4, 5, 7, 8, 12, 13, 16, 24, 32, 33, 64, 70))
+                self.assertEquals(new.get_bits(num_bits), ref.get_bits(num_bits))
+                self.assertEquals(new.index, ref.index)
+                self.assertEquals(new.tell(), ref.tell())
+
+    def test_aligned_reads(self):
+        data = '\x47\x40\x11\x10\x00\x02\xb0\x0d\xff'
+        reader = ts.bitreader(data)
+        self.assertEquals(reader.read_u8(), 0x47)
+        self.assertEquals(reader.read_u16(), 0x4011)
+        self.assertEquals(reader.get_bits(4), 1)
+        self.assertEquals(reader.read_u8(), 0x00)
+        reader.trim()
+        self.assertEquals(reader.tell(), 6)
+        self.assertEquals(reader.read_u32(), 0x02b00dff)
+        self.assertEquals(reader.read_u8(), 0)
+
+    def test_step_bytes(self):
+        rnd = random.Random(2)
+        data = random_data(rnd, 300)
+        new = ts.bitreader(data)
+        ref = reference_bitreader(data)
+        for num_bits, num_bytes in ((3, 5), (5, 100), (8, 0), (0, 150), (4, 60)):
+            self.assertEquals(new.get_bits(num_bits), ref.get_bits(num_bits))
+            self.assertEquals(new.step_bytes(num_bytes), ref.step_bytes(num_bytes))
+            self.assertEquals(new.tell(), ref.tell())
+
+    def test_exp_golomb(self):
+        rnd = random.Random(3)
+        values = [0, 1, 2, 3, 6, 7, 100, 65535, 2**31] + \
+                 [rnd.randint(0, 2**rnd.randint(1, 40)) for _ in xrange(200)]
+        bits = ''
+        for value in values:
+            code = bin(value + 1)[2:]
+            bits += '0' * (len(code) - 1) + code
+        bits += '1' + '0' * (-(len(bits) + 1) % 8)
+        data = ''.join(chr(int(bits[i:i + 8], 2)) for i in xrange(0, len(bits), 8))
+        new = ts.bitreader(data)
+        ref = reference_bitreader(data)
+        for value in values:
+            self.assertEquals(ts.ue(new), value)
+            self.assertEquals(reference_ue(ref), value)
+        self.assertEquals(new.tell(), ref.tell())
+
+    def test_signed_exp_golomb(self):
+        # codeNum 0..4 map to 0, 1, -1, 2, -2
+        reader = ts.bitreader('\xa6\x42\x80')
+        self.assertEquals([ts.se(reader) for _ in xrange(5)], [0, 1, -1, 2, -2])
+
+    def test_exp_golomb_past_end(self):
+        reader = ts.bitreader('\x00\x00')
+        self.assertRaises(ValueError, ts.ue, reader)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBitReader)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -37,6 +37,7 @@ import unittest
 
 import test_utils
 import mp4
+import livedownloader
 
 class TestDASHSegments(unittest.TestCase):
 
@@ -170,6 +171,144 @@ class TestDASHSegments(unittest.TestCase):
         self.assertTrue(trun)
         self.assertEquals(trun.sample_count, 180)
 
+    @unittest.skipIf(mp4.np is None, 'numpy not available')
+    def test_trun_sample_columns(self):
+
+        root = mp4.open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'))
+        trun = root.find('moof.traf.trun')
+
+        samples = trun.samples
+        self.assertEquals(samples.dtype.names, ('duration', 'size', 'flags', 'cto'))
+        self.assertEquals(len(samples), 180)
+        self.assertEquals(trun.total_duration, 540000)
+        self.assertEquals(trun.first_cto, samples['cto'][0])
+        for i in (0, 1, 179):
+            row = trun.sample_entry(i)
+            self.assertEquals(samples['duration'][i], row['duration'])
+            self.assertEquals(samples['size'][i], row['size'])
+        self.assertEquals(trun.sample_offsets[-1], sum(trun.sample_sizes[:-1]))
+
+        sizes = trun.sample_sizes.tolist()
+        offsets = trun.sample_offsets.tolist()
+        np = mp4.np
+        mp4.np = None
+        try:
+            plain = mp4.open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s')).find('moof.traf.trun')
+            self.assertEquals(plain.total_duration, trun.total_duration)
+            self.assertEquals(plain.first_cto, trun.first_cto)
+            self.assertEquals(plain.sample_sizes, sizes)
+            self.assertEquals(plain.sample_offsets, offsets)
+        finally:
+            mp4.np = np
+
+    def test_lazy_open_video_media_segment(self):
+
+        root = mp4.open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), lazy=True)
+        self.assertTrue(root.is_unparsed)
+
+        # Only the boxes on the path are parsed
+        trun = root.find('moof.traf.trun')
+        self.assertTrue(trun)
+        self.assertEquals(trun.sample_count, 180)
+        self.assertEquals([child.type for child in root.children], ['styp', 'moof', 'mdat'])
+
+        # Same tree as the eager parser
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+        eager = mp4.mp4(data, len(data))
+        self.assertEquals(root.description(), eager.description())
+
+    def test_compiled_path_and_index(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_init.mp4'), 'rb') as f:
+            data = f.read()
+
+        root = mp4.mp4(data, len(data))
+        query = mp4.compile_path('moov.trak.mdia.minf.stbl.stsd.avc1')
+        self.assertTrue(query is mp4.compile_path('moov.trak.mdia.minf.stbl.stsd.avc1'))
+        self.assertEquals(root.find(query).width, 320)
+        self.assertEquals(root.find('moov.trak.tkhd[track_id=5]..mdia.mdhd').timescale, 90000)
+        self.assertEquals(root.find_all('moov.trak.tkhd[track_id=4]'), [])
+
+        paths = ['moov.trak.mdia.mdhd', 'moov.trak', 'trak', 'moov.mvex.trex', 'moov.trak.mdia.minf.stbl.stsd.avc1.avcC']
+        expected = [root.find_all(path) for path in paths]
+        root.build_index()
+        self.assertEquals([root.find_all(path) for path in paths], expected)
+        self.assertEquals(root.find('moov.trak.mdia.mdhd'), expected[0][0])
+
+    def test_mdat_payload_view(self):
+
+        path = os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s')
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        root = mp4.open(path)
+        moof = root.find('moof')
+        mdat = moof.get_mdat()
+        trun = moof.find('traf.trun')
+        payload = mdat.payload
+        self.assertEquals(len(payload), mdat.size - 8)
+
+        first_sample = moof.offset + trun.data_offset
+        first_size = trun.sample_entry(0)['size']
+        self.assertEquals(payload[first_sample - mdat.payload_offset:][:first_size],
+                          data[first_sample:first_sample + first_size])
+
+    def test_incremental_parser(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+
+        parser = mp4.IncrementalParser()
+
+        # styp is completed by the first chunk, the rest of it is kept
+        boxes = parser.feed(data[:100])
+        self.assertEquals([b.type for b in boxes], ['styp'])
+        self.assertEquals(parser.pending, 100 - boxes[0].size)
+
+        for pos in range(100, len(data), 1000):
+            boxes += parser.feed(data[pos:pos+1000])
+        parser.close()
+
+        self.assertEquals([b.type for b in boxes], ['styp', 'moof', 'mdat'])
+        self.assertEquals([b.stream_offset for b in boxes], [b.offset for b in mp4.mp4(data).children])
+        self.assertEquals(parser.pending, 0)
+        self.assertEquals(boxes[1].find('traf.trun').sample_count, 180)
+
+    def test_incremental_parser_end_of_data(self):
+
+        with open(os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s'), 'rb') as f:
+            data = f.read()
+        mdat_offset = [b.offset for b in mp4.mp4(data).children if b.type == 'mdat'][0]
+
+        # mdat with size 0 extends to the end of the data
+        parser = mp4.IncrementalParser()
+        open_ended = data[:mdat_offset] + '\x00\x00\x00\x00' + data[mdat_offset + 4:]
+        boxes = []
+        for pos in range(0, len(data), 1000):
+            boxes += parser.feed(open_ended[pos:pos+1000])
+        self.assertEquals([b.type for b in boxes], ['styp', 'moof'])
+        boxes += parser.close()
+        self.assertEquals([b.type for b in boxes], ['styp', 'moof', 'mdat'])
+        self.assertEquals(boxes[2].size, len(data) - mdat_offset)
+
+        # A faulty box stops the box printing, but not the download
+        boxes = []
+        callback = lambda url, box: boxes.append(box.type)
+        broken = data[:mdat_offset] + '\x00\x00\x00\x04' + data[mdat_offset + 4:]
+        parser = mp4.IncrementalParser()
+        parser = livedownloader.parse_boxes('segment', parser, broken, callback)
+        self.assertEquals(boxes, ['styp', 'moof'])
+        parser = livedownloader.parse_boxes('segment', parser, None, callback)
+        self.assertTrue(parser is None)
+        self.assertEquals(boxes, ['styp', 'moof'])
+
+        # So does any other error from a box constructor or the callback
+        def failing_callback(url, box):
+            raise KeyError(box.type)
+        parser = livedownloader.parse_boxes('segment', mp4.IncrementalParser(), data, failing_callback)
+        self.assertTrue(parser is None)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestDASHSegments)
     result = unittest.TextTestRunner(verbosity=2).run(suite)
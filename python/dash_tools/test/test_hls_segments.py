@@ -33,11 +33,50 @@ Test parsing of HLS Segments
 
 import os
 import sys
+import hashlib
 import unittest
 
 import test_utils
 import ts
 
+
+class pes_recorder(ts.observer):
+    def __init__(self):
+        self.pes_list = []
+
+    def on_pmt(self, importer, pmt):
+        for stream in pmt.stream_list:
+            importer.observe_pid(stream.elementary_pid)
+
+    def on_pes(self, pid, pes):
+        self.pes_list.append((pid, pes.pts, pes.dts, str(pes.data)))
+
+
+class h264_recorder(ts.observer):
+    def __init__(self, split=None):
+        self.parser = ts.h264_parser()
+        self.split = split
+        self.frames = []
+
+    def on_pmt(self, importer, pmt):
+        for stream in pmt.stream_list:
+            if stream.stream_type == 0x1b:
+                importer.observe_pid(stream.elementary_pid)
+
+    def on_pes(self, pid, pes):
+        if self.split is None:
+            self.frames += self.parser.add_pes(pes.payload, pes.pts, pes.dts)
+            return
+        # Feed the payload in pieces to cut start codes at every position
+        payload = pes.payload
+        pos = 0
+        pts, dts = pes.pts, pes.dts
+        while pos < len(payload):
+            self.frames += self.parser.add_pes(payload[pos:pos + self.split], pts, dts)
+            pts = dts = -1
+            pos += self.split
+
+
 class TestHLSSegments(unittest.TestCase):
 
     def setUp(self):
@@ -98,6 +137,106 @@ class TestHLSSegments(unittest.TestCase):
         self.assertEquals(importer.num_packets, 298)
         self.assertEquals(importer.num_bytes, 56024)
 
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_vectorized_demux(self):
+        "The NumPy path must deliver the same PES packets in the same order as the packet loop."
+        with open(os.path.join(test_utils.TEST_PATH, 'data/H1.ts'), 'rb') as f:
+            data = f.read()
+        results = []
+        for vectorized in (False, True):
+            obs = pes_recorder()
+            importer = ts.ts_importer(obs, {'verbose': 0})
+            if vectorized:
+                importer.add_data(data)
+            else:
+                importer._add_data_packets(data)
+            importer.flush()
+            results.append((obs.pes_list, importer.num_packets, importer.first_pts,
+                            importer.last_pts))
+        self.assertTrue(len(results[0][0]) > 0)
+        self.assertEquals(results[0], results[1])
+
+    def test_h264_frames(self):
+        with open(os.path.join(test_utils.TEST_PATH, 'data/V1.ts'), 'rb') as f:
+            data = f.read()
+        for split in (None, 1, 7, 1000):
+            obs = h264_recorder(split)
+            importer = ts.ts_importer(obs, {'verbose': 0})
+            importer.add_data(data)
+            importer.flush()
+            frames = obs.frames + obs.parser.flush()
+            self.assertEquals(len(frames), 180)
+            self.assertEquals([f.pts for f in frames if f.frame_type == 'I'],
+                              [6000, 186000, 366000])
+            self.assertEquals(hashlib.md5(''.join(f.data for f in frames)).hexdigest(),
+                              'ad44e1fdf06af55c3cd0bfda4f1de117')
+
+    def test_pes_header(self):
+        "The struct header parser must agree with the bit reader used for display."
+        with open(os.path.join(test_utils.TEST_PATH, 'data/H1.ts'), 'rb') as f:
+            data = f.read()
+        fields = ('stream_id', 'pes_packet_length', 'pts_dts_indicator', 'pes_header_length',
+                  'data_alignment_indicator', 'pts', 'dts', 'payload_offset', 'header_len')
+        log = ts.logger.log
+        ts.logger.log = lambda text: None
+        try:
+            nr_pes = 0
+            for offset in xrange(0, len(data), 188):
+                packet = ts.ts_packet(data[offset:offset + 188])
+                payload = packet.payload
+                if packet.payload_unit_start_indicator and payload.startswith('\x00\x00\x01'):
+                    fast = ts.pes(payload)
+                    bits = ts.pes(payload, display=True)
+                    for field in fields:
+                        self.assertEquals(getattr(fast, field), getattr(bits, field))
+                    nr_pes += 1
+            self.assertTrue(nr_pes > 0)
+        finally:
+            ts.logger.log = log
+
+    def test_pes_assembly(self):
+        p = ts.pes('\x00\x00\x01\xe0\x00\x0e\x80\x80\x05\x21\x00\x01\x00\x01ab')
+        self.assertEquals(p.pts, 0)
+        p.add_data('cd')
+        p.add_data('ef')
+        self.assertEquals(p.size, p.pes_packet_length)
+        self.assertEquals(p.payload, 'abcdef')
+        self.assertEquals(len(p.fragments), 1)
+
+    def test_parallel_observer(self):
+        seg_path = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+
+        frame_counts = []
+        for obs in (ts.parser_observer(options), ts.parallel_observer(options, 2)):
+            importer = ts.ts_importer(obs, options, False)
+            ts.handle_file(seg_path, 0, importer)
+            frame_counts.append(obs.get_frame_counts())
+            self.assertEquals(importer.num_packets, 580)
+        self.assertEquals(frame_counts[0], {70: 180, 71: 282})
+        self.assertEquals(frame_counts[1], frame_counts[0])
+
+    def test_parallel_worker_dies(self):
+        seg_path = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+        obs = ts.parallel_observer(options, 2)
+        importer = ts.ts_importer(obs, options, False)
+        with open(seg_path, 'rb') as f:
+            importer.add_data(f.read())
+        self.assertEquals(len(obs.workers), 2)
+        video_worker = obs.workers[obs.pid_workers[70]][0]
+        video_worker.terminate()
+        video_worker.join()
+        poll_interval = ts.ES_POLL_INTERVAL
+        ts.ES_POLL_INTERVAL = 0.1
+        try:
+            importer.flush()
+        finally:
+            ts.ES_POLL_INTERVAL = poll_interval
+        self.assertEquals(len(obs.errors), 1)
+        self.assertTrue('exited with code' in obs.errors[0])
+        self.assertEquals(obs.get_frame_counts(), {71: 282})
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestHLSSegments)
     result = unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,138 @@
+"""
+Test parallel segment summaries and timeline merging
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+import mp4_batch
+from mp4_writer import BoxWriter
+
+
+VIDEO_SEGMENT = os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s')
+AUDIO_SEGMENT = os.path.join(test_utils.TEST_PATH, 'data/audio_segment.m4s')
+VIDEO_INIT = os.path.join(test_utils.TEST_PATH, 'data/video_init.mp4')
+
+
+def fragment_without_flags(first_sample_flags=None):
+    "A fragment of track 5 with 3 samples and no tfhd or trun sample flags."
+    writer = BoxWriter()
+    with writer.box('moof'):
+        with writer.full_box('mfhd', 0, 0):
+            writer.uint32(1)
+        with writer.box('traf'):
+            with writer.full_box('tfhd', 0, 0x020000):
+                writer.uint32(5)
+            trun_flags = 0x000200 | (first_sample_flags is not None and 0x000004)
+            with writer.full_box('trun', 0, trun_flags):
+                writer.uint32(3)
+                if first_sample_flags is not None:
+                    writer.uint32(first_sample_flags)
+                for i in range(3):
+                    writer.uint32(10)
+    with writer.box('mdat'):
+        writer.zeros(30)
+    return writer.getvalue()
+
+
+class TestMp4Batch(unittest.TestCase):
+
+    def test_summarize_segment(self):
+        summaries = mp4_batch.summarize_segment(VIDEO_SEGMENT)
+        self.assertEqual(len(summaries), 1)
+        summary = summaries[0]
+        self.assertEqual(summary.track_id, 5)
+        self.assertEqual(summary.tfdt, 0)
+        self.assertEqual(summary.sample_count, 180)
+        self.assertEqual(summary.duration, 540000)
+        self.assertTrue(summary.starts_with_sap)
+        self.assertTrue(summary.data_size <= summary.mdat_size - 8)
+
+    def test_trex_default_flags(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join(tmp_dir, name) for name in ('1.m4s', '2.m4s')]
+            with open(paths[0], 'wb') as f:
+                f.write(fragment_without_flags())
+            with open(paths[1], 'wb') as f:
+                f.write(fragment_without_flags(0x02000000))
+            summaries = [mp4_batch.summarize_segment(path)[0] for path in paths]
+            self.assertEqual([(s.sap_count, s.starts_with_sap) for s in summaries],
+                             [(None, None), (None, True)])
+
+            trex_flags = mp4_batch.read_trex_flags([VIDEO_INIT])
+            self.assertEqual(trex_flags, {5: 0})
+            trex_flags[5] = mp4_batch.SAMPLE_IS_NON_SYNC
+            summaries = [mp4_batch.summarize_segment(path, trex_flags)[0] for path in paths]
+            self.assertEqual([(s.sap_count, s.starts_with_sap) for s in summaries],
+                             [(0, False), (1, True)])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_pool_matches_serial(self):
+        paths = [VIDEO_SEGMENT, AUDIO_SEGMENT] * 3
+        serial = sorted(mp4_batch.summarize_segments(paths, processes=1))
+        parallel = sorted(mp4_batch.summarize_segments(paths, processes=2, chunksize=1))
+        self.assertEqual(serial, parallel)
+
+    def test_bad_file_reports_error(self):
+        results = list(mp4_batch.summarize_segments([VIDEO_SEGMENT + '.missing'], processes=1))
+        self.assertEqual(results[0][1], [])
+        self.assertTrue(results[0][2].startswith('IOError'))
+
+    def test_find_segments_orders_by_number(self):
+        paths = ['seg/10.m4s', 'seg/9.m4s', 'seg/100.m4s', 'seg/0.m4s']
+        self.assertEqual(mp4_batch.find_segments(paths),
+                         ['seg/0.m4s', 'seg/9.m4s', 'seg/10.m4s', 'seg/100.m4s'])
+
+    def test_timeline_discontinuities(self):
+        summary = mp4_batch.summarize_segment(VIDEO_SEGMENT)[0]
+        timeline = mp4_batch.Timeline()
+        for tfdt in (1080000, 0, 540000, 2000000):
+            timeline.add(summary._replace(tfdt=tfdt))
+        self.assertEqual([s.tfdt for s in timeline.fragments(5)], [0, 540000, 1080000, 2000000])
+        gaps = timeline.discontinuities(5)
+        self.assertEqual(len(gaps), 1)
+        self.assertEqual(gaps[0][2], 2000000 - 1620000)
+        totals = timeline.track_totals(5)
+        self.assertEqual(totals['samples'], 4 * 180)
+        self.assertEqual(totals['end'], 2540000)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestMp4Batch)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,137 @@
+"""
+Test in-place patching and patch journals
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+from mp4_patch import InPlacePatcher
+from mp4filter import TfdtFilter
+from fix_sync_sample_flags import TrunFilter
+from backup_handler import restore_from_journal, BackupError, JOURNAL_FILE_SUFFIX
+import mp4
+
+
+DATA_PATH = os.path.join(test_utils.TEST_PATH, 'data')
+
+
+class TestInPlacePatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'video_segment.m4s')
+        shutil.copy(os.path.join(DATA_PATH, 'video_segment.m4s'), self.path)
+        with open(self.path, 'rb') as ifh:
+            self.original = ifh.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read_file(self):
+        with open(self.path, 'rb') as ifh:
+            return ifh.read()
+
+    def test_tfdt_and_seq_nr_match_filter(self):
+        expected = TfdtFilter(self.path, 1000, 7).filter_top_boxes()
+        with InPlacePatcher(self.path) as patcher:
+            patcher.shift_tfdt(1000)
+            patcher.set_sequence_number(7)
+        self.assertEqual(self.read_file(), expected)
+        self.assertEqual(patcher.nr_bytes_written, 8)
+
+    def test_sync_flags_match_filter(self):
+        expected = TrunFilter(self.path).filter_top_boxes()
+        with InPlacePatcher(self.path) as patcher:
+            patcher.fix_sync_sample_flags()
+        self.assertEqual(self.read_file(), expected)
+
+    def test_track_id_and_brands(self):
+        with InPlacePatcher(self.path) as patcher:
+            patcher.set_track_id(2)
+            nr_brands = (patcher.boxes('styp')[0].size - 16) // 4
+            patcher.set_brands('cmfs', ['cmfv'] * nr_brands)
+            self.assertRaises(ValueError, patcher.set_brands, None, ['cmfv'] * (nr_brands + 1))
+            self.assertRaises(ValueError, patcher.set_brands, 'cmf')
+            self.assertRaises(ValueError, patcher.set_brands, 'cmfsx')
+            self.assertRaises(ValueError, patcher.set_brands, None, ['cmf'] + ['cmfv'] * (nr_brands - 1))
+        root = mp4.open(self.path)
+        self.assertEqual(root.find('moof.traf.tfhd').track_id, 2)
+        self.assertEqual(root.find('styp').major_brand, 'cmfs')
+        self.assertEqual(len(self.read_file()), len(self.original))
+
+    def test_overflow_does_not_write(self):
+        with InPlacePatcher(self.path) as patcher:
+            self.assertRaises(ValueError, patcher.shift_tfdt, 2 ** 32)
+        self.assertEqual(self.read_file(), self.original)
+
+    def test_rejected_brands_do_not_write(self):
+        init_path = os.path.join(self.tmp_dir, 'video_init.mp4')
+        shutil.copy(os.path.join(DATA_PATH, 'video_init.mp4'), init_path)
+        with open(init_path, 'rb') as ifh:
+            init_data = ifh.read()
+        patcher = InPlacePatcher(init_path)
+        self.assertRaises(ValueError, patcher.set_brands, 'abcd', ['x123'])
+        patcher.close()
+        with open(init_path, 'rb') as ifh:
+            self.assertEqual(ifh.read(), init_data)
+
+    def test_error_rolls_back(self):
+        try:
+            with InPlacePatcher(self.path, journal=True) as patcher:
+                patcher.shift_tfdt(90000)
+                patcher.set_track_id(3)
+                patcher.set_brands(None, ['cmfv'] * 100)
+        except ValueError:
+            pass
+        self.assertEqual(self.read_file(), self.original)
+        self.assertFalse(os.path.exists(self.path + JOURNAL_FILE_SUFFIX))
+
+    def test_journal_restore(self):
+        with InPlacePatcher(self.path, journal=True) as patcher:
+            patcher.shift_tfdt(90000)
+            patcher.set_track_id(3)
+        self.assertNotEqual(self.read_file(), self.original)
+        self.assertTrue(os.path.getsize(self.path + JOURNAL_FILE_SUFFIX) < 100)
+        self.assertRaises(BackupError, InPlacePatcher, self.path, True)
+        restore_from_journal(self.path)
+        self.assertEqual(self.read_file(), self.original)
+        self.assertFalse(os.path.exists(self.path + JOURNAL_FILE_SUFFIX))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestInPlacePatcher)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,131 @@
+"""
+Test the box writer and the filters and resegmenter that use it
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+import mp4
+from mp4_writer import BoxWriter
+from trick_mode_segment_creator import TrickFilter
+from track_resegmenter import TrackResegmenter
+
+
+DATA_PATH = os.path.join(test_utils.TEST_PATH, 'data')
+
+
+class TestBoxWriter(unittest.TestCase):
+
+    def test_nested_sizes_are_patched(self):
+        writer = BoxWriter(16)
+        with writer.box('moof'):
+            with writer.full_box('mfhd', 0, 0):
+                writer.uint32(17)
+            with writer.box('traf'):
+                with writer.full_box('tfdt', 1, 0):
+                    writer.uint64(2 ** 40)
+        data = writer.getvalue()
+        self.assertEqual(len(data), len(writer))
+        root = mp4.mp4(data, len(data))
+        self.assertEqual(root.find('moof').size, len(data))
+        self.assertEqual(root.find('moof.mfhd').seqno, 17)
+        self.assertEqual(root.find('moof.traf.tfdt').decode_time, 2 ** 40)
+
+    def test_patch_and_write_to(self):
+        writer = BoxWriter()
+        start = writer.begin_full_box('trun', 1, 0x101)
+        writer.uint32(0)
+        pos = writer.tell()
+        writer.uint32(0)
+        writer.end_box(start)
+        writer.patch_uint32(pos, 1234)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'out.mp4')
+            with open(path, 'wb') as ofh:
+                writer.write_to(ofh)
+            with open(path, 'rb') as ifh:
+                self.assertEqual(ifh.read(), writer.getvalue())
+        finally:
+            shutil.rmtree(tmp_dir)
+        root = mp4.mp4(writer.getvalue(), len(writer))
+        self.assertEqual(root.find('trun').data_offset, 1234)
+
+
+class TestWriterUsers(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_trick_filter(self):
+        output = TrickFilter(os.path.join(DATA_PATH, 'video_segment.m4s')).filter_top_boxes()
+        root = mp4.mp4(output, len(output))
+        moof = root.find('moof')
+        trun = root.find('moof.traf.trun')
+        self.assertEqual(trun.sample_count, 1)
+        self.assertEqual(trun.total_duration, 540000)
+        self.assertEqual(moof.offset + trun.data_offset, moof.get_mdat().offset + 8)
+
+    def test_resegment_track(self):
+        track_path = os.path.join(self.tmp_dir, 'audio.mp4')
+        with open(track_path, 'wb') as ofh:
+            for name in ('audio_init.mp4', 'audio_segment.m4s'):
+                with open(os.path.join(DATA_PATH, name), 'rb') as ifh:
+                    ofh.write(ifh.read())
+        output_path = os.path.join(self.tmp_dir, 'out.mp4')
+        TrackResegmenter(track_path, 1000, output_path).resegment()
+        root = mp4.open(output_path)
+        moofs = [b for b in root.children if b.type == 'moof']
+        self.assertEqual(len(moofs), 6)
+        sidx = root.find('sidx')
+        self.assertEqual(sidx.reference_count, 6)
+        for i, moof in enumerate(moofs):
+            mdat = moof.get_mdat()
+            self.assertEqual(moof.offset + moof.find('traf.trun').data_offset,
+                             mdat.offset + 8)
+            self.assertEqual(sidx.reference_entry(i)['referenced-size'],
+                             moof.size + mdat.size)
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestBoxWriter))
+    suite.addTests(unittest.TestLoader().loadTestsFromTestCase(TestWriterUsers))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,129 @@
+"""
+Test streaming and chained MP4 filters
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import test_utils
+import mp4
+from structops import str_to_uint32, str_to_uint64, uint32_to_str, uint64_to_str
+from mp4filter import FilterChain, TfdtFilter, ShiftCompositionTimeOffset
+from fix_sync_sample_flags import TrunFilter
+from mediacleaner import MediaCleanFilter
+from stppfixer import STPPFixerFilter
+
+
+VIDEO_SEGMENT = os.path.join(test_utils.TEST_PATH, 'data/video_segment.m4s')
+
+
+class TestFilterChain(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        with open(VIDEO_SEGMENT, 'rb') as ifh:
+            self.data = ifh.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_filter_file_matches_filter_top_boxes(self):
+        expected = TfdtFilter(VIDEO_SEGMENT, 1000, 7).filter_top_boxes()
+        output_path = os.path.join(self.tmp_dir, 'out.m4s')
+        size = TfdtFilter(None, 1000, 7).filter_file(VIDEO_SEGMENT, output_path)
+        with open(output_path, 'rb') as ifh:
+            self.assertEqual(ifh.read(), expected)
+        self.assertEqual(size, len(expected))
+
+    def test_chain_matches_consecutive_filters(self):
+        expected = self.data
+        for mp4_filter in (MediaCleanFilter(new_track_id=2), TfdtFilter(None, 90000, 3),
+                           TrunFilter(None)):
+            mp4_filter.data = expected
+            expected = mp4_filter.filter_top_boxes()
+
+        chain = FilterChain([MediaCleanFilter(new_track_id=2),
+                             TfdtFilter(None, 90000, 3),
+                             TrunFilter(None)], chunk_size=100)
+        output = StringIO()
+        chain.filter_stream(StringIO(self.data), output)
+        self.assertEqual(output.getvalue(), expected)
+
+    def test_unfiltered_boxes_are_copied_in_chunks(self):
+        chain = FilterChain([ShiftCompositionTimeOffset(None)], chunk_size=7)
+        output = StringIO()
+        size = chain.filter_stream(StringIO(self.data), output)
+        expected = ShiftCompositionTimeOffset(VIDEO_SEGMENT).filter_top_boxes()
+        self.assertEqual(output.getvalue(), expected)
+        self.assertEqual(size, len(expected))
+
+    def test_tfdt_version_1(self):
+        moof = mp4.mp4(self.data).find('moof')
+        traf = moof.find('traf')
+        tfdt = traf.find('tfdt')
+        decode_time = str_to_uint32(self.data[tfdt.offset + 12:tfdt.offset + 16])
+        data = bytearray(self.data)
+        for box in (moof, traf):
+            data[box.offset:box.offset + 4] = uint32_to_str(box.size + 4)
+        data[tfdt.offset:tfdt.offset + 16] = (uint32_to_str(20) + 'tfdt\x01\x00\x00\x00' +
+                                              uint64_to_str(decode_time))
+        data = str(data)
+
+        output = StringIO()
+        FilterChain([TfdtFilter(None, None, 5)]).filter_stream(StringIO(data), output)
+        output = output.getvalue()
+        self.assertEqual(len(output), len(data))
+        self.assertEqual(output[tfdt.offset:tfdt.offset + 20], data[tfdt.offset:tfdt.offset + 20])
+
+        tfilter = TfdtFilter(None, 1000)
+        tfilter.data = data
+        output = tfilter.filter_top_boxes()
+        self.assertEqual(len(output), len(data))
+        self.assertEqual(str_to_uint64(output[tfdt.offset + 12:tfdt.offset + 20]), decode_time + 1000)
+
+    def test_truncated_input(self):
+        chain = FilterChain([TfdtFilter(None, 1)])
+        self.assertRaises(ValueError, chain.filter_stream,
+                          StringIO(self.data[:-10]), StringIO())
+
+    def test_non_streamable_filter_is_rejected(self):
+        self.assertRaises(ValueError, FilterChain, [STPPFixerFilter()])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestFilterChain)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
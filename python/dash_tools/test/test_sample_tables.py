@@ -0,0 +1,104 @@
+"""
+Test sample table lookups
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import struct
+import sys
+import unittest
+
+import test_utils
+import mp4
+import sample_tables
+
+
+def make_full_box(box_type, fmt, *values):
+    payload = struct.pack('>' + fmt, *values)
+    data = struct.pack('>I4sI', 12 + len(payload), box_type, 0) + payload
+    return data
+
+
+class TestSampleTables(unittest.TestCase):
+
+    def setUp(self):
+        # 3 runs of samples with different durations and offsets
+        self.stts_runs = [(4, 1000), (1, 1500), (3, 1001)]
+        self.ctts_runs = [(1, 2000), (2, 0), (5, 1000)]
+        # chunks 1-2 have 3 samples, chunk 3 onwards have 1 sample
+        self.stsc_runs = [(1, 3, 1), (3, 1, 1)]
+        self.sizes = [100, 20, 30, 40, 50, 60, 70, 80]
+
+    def _box(self, box_class, box_type, runs, fields):
+        values = [len(runs)] + [v for run in runs for v in run]
+        data = make_full_box(box_type, 'I' + fields * len(runs), *values)
+        return box_class(data, box_type, len(data), 0)
+
+    def test_sample_time(self):
+        stts = self._box(mp4.stts_box, 'stts', self.stts_runs, 'II')
+        time = 0
+        idx = 1
+        for count, delta in self.stts_runs:
+            for i in range(count):
+                self.assertEquals(sample_tables.sample_time(stts, idx), (time, delta))
+                time += delta
+                idx += 1
+        self.assertEquals(sample_tables.sample_time(stts, 0), (0, 0))
+        self.assertEquals(sample_tables.sample_time(stts, idx), (0, 0))
+        self.assertEquals(stts.total_duration, time)
+
+    def test_sample_offset(self):
+        ctts = self._box(mp4.ctts_box, 'ctts', self.ctts_runs, 'II')
+        offsets = [offset for count, offset in self.ctts_runs for i in range(count)]
+        for idx, offset in enumerate(offsets, 1):
+            self.assertEquals(sample_tables.sample_offset(ctts, idx), offset)
+        self.assertEquals(sample_tables.sample_offset(None, 1), 0)
+
+    def test_sample_to_chunk_and_offset(self):
+        stsc = self._box(mp4.stsc_box, 'stsc', self.stsc_runs, 'III')
+        expected = [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2), (3, 0), (4, 0), (5, 0)]
+        for idx, chunk_and_index in enumerate(expected, 1):
+            self.assertEquals(sample_tables.sample_to_chunk_and_index(stsc, idx), chunk_and_index)
+
+        stsz_data = make_full_box('stsz', 'II' + 'I' * len(self.sizes), 0, len(self.sizes), *self.sizes)
+        stco_data = make_full_box('stco', 'IIIII', 4, 1000, 2000, 3000, 4000)
+        stbl = mp4.box(None, 'stbl', 0, 0)
+        stbl.children = [self._box(mp4.stsc_box, 'stsc', self.stsc_runs, 'III'),
+                         mp4.stsz_box(stsz_data, 'stsz', len(stsz_data), 0, stbl),
+                         mp4.stco_box(stco_data, 'stco', len(stco_data), 0, stbl)]
+        self.assertEquals(sample_tables.offset_from_sample(stbl, 1), 1000)
+        self.assertEquals(sample_tables.offset_from_sample(stbl, 3), 1120)
+        self.assertEquals(sample_tables.offset_from_sample(stbl, 6), 2090)
+        self.assertEquals(sample_tables.offset_from_sample(stbl, 8), 4000)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSampleTables)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
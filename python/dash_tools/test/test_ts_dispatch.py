@@ -0,0 +1,120 @@
+"""
+Test the fan-out of PES packets to several consumers
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import unittest
+
+import test_utils
+import ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+OPTIONS = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+
+
+class pes_recorder(ts.observer):
+    "Records (pid, size, pts) of the PES packets it gets, optionally slowly."
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.packets = []
+        self.flushed = False
+
+    def on_pes(self, pid, pes):
+        if self.delay:
+            time.sleep(self.delay)
+        self.packets.append((pid, len(pes.payload), pes.pts))
+
+    def flush(self):
+        self.flushed = True
+
+
+class audio_observer(pes_recorder):
+    "Subscribes itself to the audio PID like a plain observer."
+    def on_pmt(self, importer, pmt):
+        importer.observe_pid(71)
+
+
+class TestDispatchObserver(unittest.TestCase):
+
+    def run_importer(self, obs):
+        importer = ts.ts_importer(obs, OPTIONS)
+        ts.handle_file(H1_PATH, -1, importer)
+        return importer
+
+    def test_fan_out(self):
+        reference = pes_recorder()
+        dispatcher = ts.dispatch_observer()
+        dispatcher.add_consumer(reference, [ts.STREAM_TYPE_H264, ts.STREAM_TYPE_AUDIO_ADTS])
+        parser = dispatcher.add_consumer(ts.parser_observer(OPTIONS))
+        video = dispatcher.add_consumer(pes_recorder(), [ts.STREAM_TYPE_H264], threaded=True)
+        audio = dispatcher.add_consumer(audio_observer(), threaded=True, queue_size=2)
+        self.run_importer(dispatcher)
+
+        self.assertEquals(parser.get_frame_counts(), {70: 180, 71: 282})
+        self.assertEquals(dispatcher.get_frame_counts(), {70: 180, 71: 282})
+        self.assertEquals(video.packets, [p for p in reference.packets if p[0] == 70])
+        self.assertEquals(audio.packets, [p for p in reference.packets if p[0] == 71])
+        self.assertTrue(video.flushed and audio.flushed)
+        self.assertEquals(sorted(dispatcher.get_dropped().values()), [0, 0])
+
+    def test_drop(self):
+        dispatcher = ts.dispatch_observer()
+        reference = dispatcher.add_consumer(pes_recorder(), [ts.STREAM_TYPE_H264])
+        slow = dispatcher.add_consumer(pes_recorder(0.01), [ts.STREAM_TYPE_H264], threaded=True,
+                                       queue_size=4, drop=True)
+        start = time.time()
+        self.run_importer(dispatcher)
+        dropped = dispatcher.get_dropped().values()[0]
+        self.assertTrue(dropped > 0)
+        self.assertEquals(len(slow.packets) + dropped, len(reference.packets))
+        self.assertTrue(time.time() - start < len(reference.packets) * 0.01)
+
+    def test_registry(self):
+        ts.register_consumer('test_video', lambda options: pes_recorder(), [ts.STREAM_TYPE_H264])
+        try:
+            obs = ts.create_observer(['parser', 'test_video', 'ts.parser_observer'], OPTIONS, threaded=True)
+            self.assertTrue(isinstance(obs, ts.dispatch_observer))
+            self.run_importer(obs)
+            consumers = [entry[0] for entry in obs.entries]
+            self.assertEquals(len(consumers[1].packets), 180)
+            self.assertEquals(consumers[2].get_frame_counts(), consumers[0].get_frame_counts())
+        finally:
+            del ts.CONSUMERS['test_video']
+        self.assertTrue(isinstance(ts.create_observer(['parser'], OPTIONS), ts.parser_observer))
+        self.assertRaises(ValueError, ts.create_observer, ['test_video'], OPTIONS)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDispatchObserver)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
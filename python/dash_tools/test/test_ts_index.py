@@ -0,0 +1,151 @@
+"""
+Test the key frame index of TS files and I-frame only trick mode TS
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+import ts
+from trick_mode_segment_creator import convert_ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+KEY_FRAME_PTS = [6000, 186000, 366000]
+
+
+class TestKeyFrameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ts_path = os.path.join(self.tmp_dir, 'H1.ts')
+        shutil.copyfile(H1_PATH, self.ts_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def importer(self):
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+        return ts.ts_importer(ts.parser_observer(options), options, False)
+
+    def test_build(self):
+        index = ts.key_frame_index.build(self.ts_path)
+        self.assertEquals(index.pid, 70)
+        self.assertEquals(index.stream_type, 0x1b)
+        self.assertEquals([entry.pts for entry in index.entries], KEY_FRAME_PTS)
+        self.assertEquals([entry.dts for entry in index.entries], [0, 180000, 360000])
+        self.assertEquals([entry.pcr for entry in index.entries], [0, 171000, 351000])
+        with open(self.ts_path, 'rb') as f:
+            data = f.read()
+        for entry in index.entries:
+            self.assertEquals(entry.offset % 188, 0)
+            self.assertTrue(entry.offset < entry.end_offset)
+            self.assertEquals(ts.packet_pts(data, entry.offset), (70, entry.pts))
+            self.assertTrue(ts.is_key_frame_packet(data, entry.offset, 0x1b))
+
+        np = ts.np
+        ts.np = None
+        try:
+            self.assertEquals(ts.key_frame_index.build(self.ts_path).entries, index.entries)
+        finally:
+            ts.np = np
+
+    def test_save_load(self):
+        index = ts.key_frame_index.build(self.ts_path)
+        path = self.ts_path + ts.KEY_FRAME_INDEX_SUFFIX
+        index.save(path)
+        self.assertEquals(os.path.getsize(path), ts.KEY_FRAME_INDEX_HEADER.size + 3 * ts.KEY_FRAME_INDEX_ENTRY.size)
+        loaded = ts.key_frame_index.open(self.ts_path)
+        self.assertEquals(loaded.entries, index.entries)
+        self.assertEquals((loaded.pid, loaded.pmt_pid, loaded.clock_start),
+                          (index.pid, index.pmt_pid, index.clock_start))
+
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        self.assertRaises(ValueError, ts.key_frame_index.load, path)
+        self.assertEquals(ts.key_frame_index.open(self.ts_path).entries, index.entries)
+
+        # A stale index is rebuilt
+        with open(self.ts_path, 'ab') as f:
+            f.write('\xff' * 188)
+        self.assertEquals(ts.key_frame_index.open(self.ts_path).file_size, os.path.getsize(self.ts_path))
+
+        # So is one of a file rewritten with the same size
+        size = os.path.getsize(self.ts_path)
+        with open(self.ts_path, 'r+b') as f:
+            f.seek(index.entries[2].offset)
+            f.write('\xff' * (size - index.entries[2].offset))
+        mtime = os.path.getmtime(self.ts_path) + 10
+        os.utime(self.ts_path, (mtime, mtime))
+        rebuilt = ts.key_frame_index.open(self.ts_path)
+        self.assertEquals(rebuilt.file_mtime, ts.file_mtime_us(self.ts_path))
+        self.assertEquals(len(rebuilt.entries), 2)
+
+    def test_find_time(self):
+        index = ts.key_frame_index.build(self.ts_path)
+        self.assertEquals(index.find_time(0), index.entries[0])
+        self.assertEquals(index.find_time(2.5), index.entries[2])
+        self.assertEquals(index.find_time(100), None)
+        for entry, time in zip(index.entries, index.times):
+            self.assertAlmostEquals(time, (entry.pts - index.clock_start) / 90000.0)
+
+        importer = self.importer()
+        ts.handle_file(self.ts_path, -1, importer, start_time=1.0, end_time=3.0, index=index)
+        self.assertEquals(importer.observer.get_frame_counts()[70], 60)
+
+        # A key frame at the start of the file is found
+        index.entries[0] = index.entries[0]._replace(offset=0)
+        importer = self.importer()
+        ts.handle_file(self.ts_path, -1, importer, start_time=0, end_time=2.5, index=index)
+        expected = self.importer()
+        ts.handle_file(self.ts_path, -1, expected, start=0, end=index.entries[2].offset)
+        self.assertEquals(importer.num_packets, expected.num_packets)
+        self.assertEquals(importer.num_packets, index.entries[2].offset // 188)
+
+    def test_trick_mode(self):
+        out_path = os.path.join(self.tmp_dir, 'trick.ts')
+        self.assertEquals(convert_ts(self.ts_path, out_path), 3)
+        importer = self.importer()
+        ts.handle_file(out_path, -1, importer)
+        self.assertEquals(dict(importer.cc_errors), {})
+        self.assertEquals(importer.observer.get_frame_counts(), {70: 3})
+        trick_index = ts.key_frame_index.build(out_path)
+        self.assertEquals([entry.pts for entry in trick_index.entries], KEY_FRAME_PTS)
+
+        self.assertEquals(convert_ts(self.ts_path, out_path, start_time=1.0), 2)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestKeyFrameIndex)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,182 @@
+"""
+Test the live stream monitor and per-importer continuity counter checks
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import unittest
+import StringIO
+
+import test_utils
+import ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+DATAGRAM_SIZE = 7 * 188
+
+
+class fake_clock(object):
+    def __init__(self, start):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+class payload_recorder(ts.observer):
+    "Joins the PES payloads per PID."
+    def __init__(self):
+        self.payloads = {}
+
+    def on_pmt(self, importer, pmt):
+        importer.observe_pid(70)
+        importer.observe_pid(71)
+
+    def on_pes(self, pid, pes):
+        self.payloads[pid] = self.payloads.get(pid, '') + pes.payload
+
+
+class TestTSMonitor(unittest.TestCase):
+
+    def setUp(self):
+        with open(H1_PATH, 'rb') as f:
+            self.data = f.read()
+
+    def importer(self):
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+        return ts.ts_importer(ts.parser_observer(options), options, False)
+
+    def test_cc_errors_per_importer(self):
+        damaged = self.data[:100 * 188] + self.data[101 * 188:]
+        clean_importer = self.importer()
+        damaged_importer = self.importer()
+        for offset in xrange(0, len(self.data), DATAGRAM_SIZE):
+            clean_importer.add_data(self.data[offset:offset + DATAGRAM_SIZE])
+            damaged_importer.add_data(damaged[offset:offset + DATAGRAM_SIZE])
+        self.assertEquals(dict(clean_importer.cc_errors), {})
+        pid = ts.ts_packet(self.data[100 * 188:101 * 188]).pid
+        self.assertEquals(dict(damaged_importer.cc_errors), {pid: 1})
+
+        packet_importer = self.importer()
+        packet_importer._add_data_packets(damaged)
+        self.assertEquals(packet_importer.cc_errors, damaged_importer.cc_errors)
+
+    def test_cc_rules(self):
+        def packet(pid, cc, payload=True, discontinuity=False, error=False):
+            header = chr(0x47) + chr((error and 0x80 or 0) | pid >> 8) + chr(pid & 0xff)
+            if not payload:
+                return header + chr(0x20 | cc) + chr(183) + chr(0) + '\xff' * 182
+            if discontinuity:
+                return header + chr(0x30 | cc) + chr(1) + chr(0x80) + '\xff' * 182
+            return header + chr(0x10 | cc) + '\xff' * 184
+
+        data = ''.join([packet(0x100, 0), packet(0x100, 1), packet(0x100, 1), packet(0x100, 1),
+                        packet(0x100, 2), packet(0x100, 2, False), packet(0x100, 3, False),
+                        packet(0x100, 4), packet(0x100, 9, discontinuity=True), packet(0x100, 11),
+                        packet(0x101, 0), packet(0x101, 1), packet(0x101, 5, error=True),
+                        packet(0x101, 2)])
+        importers = [self.importer() for i in range(3)]
+        importers[0].add_data(data)
+        for offset in xrange(0, len(data), 188):
+            importers[1].add_data(data[offset:offset + 188])
+        importers[2]._add_data_packets(data)
+        for importer in importers:
+            self.assertEquals(dict(importer.cc_errors), {0x100: 3})
+            self.assertEquals(dict(importer.cc_error_positions), {0x100: [3 * 188, 6 * 188, 9 * 188]})
+            self.assertEquals(dict(importer.duplicate_packets), {0x100: 1})
+            self.assertEquals(dict(importer.transport_errors), {0x101: 1})
+
+    def test_duplicate_discarded(self):
+        for i in xrange(50, len(self.data) // 188):
+            packet = ts.ts_packet(self.data[i * 188:(i + 1) * 188])
+            if packet.pid == 70 and not packet.payload_unit_start_indicator:
+                break
+        duplicated = self.data[:(i + 1) * 188] + self.data[i * 188:]
+        payloads = []
+        for data, vectorized in ((self.data, True), (duplicated, True), (duplicated, False)):
+            obs = payload_recorder()
+            importer = ts.ts_importer(obs, {'verbose': 0})
+            if vectorized:
+                importer.add_data(data)
+            else:
+                importer._add_data_packets(data)
+            importer.flush()
+            if data is duplicated:
+                self.assertEquals(dict(importer.duplicate_packets), {70: 1})
+                self.assertEquals(dict(importer.cc_errors), {})
+            payloads.append(obs.payloads)
+        self.assertEquals(sorted(payloads[0]), [70, 71])
+        self.assertEquals(payloads[1], payloads[0])
+        self.assertEquals(payloads[2], payloads[0])
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_snapshots(self):
+        clock = fake_clock(1000.0)
+        output = StringIO.StringIO()
+        importer = self.importer()
+        monitor = ts.ts_monitor(importer, interval=2, window=3, output=output, clock=clock)
+        nr_datagrams = (len(self.data) + DATAGRAM_SIZE - 1) // DATAGRAM_SIZE
+        for offset in xrange(0, len(self.data), DATAGRAM_SIZE):
+            monitor.add_data(self.data[offset:offset + DATAGRAM_SIZE])
+            clock.now += 6.0 / nr_datagrams
+        self.assertEquals(importer.num_packets, 580)
+        self.assertEquals(monitor.num_packets, 580)
+
+        lines = output.getvalue().splitlines()
+        self.assertEquals(len(lines), monitor.num_snapshots)
+        self.assertEquals(len(lines), 2)
+        snapshot = json.loads(lines[-1])
+        self.assertTrue(len(monitor.buckets) <= 3)
+        self.assertTrue(2.0 <= snapshot['window'] <= 3.0)
+        video = snapshot['pids']['70']
+        self.assertEquals(video['cc_errors'], 0)
+        self.assertTrue(0.03 < video['pcr_interval_max'] < 0.04)
+        self.assertTrue('pcr_jitter' in video and 'pts_drift' in video)
+        self.assertAlmostEquals(snapshot['bitrate'],
+                                sum(stats['bitrate'] for stats in snapshot['pids'].values()))
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_bounded_window(self):
+        clock = fake_clock(0.0)
+        monitor = ts.ts_monitor(None, interval=5, window=10, output=StringIO.StringIO(), clock=clock)
+        for i in xrange(200):
+            monitor.add_data(self.data[:DATAGRAM_SIZE])
+            clock.now += 0.5
+        self.assertEquals(len(monitor.buckets), 10)
+        self.assertEquals(monitor.num_snapshots, 19)
+        snapshot = monitor.snapshot()
+        self.assertEquals(snapshot['packets'], 20 * 7)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTSMonitor)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,197 @@
+"""
+Test the memory-mapped TS file reader
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import test_utils
+import ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+
+
+class TestTSFileReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def importer(self):
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+        return ts.ts_importer(ts.parser_observer(options), options, False)
+
+    def test_find_time(self):
+        with ts.ts_file_reader(H1_PATH) as reader:
+            self.assertEquals(reader.time_at(0), (376, 0.0))
+            offset = reader.find_time(2.5)
+            self.assertEquals(offset % 188, 0)
+            self.assertEquals(reader.time_at(offset), (offset, 2.5))
+            self.assertTrue(reader.time_at(offset - 188)[0] == offset)
+            self.assertTrue(reader.find_time(2.4) < offset)
+            self.assertEquals(reader.find_time(100), reader.size)
+
+    def test_resync(self):
+        with open(H1_PATH, 'rb') as f:
+            data = f.read()
+        path = os.path.join(self.tmp_dir, 'corrupt.ts')
+        with open(path, 'wb') as f:
+            f.write('\xff' * 10 + data[:100 * 188] + '\x00' * 99 + data[100 * 188:])
+        with ts.ts_file_reader(path) as reader:
+            chunks = list(reader.chunks(0, None, 188 * 50))
+            self.assertEquals(sum(len(chunk) for chunk in chunks), len(data))
+            self.assertEquals(str(chunks[0][:188]), data[:188])
+            self.assertEquals(reader.lost_sync, 1)
+
+        importer = self.importer()
+        ts.handle_file(path, 0, importer)
+        self.assertEquals(importer.num_packets, 580)
+
+    def test_window(self):
+        with ts.ts_file_reader(H1_PATH) as reader:
+            start = reader.find_time(2.5)
+            end = reader.find_time(5)
+
+        importer = self.importer()
+        ts.handle_file(H1_PATH, 0, importer, start_time=2.5, end_time=5)
+        self.assertEquals(importer.num_packets, (end - start) // 188)
+
+        importer = self.importer()
+        ts.handle_file(H1_PATH, 100 * 188, importer, start=start + 1)
+        self.assertEquals(importer.num_packets, 100)
+
+    def test_packet_sizes(self):
+        with open(H1_PATH, 'rb') as f:
+            data = f.read()
+        packets = [data[i:i + 188] for i in xrange(0, len(data), 188)]
+        m2ts = ''.join(['\x00\x01\x02\x03' + p for p in packets])
+        rs = ''.join([p + '\xee' * 16 for p in packets])
+        for packet_size, stream in ((192, m2ts), (204, rs)):
+            path = os.path.join(self.tmp_dir, 'stream%d.ts' % packet_size)
+            with open(path, 'wb') as f:
+                f.write(stream[:100 * packet_size] + '\xff' * 50 + stream[100 * packet_size:])
+            with ts.ts_file_reader(path) as reader:
+                self.assertEquals(reader.packet_size, packet_size)
+                chunks = list(reader.chunks(0, None, 188 * 30))
+                self.assertEquals(''.join(str(chunk) for chunk in chunks), data)
+                self.assertEquals(reader.lost_sync, 1)
+
+            importer = self.importer()
+            ts.handle_file(path, 0, importer)
+            self.assertEquals(importer.num_packets, 580)
+            self.assertEquals(importer.lost_sync, 1)
+
+            importer = self.importer()
+            ts.handle_file(path, 200 * 188, importer)
+            self.assertEquals(importer.num_packets, 200)
+            importer = self.importer()
+            with open(path, 'rb') as f:
+                ts.handle_stream(f, 50 * 188, importer)
+            self.assertEquals(importer.num_packets, 50)
+
+            sync = ts.packet_sync()
+            output = [sync.add(stream[i:i + 1000]) for i in xrange(0, len(stream), 1000)]
+            self.assertEquals(''.join(str(o) for o in output) + sync.flush(), data)
+            self.assertEquals(sync.packet_size, packet_size)
+            self.assertEquals(sync.lost_sync, 0)
+
+    def test_cc_error_positions(self):
+        with open(H1_PATH, 'rb') as f:
+            data = f.read()
+        packets = [data[i:i + 188] for i in xrange(0, len(data), 188)]
+        for i in xrange(120, len(packets)):
+            if ts.ts_packet(packets[i]).pid == 70:
+                break
+        packets[i] = packets[i][:3] + chr(ord(packets[i][3]) ^ 0x08) + packets[i][4:]
+        with open(os.path.join(self.tmp_dir, 'cc.ts'), 'wb') as f:
+            f.write(''.join(packets))
+        importer = self.importer()
+        ts.handle_file(f.name, 0, importer)
+        positions = importer.cc_error_positions[70]
+        self.assertEquals(len(positions), 2)
+        self.assertEquals(positions[0], i * 188)
+
+        m2ts = ''.join(['\x00\x01\x02\x03' + p for p in packets])
+        m2ts = m2ts[:100 * 192] + '\xff' * 50 + m2ts[100 * 192:]
+        expected = [p // 188 * 192 + 4 + 50 for p in positions]
+        with open(os.path.join(self.tmp_dir, 'cc.m2ts'), 'wb') as f:
+            f.write(m2ts)
+        importer = self.importer()
+        ts.handle_file(f.name, 0, importer)
+        self.assertEquals(importer.cc_error_positions[70], expected)
+        importer = self.importer()
+        ts.handle_file(f.name, 0, importer, start=110 * 192)
+        self.assertEquals(importer.cc_error_positions[70], expected)
+        importer = self.importer()
+        for offset in xrange(0, len(m2ts), 1000):
+            importer.add_data(m2ts[offset:offset + 1000])
+        self.assertEquals(importer.cc_error_positions[70], expected)
+
+    def test_packet_sync(self):
+        with open(H1_PATH, 'rb') as f:
+            data = f.read()
+        sync = ts.packet_sync()
+        self.assertTrue(sync.add(buffer(data)) is not data)
+        self.assertEquals(sync.add(data), data)
+
+        sync = ts.packet_sync()
+        corrupt = '\xff' * 10 + data[:100 * 188] + '\x00' * 99 + data[100 * 188 + 5:]
+        output = ''.join(str(sync.add(corrupt[i:i + 1316])) for i in xrange(0, len(corrupt), 1316))
+        self.assertEquals(output, data[:100 * 188] + data[101 * 188:])
+        self.assertEquals(sync.lost_sync, 1)
+        self.assertEquals(sync.skipped_bytes, 10 + 99 + 183)
+
+        offset = 100 * 188 + 10
+        self.assertEquals(ts.find_sync(corrupt, offset), (offset + 99 + 183, 188))
+        self.assertEquals(ts.find_sync('\x47' + '\x00' * 400), (-1, None))
+        np = ts.np
+        try:
+            ts.np = None
+            self.assertEquals(ts.find_sync(corrupt, offset), (offset + 99 + 183, 188))
+            self.assertEquals(ts.count_synced(corrupt, 10, 101), 100)
+        finally:
+            ts.np = np
+
+    def test_parse_time(self):
+        self.assertEquals(ts.parse_time('42:00'), 2520.0)
+        self.assertEquals(ts.parse_time('1:02:03.5'), 3723.5)
+        self.assertEquals(ts.parse_time('90'), 90.0)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTSFileReader)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,152 @@
+"""
+Test remuxing of TS to fragmented MP4
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import shutil
+import struct
+import tempfile
+import unittest
+
+import test_utils
+import ts
+import mp4
+import mp4_batch
+import ts_remux
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+
+
+class fragment_recorder(object):
+    def __init__(self):
+        self.events = []
+
+    def on_init(self, track, data):
+        self.events.append((track.name, 'init', data))
+
+    def on_fragment(self, track, data):
+        self.events.append((track.name, track.sequence_number, data))
+
+
+class TestTSRemux(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def remux(self, sink, fragment_duration=ts_remux.FRAGMENT_DURATION):
+        obs = ts_remux.remux_observer(sink, fragment_duration)
+        importer = ts.ts_importer(obs, {'verbose': 0})
+        ts.handle_file(H1_PATH, -1, importer)
+        return obs
+
+    def test_nal_units(self):
+        data = '\x00\x00\x00\x01\x65\x88\x00\x00\x01\x06\x05\x00\x00\x00\x01\x41\x9a'
+        self.assertEquals(ts_remux.length_prefixed_nal_units(data),
+                          '\x00\x00\x00\x02\x65\x88\x00\x00\x00\x02\x06\x05\x00\x00\x00\x02\x41\x9a')
+        self.assertEquals(ts_remux.remove_emulation_prevention('\x01\x00\x00\x03\x00\x00\x03\x01'),
+                          '\x01\x00\x00\x00\x00\x01')
+
+    def test_unwrap(self):
+        track = ts_remux.h264_track(1, 70, None, 2.0)
+        wrap = ts.TIMESTAMP_WRAP
+        self.assertEquals([track.unwrap(t) for t in (wrap - 3000, wrap - 10, 5, 3005, wrap - 20)],
+                          [wrap - 3000, wrap - 10, wrap + 5, wrap + 3005, wrap - 20])
+
+    def test_output_names(self):
+        self.assertEquals(ts_remux.output_names(['a/H1.ts', 'a/V1.ts']), ['H1', 'V1'])
+        self.assertEquals(ts_remux.output_names(['ladder/1080p/index.ts', 'ladder/720p/index.ts', 'H1.ts']),
+                          [os.path.join('1080p', 'index'), os.path.join('720p', 'index'), 'H1'])
+        self.assertRaises(ValueError, ts_remux.output_names, ['a/H1.ts', 'a/H1.m2ts'])
+        self.assertRaises(ValueError, ts_remux.output_names, ['H1.ts', './H1.ts'])
+
+    def test_fragments(self):
+        recorder = fragment_recorder()
+        obs = self.remux(recorder)
+        self.assertEquals(obs.get_frame_counts(), {70: 180, 71: 282})
+        for name in ('video_70', 'audio_71'):
+            events = [event[1] for event in recorder.events if event[0] == name]
+            self.assertEquals(events, ['init', 1, 2, 3])
+
+        video = obs.tracks[70]
+        self.assertEquals(ts_remux.sps_dimensions(video.parser.sps), (320, 180))
+        config, sample_rate, channels = ts_remux.adts_config(obs.tracks[71].parser.header)
+        self.assertEquals((config, sample_rate, channels), ('\x11\x90', 48000, 2))
+
+    def test_segments(self):
+        info = ts_remux.remux_file(H1_PATH, self.tmp_dir)
+        self.assertEquals(info['samples'], {'video_70': 180, 'audio_71': 282})
+
+        timeline = mp4_batch.Timeline()
+        for result in mp4_batch.summarize_segments(mp4_batch.find_segments([self.tmp_dir]), 1):
+            timeline.add_result(result)
+        self.assertEquals(timeline.errors, [])
+        tracks = {}
+        for track_id in timeline.tracks:
+            self.assertEquals(timeline.discontinuities(track_id), [])
+            totals = timeline.track_totals(track_id)
+            self.assertEquals(totals['non_sap_starts'], 0)
+            tracks[totals['samples']] = [s.tfdt for s in timeline.fragments(track_id)]
+        self.assertEquals(tracks[180], [0, 180000, 360000])
+        self.assertEquals(tracks[282], [0, 94 * 1024, 188 * 1024])
+
+        init = mp4.open(os.path.join(self.tmp_dir, 'video_70', 'init.mp4'))
+        avc1 = init.find('moov.trak.mdia.minf.stbl.stsd.avc1')
+        self.assertEquals((avc1.width, avc1.height), (320, 180))
+        self.assertEquals(init.find('moov.trak.mdia.mdhd').timescale, 90000)
+        init = mp4.open(os.path.join(self.tmp_dir, 'audio_71', 'init.mp4'))
+        mp4a = init.find('moov.trak.mdia.minf.stbl.stsd.mp4a')
+        self.assertEquals((mp4a.sample_rate, mp4a.channels), (48000, 2))
+        self.assertEquals(mp4a.find('esds').cfg, '0x1190')
+
+        # Samples are length prefixed NAL units that fill the mdat
+        segment = mp4.open(os.path.join(self.tmp_dir, 'video_70', '1.m4s'))
+        trun = segment.find('moof.traf.trun')
+        mdat = segment.find('mdat')
+        data = str(segment.fmap[mdat.offset + 8:mdat.offset + mdat.size])
+        sizes = [trun.sample_entry(i)['size'] for i in range(trun.sample_count)]
+        self.assertEquals(sum(sizes), len(data))
+        self.assertEquals(ord(data[4]) & 0x1f, 5)
+        offset = 0
+        for size in sizes:
+            end = offset + size
+            while offset < end:
+                offset += 4 + struct.unpack_from('>I', data, offset)[0]
+            self.assertEquals(offset, end)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTSRemux)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
@@ -0,0 +1,165 @@
+"""
+Test PCR and PTS/DTS timing analysis
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import struct
+import unittest
+
+import test_utils
+import ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+PCR_PID = 0x100
+VIDEO_PID = 0x101
+PACKET_TICKS = 27000  # One packet per ms, 1504000 bps
+
+
+def encode_timestamp(prefix, timestamp):
+    timestamp %= ts.TIMESTAMP_WRAP
+    return struct.pack('>BHH', (prefix << 4) | ((timestamp >> 29) & 0x0e) | 1,
+                       ((timestamp >> 14) & 0xfffe) | 1, ((timestamp << 1) & 0xfffe) | 1)
+
+
+def pcr_packet(pid, pcr, cc):
+    pcr %= ts.PCR_WRAP
+    base, extension = divmod(pcr, 300)
+    header = struct.pack('>BHBBB', 0x47, pid, 0x20 | cc, 183, 0x10)
+    clock = struct.pack('>IH', base >> 1, ((base & 1) << 15) | 0x7e00 | extension)
+    return header + clock + '\xff' * (188 - 12)
+
+
+def pes_packet(pid, pts, dts, cc):
+    header = struct.pack('>BHB', 0x47, 0x4000 | pid, 0x10 | cc)
+    pes_header = '\x00\x00\x01\xe0\x00\x00\x80\xc0\x0a' + \
+        encode_timestamp(3, pts) + encode_timestamp(1, dts)
+    return header + pes_header + '\x00' * (184 - len(pes_header))
+
+
+def cbr_stream(start, nr_packets, delay, pcr_every=10, pes_every=10, skip_pcr=()):
+    """A stream with one packet per ms, a PCR every pcr_every packets and a
+    one-packet PES every pes_every packets with a DTS delay (90 kHz) after
+    its arrival."""
+    packets = []
+    for i in xrange(nr_packets):
+        pcr = start + i * PACKET_TICKS
+        if i % pcr_every == 0 and i not in skip_pcr:
+            packets.append(pcr_packet(PCR_PID, pcr, i // pcr_every % 16))
+        elif i % pes_every == pes_every // 2:
+            dts = pcr // 300 + delay
+            packets.append(pes_packet(VIDEO_PID, dts + 3000, dts, i // pes_every % 16))
+        else:
+            packets.append(struct.pack('>BHB', 0x47, 0x1fff, 0x10) + '\xff' * 184)
+    return ''.join(packets)
+
+
+class TestTSTiming(unittest.TestCase):
+
+    def analyze(self, data, chunk_size=None):
+        analyzer = ts.timing_analyzer()
+        chunk_size = chunk_size or len(data)
+        for offset in xrange(0, len(data), chunk_size):
+            analyzer.add_data(data[offset:offset + chunk_size])
+        return analyzer.analyze()
+
+    def test_packet_pes_times(self):
+        data = pes_packet(VIDEO_PID, 12000, 9000, 0)
+        self.assertEquals(ts.packet_pes_times(data, 0), (VIDEO_PID, 12000, 9000))
+        self.assertEquals(ts.packet_pts(data, 0), (VIDEO_PID, 12000))
+        self.assertEquals(ts.packet_pes_times(pcr_packet(PCR_PID, 0, 0), 0), None)
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_cbr_stream(self):
+        results = self.analyze(cbr_stream(1000000, 2000, 9000))
+        pcr = results['pcr'][PCR_PID]
+        self.assertEquals(pcr['count'], 200)
+        self.assertAlmostEquals(pcr['interval_max'], 0.01)
+        self.assertAlmostEquals(pcr['mux_rate'], 1504000)
+        self.assertEquals(pcr['interval_errors'], 0)
+        self.assertEquals(pcr['discontinuities'], 0)
+        self.assertTrue(pcr['constant_rate'])
+        self.assertTrue(pcr['accuracy_max'] < 1e-9)
+        self.assertEquals(pcr['accuracy_errors'], 0)
+
+        video = results['pes'][VIDEO_PID]
+        self.assertEquals(video['count'], 200)
+        self.assertEquals(video['underflows'], 0)
+        self.assertEquals(video['buffer_max'], 10 * 184)
+        self.assertAlmostEquals(video['decode_delay_min'], 0.099)
+        self.assertAlmostEquals(video['decode_delay_max'], 0.099)
+        self.assertAlmostEquals(video['pts_dts_max'], 3000 / 90000.0)
+
+        # A PCR that is 2 us off is still a constant rate, but inaccurate. Its
+        # neighbours are interpolated from it and are 1 us off.
+        data = cbr_stream(1000000, 2000, 9000)
+        jittered = pcr_packet(PCR_PID, 1000000 + 1000 * PACKET_TICKS + 54, 100 % 16)
+        pcr = self.analyze(data[:1000 * 188] + jittered + data[1001 * 188:])['pcr'][PCR_PID]
+        self.assertTrue(pcr['constant_rate'])
+        self.assertEquals(pcr['accuracy_errors'], 3)
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_wrap_around(self):
+        start = ts.PCR_WRAP - 1000 * PACKET_TICKS
+        data = cbr_stream(start, 2000, 9000)
+        self.assertEquals(self.analyze(data, 7 * 188), self.analyze(cbr_stream(1000000, 2000, 9000)))
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_errors(self):
+        data = cbr_stream(1000000, 2000, 0, skip_pcr=(500, 510, 520, 530))
+        data += cbr_stream(1000000, 1000, 0)
+        results = self.analyze(data)
+        pcr = results['pcr'][PCR_PID]
+        self.assertEquals(pcr['interval_errors'], 1)
+        self.assertAlmostEquals(pcr['interval_max'], 0.05)
+        self.assertEquals(pcr['discontinuities'], 1)
+        self.assertEquals(results['pes'][VIDEO_PID]['underflows'], 300)
+
+    @unittest.skipIf(ts.np is None, 'numpy not available')
+    def test_chunked(self):
+        with open(H1_PATH, 'rb') as f:
+            data = f.read()
+        results = self.analyze(data)
+        self.assertEquals(self.analyze(data, 3 * 188), results)
+        self.assertEquals(sorted(results['pes']), [70, 71])
+        self.assertEquals(results['pes'][70]['count'], 180)
+        self.assertEquals(results['pes'][71]['count'], 282)
+        self.assertEquals(results['pcr'][70]['interval_errors'], 0)
+        self.assertEquals(results['pes'][70]['underflows'], 0)
+        # H1.ts has a variable mux rate, so PCR accuracy does not apply
+        self.assertFalse(results['pcr'][70]['constant_rate'])
+        self.assertEquals(results['pcr'][70].get('accuracy_errors', 0), 0)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTSTiming)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
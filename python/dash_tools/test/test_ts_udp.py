@@ -0,0 +1,99 @@
+"""
+Test UDP ingest over the loopback interface
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import time
+import socket
+import threading
+import unittest
+
+import test_utils
+import ts
+
+H1_PATH = os.path.join(test_utils.TEST_PATH, 'data/H1.ts')
+DATAGRAM_SIZE = 7 * 188
+
+
+def send_datagrams(data, host, port, delay=0.2):
+    time.sleep(delay)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    for i in range(0, len(data), DATAGRAM_SIZE):
+        sock.sendto(data[i:i + DATAGRAM_SIZE], (host, port))
+    sock.close()
+
+
+class TestUDPIngest(unittest.TestCase):
+
+    def setUp(self):
+        with open(H1_PATH, 'rb') as f:
+            self.data = f.read()
+
+    def ingest(self, host, port):
+        options = {'video': False, 'audio': False, 'text': False, 'verbose': 0}
+        importer = ts.ts_importer(ts.parser_observer(options), options)
+        sender = threading.Thread(target=send_datagrams, args=(self.data * 4, host, port))
+        sender.start()
+        receiver = ts.handle_udp(host, port, importer, duration=1.0)
+        sender.join()
+        self.assertEquals(receiver.overruns, 0)
+        self.assertEquals(importer.num_packets, 4 * 580)
+        self.assertEquals(receiver.num_bytes, 4 * len(self.data))
+
+    def test_unicast(self):
+        self.ingest('127.0.0.1', 15600)
+
+    def test_multicast(self):
+        try:
+            self.ingest('239.255.42.42', 15601)
+        except socket.error as e:
+            self.skipTest('no multicast: %s' % e)
+
+    def test_ring_overrun(self):
+        sock = ts.create_socket(15602, '127.0.0.1')
+        receiver = ts.udp_receiver(sock, slots=4, datagram_size=DATAGRAM_SIZE)
+        send_datagrams(self.data[:10 * DATAGRAM_SIZE], '127.0.0.1', 15602, 0)
+        receiver.start()
+        time.sleep(0.3)
+        data = receiver.get(1.0)
+        receiver.stop()
+        sock.close()
+        self.assertEquals(data, self.data[:4 * DATAGRAM_SIZE])
+        self.assertEquals(receiver.overruns, 6)
+        self.assertEquals(receiver.num_datagrams, 4)
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestUDPIngest)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(len(result.failures) + len(result.errors))
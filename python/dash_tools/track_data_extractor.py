@@ -32,9 +32,10 @@
 
 from collections import namedtuple
 
-from structops import str_to_uint16, uint32_to_str
+from structops import str_to_uint16
 from structops import str_to_uint32, str_to_uint64
 from mp4filter import MP4Filter
+from mp4_writer import BoxWriter
 
 SampleData = namedtuple("SampleData", "start dur size offset flags cto")
 
@@ -82,13 +83,7 @@ class TrackDataExtractor(MP4Filter):
                 if self.segment_start is None:
                     self.segment_start = file_pos
                 self.last_moof_start = file_pos
-            output += data[:8]
-            pos = 8
-            while pos < len(data):
-                size, box_type = self.check_box(data[pos:pos + 8])
-                output += self.filterbox(box_type, data[pos:pos+size],
-                                         file_pos + len(output), path)
-                pos += size
+            output = self.filter_container(data, file_pos, path)
         elif path == "moov.mvex.trex":
             output = self.process_trex(data)
         elif path == "moov.trak.mdia.mdhd":
@@ -287,14 +282,15 @@ class TrackDataExtractor(MP4Filter):
             header_end += size
         return header_end
 
+    def write_new_mdat(self, writer, media_info):
+        "Write an mdat box with data for samples in media_info to writer."
+        with writer.box('mdat'):
+            for i in range(media_info.start_nr, media_info.end_nr):
+                sample = self.samples[i]
+                writer.write(buffer(self.data, sample.offset, sample.size))
+
     def construct_new_mdat(self, media_info):
         "Return an mdat box with data for samples in media_info."
-        start_nr = media_info.start_nr
-        end_nr = media_info.end_nr
-        sample_data = []
-        for i in range(media_info.start_nr, media_info.end_nr):
-            sample = self.samples[i]
-            sample_data.append(self.data[sample.offset:sample.offset +
-                                                       sample.size])
-        combined_data = "".join(sample_data)
-        return uint32_to_str(8 + len(combined_data)) + 'mdat' + combined_data
+        writer = BoxWriter()
+        self.write_new_mdat(writer, media_info)
+        return writer.getvalue()
@@ -36,9 +36,8 @@ import os
 from argparse import ArgumentParser
 from collections import namedtuple
 
-from structops import str_to_uint16, uint16_to_str, uint32_to_str, sint32_to_str
-from structops import str_to_uint32, str_to_uint64, uint64_to_str
 from track_data_extractor import TrackDataExtractor
+from mp4_writer import BoxWriter
 from backup_handler import make_backup, BackupError
 
 SegmentData = namedtuple("SegmentData", "nr start dur size data")
@@ -76,16 +75,15 @@ class TrackResegmenter(object):
 
         segment_info = self._map_samples_to_new_segments()
         self.track_id = ip.track_id
-        output_segments = []
+        writer = BoxWriter(len(ip.data))
         segment_sizes = []
         for i, seg_info in enumerate(segment_info):
-            output_segment = ""
+            segment_start = writer.tell()
             if ip.styp:
-                output_segment += ip.styp
-            output_segment += self._generate_moof(i+1, seg_info)
-            output_segment += ip.construct_new_mdat(seg_info)
-            output_segments.append(output_segment)
-            segment_sizes.append(len(output_segment))
+                writer.write(ip.styp)
+            self._generate_moof(writer, i+1, seg_info)
+            ip.write_new_mdat(writer, seg_info)
+            segment_sizes.append(writer.tell() - segment_start)
         if self.output_file:
             if self.output_file == self.input_file:
                 try:
@@ -96,7 +94,7 @@ class TrackResegmenter(object):
                     return
             with open(self.output_file, "wb") as ofh:
                 input_header_end = self.input_parser.find_header_end()
-                ofh.write(ip.data[:input_header_end])
+                ofh.write(buffer(ip.data, 0, input_header_end))
                 if not self.skip_sidx:
                     sidx = self._generate_sidx(segment_info, segment_sizes,
                                                timescale)
@@ -104,8 +102,7 @@ class TrackResegmenter(object):
                     sidx_start = input_header_end
                     self.sidx_range = "%d-%d" % (sidx_start,
                                                  sidx_start + len(sidx) - 1)
-                for output_segment in output_segments:
-                    ofh.write(output_segment)
+                writer.write_to(ofh)
 
     def _map_samples_to_new_segments(self):
         "Calculate which samples go into which segments."
@@ -144,46 +141,41 @@ class TrackResegmenter(object):
     def _generate_sidx(self, segment_info, segment_sizes, timescale):
         "Generate sidx box."
         earliest_presentation_time = segment_info[0].start_time
-        parts = ['sidx',
-                 uint32_to_str(0), # version + flags
-                 uint32_to_str(1), # reference_ID
-                 uint32_to_str(timescale),
-                 uint32_to_str(earliest_presentation_time),
-                 uint32_to_str(0),  # first_offset
-                 uint16_to_str(0),  # reserved
-                 uint16_to_str(len(segment_sizes))]  # reference_count
-        for info, size in zip(segment_info, segment_sizes):
-            parts.append(uint32_to_str(size))  # Setting reference type to 0
-            parts.append(uint32_to_str(info.dur))
-            parts.append(uint32_to_str(0x90000000)) # SAP info
-        output = ''.join(parts)
-        size = 4 + len(output)
-        output = uint32_to_str(size) + output
-        return output
-
-    def _generate_moof(self, sequence_nr, seg_info):
-        "Generate a moof box with the correct sample entries"
-        mfhd = self._generate_mfhd(sequence_nr)
-        offset = 8 + len(mfhd)
-        traf = self._generate_traf(seg_info, offset)
-        size = 8 + len(mfhd) + len(traf)
-        return uint32_to_str(size) + 'moof' + mfhd + traf
-
-    def _generate_mfhd(self, sequence_nr):
-        return (uint32_to_str(16) +  # size
-                'mfhd' +
-                uint32_to_str(0) +  # version_and_flags
-                uint32_to_str(sequence_nr))
-
-    def _generate_traf(self, seg_info, offset):
-        tfhd = self._generate_tfhd(seg_info, self.track_id)
-        tfdt = self._generate_tfdt(seg_info)
-        offset += 8 + len(tfhd) + len(tfdt)
-        trun = self._generate_trun(seg_info, offset)
-        size = 8 + len(tfhd) + len(tfdt) + len(trun)
-        return uint32_to_str(size) + 'traf' + tfhd + tfdt + trun
-
-    def _generate_tfhd(self, seg_info, track_id):
+        writer = BoxWriter(32 + 12 * len(segment_sizes))
+        with writer.full_box('sidx', 0, 0):
+            writer.uint32(1)  # reference_ID
+            writer.uint32(timescale)
+            writer.uint32(earliest_presentation_time)
+            writer.uint32(0)  # first_offset
+            writer.uint16(0)  # reserved
+            writer.uint16(len(segment_sizes))  # reference_count
+            for info, size in zip(segment_info, segment_sizes):
+                writer.uint32(size)  # Setting reference type to 0
+                writer.uint32(info.dur)
+                writer.uint32(0x90000000) # SAP info
+        return writer.getvalue()
+
+    def _generate_moof(self, writer, sequence_nr, seg_info):
+        "Write a moof box with the correct sample entries"
+        moof_start = writer.begin_box('moof')
+        self._generate_mfhd(writer, sequence_nr)
+        data_offset_pos = self._generate_traf(writer, seg_info)
+        moof_size = writer.end_box(moof_start)
+        writer.patch_uint32(data_offset_pos, moof_size + 8)  # 8 bytes into mdat
+
+    def _generate_mfhd(self, writer, sequence_nr):
+        with writer.full_box('mfhd', 0, 0):
+            writer.uint32(sequence_nr)
+
+    def _generate_traf(self, writer, seg_info):
+        "Write a traf box and return the position of the trun data_offset."
+        with writer.box('traf'):
+            self._generate_tfhd(writer, seg_info, self.track_id)
+            self._generate_tfdt(writer, seg_info)
+            data_offset_pos = self._generate_trun(writer, seg_info)
+        return data_offset_pos
+
+    def _generate_tfhd(self, writer, seg_info, track_id):
         ip = self.input_parser
         first_sample = ip.samples[seg_info.start_nr]
         common_size = first_sample.size
@@ -200,79 +192,63 @@ class TrackResegmenter(object):
             if sample.cto != common_cto:
                 common_cto = None
         flags = 0x020000
-        data = ""
+        defaults = []
         sample_flags = 0  # Which individual sample data is needed
         if common_dur is not None:
             flags |= 0x08
-            data += uint32_to_str(common_dur)
+            defaults.append(common_dur)
         else:
             sample_flags |= 0x100
         if common_size is not None:
             flags |= 0x10
-            data += uint32_to_str(common_size)
+            defaults.append(common_size)
         else:
             sample_flags |= 0x200
         if common_flags is not None:
             flags |= 0x20
-            data += uint32_to_str(common_flags)
+            defaults.append(common_flags)
         else:
             sample_flags |= 0x400
         if common_cto is None or common_cto != 0:
             sample_flags |= 0x800
-        size = 16 + len(data)
         self.sample_flags = sample_flags
 
-        version_and_flags = flags
-        return (uint32_to_str(size) + 'tfhd' +
-                uint32_to_str(version_and_flags) +
-                uint32_to_str(track_id) + data)
+        with writer.full_box('tfhd', 0, flags):
+            writer.uint32(track_id)
+            for value in defaults:
+                writer.uint32(value)
 
-    def _generate_tfdt(self, seg_info):
+    def _generate_tfdt(self, writer, seg_info):
         if seg_info.start_time > 2 ** 30:
-            version = 1
-            size = 20
+            with writer.full_box('tfdt', 1, 0):
+                writer.uint64(seg_info.start_time)
         else:
-            version = 0
-            size = 16
-        output = uint32_to_str(size) + 'tfdt'
-        if version == 0:
-            output += uint32_to_str(0x00000000) + uint32_to_str(
-                seg_info.start_time)
-        else:
-            output += uint32_to_str(0x01000000) + uint64_to_str(
-                seg_info.start_time)
-        return output
-
-    def _generate_trun(self, seg_info, offset):
-        "Generate trun box with correct sample data for segment."
-
-        def nr_sample_bytes(sample_flags):
-            nr_bytes = 0
-            for pattern in (0x100, 0x200, 0x400, 0x800):
-                if sample_flags & pattern != 0:
-                    nr_bytes += 4
-            return nr_bytes
+            with writer.full_box('tfdt', 0, 0):
+                writer.uint32(seg_info.start_time)
+
+    def _generate_trun(self, writer, seg_info):
+        """Write trun box with correct sample data for segment.
+
+        The data_offset is written as 0 and its position is returned so
+        that it can be set once the size of the moof is known."""
         version = 1  # Allow for signed cto
         ip = self.input_parser
-        sample_data_size = nr_sample_bytes(self.sample_flags)
         sample_count = seg_info.end_nr - seg_info.start_nr
-        trun_size = 20 + sample_count * sample_data_size
-        output = uint32_to_str(trun_size) + 'trun'
         flags = self.sample_flags | 0x01  # offset present
-        version_and_flags = (version << 24) | flags
-        output += uint32_to_str(version_and_flags)
-        output += uint32_to_str(sample_count)
-        output += uint32_to_str(offset + trun_size + 8)  # 8 bytes into mdat
-        for sample in ip.samples[seg_info.start_nr:seg_info.end_nr]:
-            if self.sample_flags & 0x100:
-                output += uint32_to_str(sample.dur)
-            if self.sample_flags & 0x200:
-                output += uint32_to_str(sample.size)
-            if self.sample_flags & 0x400:
-                output += uint32_to_str(sample.flags)
-            if self.sample_flags & 0x800:
-                output += sint32_to_str(sample.cto)
-        return output
+        fields = [(0x100, 'I', 'dur'), (0x200, 'I', 'size'),
+                  (0x400, 'I', 'flags'), (0x800, 'i', 'cto')]
+        fields = [(code, name) for pattern, code, name in fields
+                  if self.sample_flags & pattern]
+        row_format = '>' + ''.join(code for code, _ in fields)
+        names = [name for _, name in fields]
+        with writer.full_box('trun', version, flags):
+            writer.uint32(sample_count)
+            data_offset_pos = writer.tell()
+            writer.uint32(0)
+            if names:
+                for sample in ip.samples[seg_info.start_nr:seg_info.end_nr]:
+                    writer.pack(row_format, *[getattr(sample, name) for name in names])
+        return data_offset_pos
 
 
 def main():
@@ -1,11 +1,16 @@
-"""Create trick mode segments by removing all other frames than the first."""
+"""Create trick mode segments by removing all other frames than the first.
+
+MPEG-2 TS files are converted to a single I-frame only TS file with the
+key frame index of ts.py."""
 
 import os
 import shutil
 from argparse import ArgumentParser
 
 from mp4filter import MP4Filter
-from structops import str_to_uint32, uint32_to_str, str_to_uint64, uint64_to_str
+from structops import str_to_uint16, str_to_uint32, uint32_to_str, str_to_uint64, uint64_to_str
+from mp4_writer import BoxWriter
+import ts
 
 
 class TrickFilter(MP4Filter):
@@ -15,8 +20,6 @@ class TrickFilter(MP4Filter):
         MP4Filter.__init__(self, file_name)
         self.offset = offset
         self.relevant_boxes = ["moof", "mdat"]
-        self.moof_data = None
-        self.traf_data = None
         self.trun_data = None
 
     def filterbox(self, box_type, data, file_pos, path=""):
@@ -27,24 +30,8 @@ class TrickFilter(MP4Filter):
             path = "%s.%s" % (path, box_type)
         output = ""
         if path in ("moof", "moof.traf"):
-            size, b_type = self.check_box(data)
-            if path == "moof":
-                assert b_type == "moof"
-                self.moof_data = {'pos': file_pos, 'size': size}
-            elif path == "moof.traf":
-                assert b_type == "traf"
-                self.traf_data = {'pos': file_pos, 'size': size}
-            output += data[:8]
-            pos = 8
-            file_pos += 8
-            while pos < len(data):
-                data_len = len(data)
-                sub_data = data[pos:]
-                size, box_type = self.check_box(sub_data)
-                output += self.filterbox(box_type, sub_data[:size], file_pos,
-                                         path)
-                pos += size
-                file_pos += size
+            # The container sizes are updated to the shortened trun
+            output = self.filter_container(data, file_pos, path)
         elif path == "moof.traf.trun": # Our target box
             output = self.process_trun(data)
         elif path == "mdat":
@@ -114,48 +101,31 @@ class TrickFilter(MP4Filter):
         new_data_offset = data_offset - (size - new_size)
 
         # Here starts the trun output
-        output = uint32_to_str(new_size) + data[4:12]
-        output += uint32_to_str(1) # 1 sample
-        output += uint32_to_str(new_data_offset)
+        writer = BoxWriter(new_size)
+        start = writer.begin_box(b_type)
+        writer.write(data[8:12])
+        writer.uint32(1) # 1 sample
+        writer.uint32(new_data_offset)
         pos = entry_offset
         if has_first_sample_flags:
-            output += data[pos:pos + 4]
+            writer.write(data[pos:pos + 4])
             pos += 4
-        output += uint32_to_str(total_duration)
+        writer.uint32(total_duration)
         pos += 4
-        output += data[pos:pos + sample_row_size - 4]
+        writer.write(data[pos:pos + sample_row_size - 4])
+        writer.end_box(start)
 
-        return output
+        return writer.getvalue()
 
     def process_mdat(self, data):
         """Remove all samples but one, and change offset and report size."""
         size, b_type = self.check_box(data)
         assert b_type == "mdat"
         data_size = self.trun_data['first_sample_size']
-        return uint32_to_str(data_size + 8) + "mdat" + data[8: 8 + data_size]
-
-    def finalize(self):
-        "Rewrite the size fields which have changed"
-        op = self.output
-        op_parts = []
-
-        size_reduction = self.trun_data['size'] - self.trun_data['new_size']
-        op_parts.append(op[:self.moof_data['pos']])
-
-        # Write new moof size
-        new_moof_size = self.moof_data['size'] - size_reduction
-        op_parts.append(uint32_to_str(new_moof_size))
-        pos = self.moof_data['pos'] + 4
-        op_parts.append(op[pos:self.traf_data['pos']])
-
-        # Write new traf size
-        new_traf_size = self.traf_data['size'] - size_reduction
-        op_parts.append(uint32_to_str(new_traf_size))
-        pos = self.traf_data['pos'] + 4
-
-        op_parts.append(op[pos:])
-
-        self.output = "".join(op_parts)
+        writer = BoxWriter(data_size + 8)
+        with writer.box(b_type):
+            writer.write(buffer(data, 8, data_size))
+        return writer.getvalue()
 
 
 def convert_directory(input_dir, output_dir):
@@ -175,15 +145,81 @@ def convert_directory(input_dir, output_dir):
                 ofh.write(output)
 
 
+def renumber_cc(packet, cc_map):
+    """Return packet with the next continuity counter of its pid in cc_map."""
+    pid = str_to_uint16(packet[1:3]) & 0x1fff
+    control = ord(packet[3])
+    cc = cc_map.get(pid, 15)
+    if control & 0x10:
+        cc = (cc + 1) % 16
+    cc_map[pid] = cc
+    return packet[:3] + chr((control & 0xf0) | cc) + packet[4:]
+
+
+def convert_ts(in_path, out_path, index=None, start_time=None, end_time=None):
+    """Write the key frames of a TS file between start_time and end_time
+    (seconds) to out_path, each preceded by the PAT and PMT.
+
+    The key frames are found with the key frame index, which is built and
+    saved next to in_path if missing. Return the number of key frames."""
+    if index is None:
+        index = ts.key_frame_index.open(in_path)
+    psi_pids = [ts.PAT_PID, index.pmt_pid]
+    cc_map = {}
+    nr_frames = 0
+    with ts.ts_file_reader(in_path) as reader:
+        data = reader.data
+        psi = {}
+        for chunk_offset, chunk in reader.offset_chunks(0):
+            for offset in xrange(0, len(chunk), ts.TS_PACKET_SIZE):
+                header = str_to_uint16(chunk[offset + 1:offset + 3])
+                pid = header & 0x1fff
+                if pid in psi_pids and header & 0x4000 and pid not in psi:
+                    psi[pid] = chunk[offset:offset + ts.TS_PACKET_SIZE]
+            if len(psi) == len(psi_pids):
+                break
+        with open(out_path, 'wb') as ofh:
+            for entry, time in zip(index.entries, index.times):
+                if start_time is not None and time < start_time:
+                    continue
+                if end_time is not None and time >= end_time:
+                    break
+                packets = [psi[pid] for pid in psi_pids if pid in psi]
+                for offset in xrange(entry.offset, entry.end_offset, reader.packet_size):
+                    packet = data[offset:offset + ts.TS_PACKET_SIZE]
+                    if packet[0] == ts.TS_SYNC_BYTE and \
+                       str_to_uint16(packet[1:3]) & 0x1fff == index.pid:
+                        packets.append(packet)
+                for packet in packets:
+                    ofh.write(renumber_cc(packet, cc_map))
+                nr_frames += 1
+    return nr_frames
+
+
 if __name__ == "__main__":
     parser = ArgumentParser(usage="usage: %(prog)s [options]")
 
     parser.add_argument("-i", "--input-dir", action="store",
-                        dest="input_dir", help="Input directory",
-                        required=True)
+                        dest="input_dir", help="Input directory")
+
+    parser.add_argument("-t", "--ts-input", action="store",
+                        dest="ts_input", help="Input TS file")
+
+    parser.add_argument("--start-time", action="store", type=float,
+                        dest="start_time", help="Start time (s) in the TS file")
+
+    parser.add_argument("--end-time", action="store", type=float,
+                        dest="end_time", help="End time (s) in the TS file")
 
     parser.add_argument("-o", "--output-door", action="store",
                         dest="output_dir", help="Output dir",
                         required=True)
     args = parser.parse_args()
-    convert_directory(args.input_dir, args.output_dir)
+    if args.ts_input:
+        out_path = os.path.join(args.output_dir, os.path.basename(args.ts_input))
+        print "Converting %s -> %s" % (args.ts_input, out_path)
+        convert_ts(args.ts_input, out_path, None, args.start_time, args.end_time)
+    elif args.input_dir:
+        convert_directory(args.input_dir, args.output_dir)
+    else:
+        parser.error("an input directory or TS file is required")
@@ -37,15 +37,25 @@ MPEG2 Transport Stream parser
 #pylint: disable=missing-docstring
 #pylint: disable=line-too-long
 
+import os
+import sys
+import mmap
 import time
+import errno
 import struct
 import socket
+import Queue
 import select
 import httplib
+import json
+import bisect
 import binascii
 import optparse
 import urlparse
 import datetime
+import threading
+import collections
+import multiprocessing
 
 class Logger(object):
     "Simple log class where output can be turned off."
@@ -74,6 +84,11 @@ except ImportError as e:
     log("Warning: Couldn't import cea708. Parsing disabled.")
     cea708 = None
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 FILTER = ''.join([(len(repr(chr(character))) == 3) and chr(character) or '.' for character in range(256)])
 def dump_hex(src, length=8):
     result = []
@@ -197,64 +212,145 @@ def get_stream_type(stream_type):
         return STREAM_TYPES.get(stream_type)
     return 'unknown'
 
-def create_socket(port, host):
+UDP_RECEIVE_BUFFER_SIZE = 8 * 1024 * 1024
+
+def is_multicast(host):
+    return 224 <= int(host.split('.')[0]) <= 239
+
+def create_socket(port, host, receive_buffer_size=UDP_RECEIVE_BUFFER_SIZE):
+    """Create a UDP socket bound to port that has joined the group host if it
+    is a multicast address. The kernel may use a smaller receive buffer than
+    asked for, see net.core.rmem_max."""
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
     sock.bind(('', port))
-    mreq = struct.pack("=4sl", socket.inet_aton(host), socket.INADDR_ANY)
-    #sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    if is_multicast(host):
+        mreq = struct.pack("=4sl", socket.inet_aton(host), socket.INADDR_ANY)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
     return sock
 
+def socket_drops(sock):
+    """Return the number of datagrams the kernel dropped for sock because its
+    receive buffer was full, or None if that is not known (Linux only)."""
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    try:
+        with open('/proc/net/udp') as f:
+            lines = f.readlines()[1:]
+    except IOError:
+        return None
+    for line in lines:
+        fields = line.split()
+        if len(fields) > 12 and fields[9] == inode:
+            return int(fields[12])
+    return None
+
 class bitreader(object):
+    """MSB-first bit reader.
+
+    Bits are taken from an integer window that is refilled eight bytes at
+    a time, so get_bits does a shift and a mask instead of a loop per bit.
+    Reading past the end of the buffer returns zero bits.
+    index is the 1-based position of the byte holding the next bit."""
     def __init__(self, buffer):
         self.buffer = buffer
-        self.bit_pos = 7
-        self.byte = struct.unpack("B", self.buffer[0])[0]
-        self.index = 1
+        self.size = len(buffer)
+        self.pos = 0        # byte position of the next refill
+        self.window = 0     # unread bits, right aligned
+        self.bits = 0       # number of unread bits in window
+
+    @property
+    def index(self):
+        return (self.pos * 8 - self.bits) // 8 + 1
+
+    def _refill(self):
+        if self.pos + 8 <= self.size:
+            value = struct.unpack_from('>Q', self.buffer, self.pos)[0]
+        else:
+            tail = str(self.buffer[self.pos:self.pos + 8])
+            value = struct.unpack('>Q', tail + '\0' * (8 - len(tail)))[0]
+        self.window = (self.window << 64) | value
+        self.bits += 64
+        self.pos += 8
 
     def get_bits(self, num_bits):
-        num = 0
-        mask = 1 <<self.bit_pos
-        while num_bits:
-            num_bits -= 1
-            num <<= 1
-            if self.byte & mask:
-                num |= 1
-            mask >>= 1
-            self.bit_pos -= 1
-            if self.bit_pos < 0:
-                self.bit_pos = 7
-                mask = 1 <<self.bit_pos
-                if self.index < len(self.buffer):
-                    self.byte = struct.unpack("B", self.buffer[self.index])[0]
-                else:
-                    self.byte = 0
-                self.index += 1
+        while self.bits < num_bits:
+            self._refill()
+        self.bits -= num_bits
+        num = self.window >> self.bits
+        self.window &= (1 << self.bits) - 1
         return num
 
+    def _read_aligned(self, fmt, num_bytes):
+        if self.bits >= num_bytes * 8:
+            return self.get_bits(num_bytes * 8)
+        if self.bits == 0 and self.pos + num_bytes <= self.size:
+            self.pos += num_bytes
+            return struct.unpack_from(fmt, self.buffer, self.pos - num_bytes)[0]
+        return self.get_bits(num_bytes * 8)
+
+    def read_u8(self):
+        return self._read_aligned('>B', 1)
+
+    def read_u16(self):
+        return self._read_aligned('>H', 2)
+
+    def read_u32(self):
+        return self._read_aligned('>I', 4)
+
+    def skip_bits(self, num_bits):
+        if num_bits <= self.bits:
+            self.bits -= num_bits
+            self.window &= (1 << self.bits) - 1
+            return
+        num_bits -= self.bits
+        self.window = 0
+        self.bits = 0
+        self.pos += num_bits // 8
+        self.get_bits(num_bits % 8)
+
+    def read_ue(self):
+        "Read an unsigned Exp-Golomb code."
+        leading_zero_bits = 0
+        while not self.window:
+            if self.pos >= self.size:
+                raise ValueError('Exp-Golomb code runs past end of data')
+            leading_zero_bits += self.bits
+            self.bits = 0
+            self._refill()
+        zeros = self.bits - self.window.bit_length()
+        leading_zero_bits += zeros
+        self.bits -= zeros + 1
+        self.window &= (1 << self.bits) - 1
+        return (1 << leading_zero_bits) - 1 + self.get_bits(leading_zero_bits)
+
+    def read_se(self):
+        "Read a signed Exp-Golomb code."
+        k = self.read_ue()
+        if k & 1:
+            return (k + 1) >> 1
+        return -(k >> 1)
+
     def step_bytes(self, bytes):
-        data = self.buffer[self.index - 1: self.index - 1 + bytes]
-        for i in range(bytes):
-            self.get_bits(8)
+        start = self.index - 1
+        data = self.buffer[start: start + bytes]
+        self.skip_bits(bytes * 8)
         return data
 
     def trim(self):
-        bits_to_trim = 7 - self.bit_pos
-        self.get_bits(bits_to_trim)
+        self.skip_bits(self.bits % 8)
 
     def tell(self):
         return self.index
 
     def seek(self, idx):
-        self.index += idx
+        self.skip_bits(idx * 8)
 
 def ue(reader):
-    leading_zero_bits = -1
-    b = 0
-    while not b:
-        leading_zero_bits += 1
-        b = reader.get_bits(1)
-    return 2**leading_zero_bits - 1 + reader.get_bits(leading_zero_bits)
+    return reader.read_ue()
+
+def se(reader):
+    return reader.read_se()
 
 def print_bits(text, num, display, to_hex=False):
     if not display:
@@ -288,13 +384,11 @@ class frame(object):
                     self.dts / 90.0,
                     self.pts - self.dts)
 
-cc_map = {}
-
 #
 # TS packet parser
 #
 class ts_packet(object):
-    def __init__(self, data, display=False, check_cc=False):
+    def __init__(self, data, display=False, check_cc=False, cc_map=None):
         self.reader = bitreader(data)
         self.data = data
 
@@ -311,21 +405,17 @@ class ts_packet(object):
         self.adaptation_field_exist         = read_bits(self.reader,  2, '  adaptation field exist', display)
         self.continuity_counter             = read_bits(self.reader,  4, '  continuity counter', display)
 
-        global cc_map
-        if not cc_map.has_key(self.pid):
-            cc_map[self.pid] = -1
-
-        if cc_map[self.pid] >= 0:
-            cc_map[self.pid] = cc_map[self.pid] + 1
-            if cc_map[self.pid] > 15:
-                cc_map[self.pid] = 0
-
-            if check_cc:
-                if not self.continuity_counter == cc_map[self.pid]:
-                    #print 'CC error:', self.continuity_counter, ' != ', cc_map[self.pid]
-	                pass
-
-        cc_map[self.pid] = self.continuity_counter
+        # cc_map holds the continuity state of the last packet per PID of one stream
+        self.cc_error = False
+        self.cc_repeated = False
+        if cc_map is not None and self.pid != STUFFING_PID and not self.transport_error_indicator:
+            discontinuity = self.adaptation_field_exist & 0x02 and ord(data[4]) and ord(data[5]) & 0x80
+            state = continuity_state(self.continuity_counter, self.adaptation_field_exist & 0x01,
+                                     discontinuity, cc_map.get(self.pid))
+            if check_cc and self.pid in cc_map:
+                self.cc_error = bool(state & CC_ERROR)
+                self.cc_repeated = bool(state & CC_REPEATED)
+            cc_map[self.pid] = state & ~CC_ERROR
 
         if (self.adaptation_field_exist == 2) or (self.adaptation_field_exist == 3):
             tell_1 = self.reader.index
@@ -373,6 +463,280 @@ class ts_packet(object):
                 return True
         return False
 
+#
+# Vectorized TS packet header parsing
+#
+TS_PACKET_SIZE = 188
+ZERO_DATA_START = [0x00, 0x00, 0x01, 0xBE]
+
+ts_headers = collections.namedtuple('ts_headers',
+                                    'transport_error_indicator payload_unit_start_indicator pid '
+                                    'adaptation_field_exist continuity_counter payload_start zero_data '
+                                    'discontinuity_indicator')
+
+def packet_array(data):
+    """View the whole packets at the start of data as an (N, 188) uint8 array.
+
+    The array stops before the first packet without sync byte."""
+    nr_packets = len(data) // TS_PACKET_SIZE
+    packets = np.frombuffer(data, np.uint8, nr_packets * TS_PACKET_SIZE).reshape(nr_packets, TS_PACKET_SIZE)
+    bad_sync = np.flatnonzero(packets[:, 0] != 0x47)
+    if len(bad_sync):
+        packets = packets[:bad_sync[0]]
+    return packets
+
+#
+# Packet sync
+#
+TS_SYNC_BYTE = '\x47'
+# 188-byte TS, 192-byte M2TS packets with a 4-byte timecode prefix and
+# 204-byte packets with 16 Reed-Solomon parity bytes
+PACKET_SIZES = (188, 192, 204)
+SYNC_PACKETS = 3
+SYNC_SEARCH_BYTES = 64 * 1024
+
+def count_synced(data, offset, count, stride=TS_PACKET_SIZE):
+    "Return how many of the count packets stride bytes apart from offset start with a sync byte."
+    if not count:
+        return 0
+    if np is not None:
+        syncs = np.frombuffer(data, np.uint8, (count - 1) * stride + 1, offset)[::stride]
+        bad_sync = np.flatnonzero(syncs != 0x47)
+        if len(bad_sync):
+            return int(bad_sync[0])
+        return count
+    for i in xrange(count):
+        if data[offset + i * stride] != TS_SYNC_BYTE:
+            return i
+    return count
+
+def find_sync(data, offset=0, end=None, packet_sizes=PACKET_SIZES, nr_packets=SYNC_PACKETS):
+    """Return (offset, packet size) of the first position from offset where
+    nr_packets packets of one of packet_sizes start with a sync byte, or
+    (-1, None). Only the bytes before end are looked at. With NumPy the
+    candidates in a window of SYNC_SEARCH_BYTES are checked all at once."""
+    if end is None:
+        end = len(data)
+    if np is not None:
+        while offset < end:
+            length = min(end - offset, SYNC_SEARCH_BYTES + (nr_packets - 1) * max(packet_sizes))
+            window = np.frombuffer(data, np.uint8, length, offset)
+            candidates = np.flatnonzero(window[:SYNC_SEARCH_BYTES] == 0x47)
+            found = None
+            for size in packet_sizes:
+                c = candidates[candidates < length - (nr_packets - 1) * size]
+                if found is not None:
+                    c = c[c < found[0]]
+                for i in xrange(1, nr_packets):
+                    c = c[window[c + i * size] == 0x47]
+                if len(c):
+                    found = int(c[0]), size
+            if found is not None:
+                return found[0] + offset, found[1]
+            offset += SYNC_SEARCH_BYTES
+        return -1, None
+    if not hasattr(data, 'find'):
+        data = str(data)
+    offset = data.find(TS_SYNC_BYTE, offset)
+    while 0 <= offset < end:
+        for size in packet_sizes:
+            if offset + (nr_packets - 1) * size < end and \
+               all(data[offset + i * size] == TS_SYNC_BYTE for i in xrange(1, nr_packets)):
+                return offset, size
+        offset = data.find(TS_SYNC_BYTE, offset + 1)
+    return -1, None
+
+def pack_packets(data, offset, count, stride):
+    """Return the 188-byte packets of count packets stride bytes apart from
+    offset as one string, without their prefix or parity bytes."""
+    if np is not None:
+        view = np.frombuffer(data, np.uint8, (count - 1) * stride + TS_PACKET_SIZE, offset)
+        return np.lib.stride_tricks.as_strided(view, (count, TS_PACKET_SIZE), (stride, 1)).tobytes()
+    return ''.join([data[offset + i * stride:offset + i * stride + TS_PACKET_SIZE] for i in xrange(count)])
+
+class packet_sync(object):
+    """Turns a stream of TS data into whole 188-byte packets.
+
+    The packet size is detected from the spacing of the sync bytes, and
+    the M2TS timecode prefix or the RS parity bytes are stripped. After a
+    packet without sync byte the data is searched for the next position
+    with sync bytes in SYNC_PACKETS consecutive packets, and lost_sync is
+    counted. Partial packets are kept for the next call, and clean 188-byte
+    data is returned as is.
+
+    runs maps the returned packets back to the input stream: it holds
+    (packet index, stream byte position, packet size) for every run of
+    packets that were consecutive in the input."""
+    def __init__(self, packet_sizes=PACKET_SIZES):
+        self.packet_sizes = packet_sizes
+        self.packet_size = None
+        self.lost_sync = 0
+        self.skipped_bytes = 0
+        self.pending = ''
+        self.position = 0
+        self.runs = []
+
+    def add(self, data):
+        "Return the whole packets of the kept data followed by data."
+        if self.pending:
+            data = self.pending + str(data)
+            self.pending = ''
+        size = len(data)
+        offset = 0
+        packets = []
+        self.runs = []
+        nr_packets = 0
+        while True:
+            if self.packet_size is None:
+                found, self.packet_size = find_sync(data, offset, size, self.packet_sizes)
+                if found < 0:
+                    # keep the bytes that could start a sync not yet confirmed
+                    keep = max(offset, size - (SYNC_PACKETS - 1) * max(self.packet_sizes))
+                    self.skipped_bytes += keep - offset
+                    offset = keep
+                    break
+                self.skipped_bytes += found - offset
+                offset = found
+            stride = self.packet_size
+            count = (size - offset) // stride
+            synced = count_synced(data, offset, count, stride)
+            if synced:
+                self.runs.append((nr_packets, self.position + offset, stride))
+                nr_packets += synced
+                if stride != TS_PACKET_SIZE:
+                    packets.append(pack_packets(data, offset, synced, stride))
+                elif offset or synced * stride != size:
+                    packets.append(buffer(data, offset, synced * stride))
+                else:
+                    packets.append(data)
+                offset += synced * stride
+            if synced == count:
+                break
+            self.lost_sync += 1
+            self.packet_size = None
+        if offset < size:
+            self.pending = str(buffer(data, offset))
+        self.position += offset
+        if len(packets) == 1:
+            return packets[0]
+        return ''.join([str(p) for p in packets])
+
+    def flush(self):
+        "Return the last packet if it is only missing its parity or the next prefix."
+        data = self.pending
+        self.pending = ''
+        self.runs = []
+        if self.packet_size is not None and len(data) >= TS_PACKET_SIZE and data[0] == TS_SYNC_BYTE:
+            self.runs.append((0, self.position, self.packet_size))
+            self.skipped_bytes += len(data) - TS_PACKET_SIZE
+            return data[:TS_PACKET_SIZE]
+        self.skipped_bytes += len(data)
+        return ''
+
+def packet_headers(packets):
+    """Extract the TS header fields of all packets in an (N, 188) array at once.
+
+    payload_start is the offset of the payload in each packet (188 for no
+    payload), zero_data flags payloads starting with 00 00 01 BE and
+    discontinuity_indicator is the flag of the adaptation field."""
+    byte1 = packets[:, 1]
+    byte3 = packets[:, 3]
+    pid = ((byte1 & 0x1f).astype(np.int32) << 8) | packets[:, 2]
+    adaptation_field_exist = (byte3 >> 4) & 0x03
+    has_adaptation = (adaptation_field_exist & 0x02) != 0
+    payload_start = np.where(has_adaptation, 5 + packets[:, 4].astype(np.int32), 4)
+    np.minimum(payload_start, TS_PACKET_SIZE, out=payload_start)
+
+    rows = np.arange(len(packets))
+    first = np.minimum(payload_start, TS_PACKET_SIZE - 4)
+    zero_data = payload_start < TS_PACKET_SIZE - 3
+    for i, value in enumerate(ZERO_DATA_START):
+        zero_data &= packets[rows, first + i] == value
+    discontinuity_indicator = has_adaptation & (packets[:, 4] > 0) & ((packets[:, 5] & 0x80) != 0)
+
+    return ts_headers(byte1 >> 7,
+                      (byte1 >> 6) & 0x01,
+                      pid,
+                      adaptation_field_exist,
+                      byte3 & 0x0f,
+                      payload_start,
+                      zero_data,
+                      discontinuity_indicator)
+
+# Continuity state of a packet as kept in cc_map: the counter and flags
+CC_HAS_PAYLOAD = 0x10
+CC_REPEATED = 0x20
+CC_ERROR = 0x40
+
+def continuity_state(cc, has_payload, discontinuity, previous):
+    """Return the continuity state of a packet given the state of the
+    previous packet of its PID (None for the first one).
+
+    A packet with payload increments the counter, and may be sent once more
+    with the same counter as a duplicate. A packet without payload repeats
+    the counter. The check is skipped after a discontinuity indicator."""
+    state = cc | (has_payload and CC_HAS_PAYLOAD or 0)
+    if previous is None or discontinuity:
+        return state
+    previous_cc = previous & 0x0f
+    if has_payload and previous & CC_HAS_PAYLOAD and cc == previous_cc:
+        state |= CC_REPEATED
+        if previous & CC_REPEATED:
+            state |= CC_ERROR
+    elif cc != (previous_cc + (has_payload and 1 or 0)) % 16:
+        state |= CC_ERROR
+    return state
+
+def find_cc_errors(headers, cc_map, mask=None):
+    """Check the continuity counters of the packets in headers per PID.
+
+    This follows continuity_state for all packets at once: the packets are
+    sorted by PID and each is compared with the one before it. cc_map holds
+    the state of the last packet per PID and is updated, so the check
+    continues across calls. Return two dicts mapping a PID to the indices
+    of its packets with a CC error and of its duplicate packets."""
+    pid = headers.pid
+    indices = np.flatnonzero(pid != STUFFING_PID if mask is None else mask & (pid != STUFFING_PID))
+    errors = {}
+    duplicates = {}
+    if not len(indices):
+        return errors, duplicates
+    order = indices[np.argsort(pid[indices], kind='mergesort')]
+    pids = pid[order]
+    cc = headers.continuity_counter[order].astype(np.int32)
+    has_payload = (headers.adaptation_field_exist[order] & 0x01).astype(bool)
+    discontinuity = headers.discontinuity_indicator[order].astype(bool)
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(pids)) + 1))
+    ends = np.concatenate((starts[1:], [len(order)])) - 1
+    previous = np.empty_like(cc)
+    previous[1:] = cc[:-1] | np.where(has_payload[:-1], CC_HAS_PAYLOAD, 0)
+    previous[starts] = [cc_map.get(p, -1) for p in pids[starts].tolist()]
+    known = (previous >= 0) & ~discontinuity
+    previous_cc = previous & 0x0f
+
+    repeated = known & has_payload & ((previous & CC_HAS_PAYLOAD) != 0) & (cc == previous_cc)
+    previous_repeated = np.empty_like(repeated)
+    previous_repeated[1:] = repeated[:-1]
+    previous_repeated[starts] = (previous[starts] >= 0) & ((previous[starts] & CC_REPEATED) != 0)
+    error = known & np.where(repeated, previous_repeated, cc != (previous_cc + has_payload) % 16)
+
+    state = cc | np.where(has_payload, CC_HAS_PAYLOAD, 0) | np.where(repeated, CC_REPEATED, 0)
+    for p, value in zip(pids[ends].tolist(), state[ends].tolist()):
+        cc_map[p] = value
+    for result, flags in ((errors, error), (duplicates, repeated & ~error)):
+        found = np.flatnonzero(flags)
+        if len(found):
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(pids[found])) + 1, [len(found)])).tolist()
+            for first, last in zip(bounds[:-1], bounds[1:]):
+                result[int(pids[found[first]])] = order[found[first:last]]
+    return errors, duplicates
+
+def count_cc_errors(headers, cc_map, mask=None):
+    "Like find_cc_errors, but return a dict with the number of errors per PID."
+    errors = find_cc_errors(headers, cc_map, mask)[0]
+    return dict((p, len(e)) for p, e in errors.iteritems())
+
 class pmt_info(object):
     def __init__(self, program_num, reserved, program_pid):
         self.program_num = program_num
@@ -893,64 +1257,114 @@ class SCTE35(ts_packet):
 #
 # PES parser
 #
+PES_HEADER = struct.Struct('>HBBHBBB')
+PES_TIMESTAMP = struct.Struct('>BHH')
+
+def parse_pes_timestamp(data, offset):
+    "Return the 33-bit PTS or DTS coded in the 5 bytes at offset."
+    high, middle, low = PES_TIMESTAMP.unpack_from(data, offset)
+    return (((high >> 1) & 0x07) << 30) | ((middle >> 1) << 15) | (low >> 1)
+
 class pes(object):
+    """A PES packet being assembled from TS packet payloads.
+
+    The payloads are collected in a list and joined once when data or
+    payload is first used, so a large PES is not copied for every packet."""
     def __init__(self, data, display=False):
-        self.reader = bitreader(data)
-        self.data = data
+        self.fragments = [data]
+        self.num_bytes = len(data)
         self.pts = 0.0
         self.dts = 0.0
 
         if display:
-            log('')
-            log('[PACKETIZED ELEMENTARY STREAM]')
+            self.reader = bitreader(data)
+            self._parse_header_bits()
+        else:
+            self._parse_header(data)
+        self.header_len = self.payload_offset
+
+    def _parse_header(self, data):
+        header = data[:19]
+        if len(header) < 19:
+            header = str(header).ljust(19, '\0')
+        (prefix_high, prefix_low, self.stream_id, self.pes_packet_length,
+         flags_1, flags_2, self.pes_header_length) = PES_HEADER.unpack_from(header)
+        self.packet_start_prefix = (prefix_high << 8) | prefix_low
+        self.marker_bits                = flags_1 >> 6
+        self.scrambling_control         = (flags_1 >> 4) & 0x03
+        self.priority                   = (flags_1 >> 3) & 0x01
+        self.data_alignment_indicator   = (flags_1 >> 2) & 0x01
+        self.copyright                  = (flags_1 >> 1) & 0x01
+        self.original_or_copy           = flags_1 & 0x01
+        self.pts_dts_indicator          = flags_2 >> 6
+        self.escr_flag                  = (flags_2 >> 5) & 0x01
+        self.es_rate_flag               = (flags_2 >> 4) & 0x01
+        self.dsm_trick_mode_flag        = (flags_2 >> 3) & 0x01
+        self.additional_copy_info_flag  = (flags_2 >> 2) & 0x01
+        self.crc_flag                   = (flags_2 >> 1) & 0x01
+        self.extension_flag             = flags_2 & 0x01
+
+        timestamp_bytes = 0
+        if self.pts_dts_indicator == 0x02:
+            self.pts = parse_pes_timestamp(header, 9)
+            timestamp_bytes = 5
+        elif self.pts_dts_indicator == 0x03:
+            self.pts = parse_pes_timestamp(header, 9)
+            self.dts = parse_pes_timestamp(header, 14)
+            timestamp_bytes = 10
+        self.payload_offset = 9 + max(self.pes_header_length, timestamp_bytes)
 
-        self.packet_start_prefix    = read_bits(self.reader, 24, '  packet start prefix', display)
-        self.stream_id              = read_bits(self.reader, 8,  '  stream id', display)
-        self.pes_packet_length      = read_bits(self.reader, 16, '  pes packet length', display)
+    def _parse_header_bits(self):
+        log('')
+        log('[PACKETIZED ELEMENTARY STREAM]')
+
+        self.packet_start_prefix    = read_bits(self.reader, 24, '  packet start prefix', True)
+        self.stream_id              = read_bits(self.reader, 8,  '  stream id', True)
+        self.pes_packet_length      = read_bits(self.reader, 16, '  pes packet length', True)
 
         # check if we have optional pes header
-        self.marker_bits                = read_bits(self.reader, 2,  '  marker bits (2)', display)
-        self.scrambling_control         = read_bits(self.reader, 2,  '  scrambling control', display)
-        self.priority                   = read_bits(self.reader, 1,  '  priority', display)
-        self.data_alignment_indicator   = read_bits(self.reader, 1,  '  data alignment indicator', display)
-        self.copyright                  = read_bits(self.reader, 1,  '  copyright', display)
-        self.original_or_copy           = read_bits(self.reader, 1,  '  original or copy', display)
-        self.pts_dts_indicator          = read_bits(self.reader, 2,  '  pts dts indicator', display)
-        self.escr_flag                  = read_bits(self.reader, 1,  '  escr flag', display)
-        self.es_rate_flag               = read_bits(self.reader, 1,  '  es rate flag', display)
-        self.dsm_trick_mode_flag        = read_bits(self.reader, 1,  '  dsm trick mode flag', display)
-        self.additional_copy_info_flag  = read_bits(self.reader, 1,  '  additional copy info flag', display)
-        self.crc_flag                   = read_bits(self.reader, 1,  '  pes crc flag', display)
-        self.extension_flag             = read_bits(self.reader, 1,  '  pes extension flag', display)
-        self.pes_header_length          = read_bits(self.reader, 8,  '  pes header length', display)
+        self.marker_bits                = read_bits(self.reader, 2,  '  marker bits (2)', True)
+        self.scrambling_control         = read_bits(self.reader, 2,  '  scrambling control', True)
+        self.priority                   = read_bits(self.reader, 1,  '  priority', True)
+        self.data_alignment_indicator   = read_bits(self.reader, 1,  '  data alignment indicator', True)
+        self.copyright                  = read_bits(self.reader, 1,  '  copyright', True)
+        self.original_or_copy           = read_bits(self.reader, 1,  '  original or copy', True)
+        self.pts_dts_indicator          = read_bits(self.reader, 2,  '  pts dts indicator', True)
+        self.escr_flag                  = read_bits(self.reader, 1,  '  escr flag', True)
+        self.es_rate_flag               = read_bits(self.reader, 1,  '  es rate flag', True)
+        self.dsm_trick_mode_flag        = read_bits(self.reader, 1,  '  dsm trick mode flag', True)
+        self.additional_copy_info_flag  = read_bits(self.reader, 1,  '  additional copy info flag', True)
+        self.crc_flag                   = read_bits(self.reader, 1,  '  pes crc flag', True)
+        self.extension_flag             = read_bits(self.reader, 1,  '  pes extension flag', True)
+        self.pes_header_length          = read_bits(self.reader, 8,  '  pes header length', True)
 
         pos_1 = self.reader.tell()
 
         if self.pts_dts_indicator == 0x02:
-            self.pts_dts_marker_1   = read_bits(self.reader,  4, '   marker (2)', display)
-            self.pts_a              = read_bits(self.reader,  3, '   pts 1(3)', display)
-            self.pts_dts_marker_2   = read_bits(self.reader,  1, '   marker', display)
-            self.pts_b              = read_bits(self.reader, 15, '   pts 2(3)', display)
-            self.pts_dts_marker_3   = read_bits(self.reader,  1, '   marker', display)
-            self.pts_c              = read_bits(self.reader, 15, '   pts 3(3)', display)
-            self.pts_dts_marker_4   = read_bits(self.reader,  1, '   marker', display)
+            self.pts_dts_marker_1   = read_bits(self.reader,  4, '   marker (2)', True)
+            self.pts_a              = read_bits(self.reader,  3, '   pts 1(3)', True)
+            self.pts_dts_marker_2   = read_bits(self.reader,  1, '   marker', True)
+            self.pts_b              = read_bits(self.reader, 15, '   pts 2(3)', True)
+            self.pts_dts_marker_3   = read_bits(self.reader,  1, '   marker', True)
+            self.pts_c              = read_bits(self.reader, 15, '   pts 3(3)', True)
+            self.pts_dts_marker_4   = read_bits(self.reader,  1, '   marker', True)
             self.pts = (self.pts_a << 30) + (self.pts_b << 15) + (self.pts_c)
             #log('   pts: %s' % (int(self.pts) / 90000.0))
         elif self.pts_dts_indicator == 0x03:
-            self.pts_dts_marker_5   = read_bits(self.reader,  4, '   marker (3)', display)
-            self.pts_a              = read_bits(self.reader,  3, '   pts 1(3)', display)
-            self.pts_dts_marker_6   = read_bits(self.reader,  1, '   marker', display)
-            self.pts_b              = read_bits(self.reader, 15, '   pts 2(3)', display)
-            self.pts_dts_marker_7   = read_bits(self.reader,  1, '   marker', display)
-            self.pts_c              = read_bits(self.reader, 15, '   pts 3(3)', display)
-            self.pts_dts_marker_8   = read_bits(self.reader,  1, '   marker', display)
-            self.pts_dts_marker_9   = read_bits(self.reader,  4, '   marker (1)', display)
-            self.dts_a              = read_bits(self.reader,  3, '   dts 1(3)', display)
-            self.pts_dts_marker_10  = read_bits(self.reader,  1, '   marker', display)
-            self.dts_b              = read_bits(self.reader, 15, '   dts 2(3)', display)
-            self.pts_dts_marker_11  = read_bits(self.reader,  1, '   marker', display)
-            self.dts_c              = read_bits(self.reader, 15, '   dts 3(3)', display)
-            self.pts_dts_marker_12  = read_bits(self.reader,  1, '   marker', display)
+            self.pts_dts_marker_5   = read_bits(self.reader,  4, '   marker (3)', True)
+            self.pts_a              = read_bits(self.reader,  3, '   pts 1(3)', True)
+            self.pts_dts_marker_6   = read_bits(self.reader,  1, '   marker', True)
+            self.pts_b              = read_bits(self.reader, 15, '   pts 2(3)', True)
+            self.pts_dts_marker_7   = read_bits(self.reader,  1, '   marker', True)
+            self.pts_c              = read_bits(self.reader, 15, '   pts 3(3)', True)
+            self.pts_dts_marker_8   = read_bits(self.reader,  1, '   marker', True)
+            self.pts_dts_marker_9   = read_bits(self.reader,  4, '   marker (1)', True)
+            self.dts_a              = read_bits(self.reader,  3, '   dts 1(3)', True)
+            self.pts_dts_marker_10  = read_bits(self.reader,  1, '   marker', True)
+            self.dts_b              = read_bits(self.reader, 15, '   dts 2(3)', True)
+            self.pts_dts_marker_11  = read_bits(self.reader,  1, '   marker', True)
+            self.dts_c              = read_bits(self.reader, 15, '   dts 3(3)', True)
+            self.pts_dts_marker_12  = read_bits(self.reader,  1, '   marker', True)
             self.pts = (self.pts_a << 30) + (self.pts_b << 15) + (self.pts_c)
             self.dts = (self.dts_a << 30) + (self.dts_b << 15) + (self.dts_c)
             #log('   pts: %s' % (int(self.pts) / 90000.0))
@@ -966,12 +1380,16 @@ class pes(object):
 
         # parse further...
         self.payload_offset = self.reader.index - 1
-        self.header_len = self.reader.index - 1
-        #print 'PES Header Lengths:', 9 + self.pes_header_length, self.header_len
-        #log(dump_hex(self.payload[0:10*16], 16))
 
     def add_data(self, data):
-        self.data += data
+        self.fragments.append(data)
+        self.num_bytes += len(data)
+
+    @property
+    def data(self):
+        if len(self.fragments) > 1:
+            self.fragments = [''.join(self.fragments)]
+        return self.fragments[0]
 
     @property
     def payload(self):
@@ -979,7 +1397,7 @@ class pes(object):
 
     @property
     def size(self):
-        return len(self.data) - 6
+        return self.num_bytes - 6
 
 #
 # TS Importer Observer interface
@@ -995,10 +1413,16 @@ class observer(object):
         pass
     def get_scte35_pids(self):
         return set()
+    def get_cc_summaries(self):
+        return []
+    def get_frame_counts(self):
+        return {}
 
 #
 # TS importer
 #
+CC_ERROR_POSITIONS = 100
+
 class ts_importer(object):
     def __init__(self, observer, options, log_cc=False):
         self.preflight_packets = 0
@@ -1018,6 +1442,16 @@ class ts_importer(object):
         self.num_stuffing_packets = 0
         self.pid_counter = {}
         self.packet_errors = 0
+        self.cc_map = {}
+        self.cc_errors = collections.defaultdict(int)
+        self.cc_error_positions = collections.defaultdict(list)
+        self.duplicate_packets = collections.defaultdict(int)
+        self.transport_errors = collections.defaultdict(int)
+        self.timing = None
+        self.packet_sync = packet_sync()
+        self.packet_size = None
+        self.lost_sync = 0
+        self.runs = [(0, 0, TS_PACKET_SIZE)]
 
         self.first_pts = 0
         self.last_pts = 0
@@ -1026,6 +1460,7 @@ class ts_importer(object):
 
     # Use the preflight for vod to get pat and pmt
     def preflight(self, data):
+        data = packet_sync().add(data)
         offset = 0
         pids = {}
         while offset < len(data) and ord(data[offset]) == 0x47:
@@ -1052,6 +1487,8 @@ class ts_importer(object):
             if self.has_pmt and self.preflight_packets > 100:
                 return True
 
+        if self.has_pmt:
+            return True
         log('pids found: %s' % pids)
         raise Exception('Could not find pat/pmt during preflight')
 
@@ -1059,10 +1496,38 @@ class ts_importer(object):
         if not self.pids.has_key(pid):
             self.pids[pid] = None
 
-    def add_data(self, data):
+    def add_data(self, data, position=None):
+        """Parse the TS data in data. position is the file offset of data when
+        it is a run of whole packets of packet_size bytes, as generated by
+        ts_file_reader.offset_chunks, else positions are counted in the
+        stream given to add_data."""
+        data = self.packet_sync.add(data)
+        if position is None:
+            self.runs = self.packet_sync.runs
+        else:
+            self.runs = [(0, position, self.packet_size or TS_PACKET_SIZE)]
+        self._add_packets(data)
+
+    def _add_packets(self, data):
+        "Parse whole 188-byte packets."
+        if not data:
+            return
+        if self.timing is not None:
+            self.timing.add_data(data)
+        if np is not None and self.options['verbose'] < 2:
+            self._add_data_vectorized(data)
+        else:
+            self._add_data_packets(data)
+
+    def _add_data_packets(self, data):
+        "Parse one ts_packet at a time. Used without NumPy and for PES and packet display."
         offset = 0
         while offset + 188 <= len(data) and ord(data[offset]) == 0x47:
-            packet = ts_packet(data[offset:offset+188], display=self.options['verbose'] >= 3, check_cc=True)
+            packet = ts_packet(data[offset:offset+188], display=self.options['verbose'] >= 3, check_cc=True, cc_map=self.cc_map)
+            if packet.cc_error:
+                self._add_cc_errors(packet.pid, [offset // 188])
+            elif packet.cc_repeated:
+                self.duplicate_packets[packet.pid] += 1
             #log(dump_hex(packet.data, 16))
 
             if not self.pid_counter.has_key(packet.pid):
@@ -1077,6 +1542,10 @@ class ts_importer(object):
 
             if packet.transport_error_indicator:
                 self.packet_errors += 1
+                self.transport_errors[packet.pid] += 1
+            elif packet.cc_repeated:
+                # A duplicate packet is discarded
+                pass
             elif packet.pid == PAT_PID:
                 self._handle_pat(packet)
             elif packet.pid == CA_PID:
@@ -1105,7 +1574,7 @@ class ts_importer(object):
                     if self.pids[packet.pid]:
                         if self.pids[packet.pid].pes_packet_length:
                             if self.pids[packet.pid].pes_packet_length != self.pids[packet.pid].size:
-                                log('LENGTH ERROR, pid={0} should be {1} but is {2}'.format(packet.pid, self.pids[packet.pid].pes_packet_length, len(self.pids[packet.pid].data) - 6))
+                                log('LENGTH ERROR, pid={0} should be {1} but is {2}'.format(packet.pid, self.pids[packet.pid].pes_packet_length, self.pids[packet.pid].size))
                         self.observer.on_pes(packet.pid, self.pids[packet.pid])
 
                     # Create new pes
@@ -1133,7 +1602,195 @@ class ts_importer(object):
             self.num_bytes += 188
             offset += 188
 
+    def _add_data_vectorized(self, data):
+        """Demultiplex all whole packets in data with NumPy.
+
+        The header fields of all packets are extracted at once. Packets of
+        observed PIDs are grouped per PID, and each PES gets its payload
+        ranges joined in one go. The finished PES packets are then passed to
+        the observer in stream order, and PSI packets that can change the
+        set of observed PIDs are handled in between, so the observer sees
+        the same sequence of calls as with _add_data_packets."""
+        packets = packet_array(data)
+        nr_packets = len(packets)
+        if not nr_packets:
+            return
+        headers = packet_headers(packets)
+        error = headers.transport_error_indicator.astype(bool)
+        pid = headers.pid
+
+        self.packet_errors += int(error.sum())
+        if error.any():
+            for error_pid, nr_errors in zip(*[a.tolist() for a in np.unique(pid[error], return_counts=True)]):
+                self.transport_errors[error_pid] += nr_errors
+        self.num_stuffing_packets += int(((pid == STUFFING_PID) & ~error).sum())
+        cc_errors, duplicates = find_cc_errors(headers, self.cc_map, ~error)
+        for error_pid, indices in cc_errors.iteritems():
+            self._add_cc_errors(error_pid, indices.tolist())
+        # Duplicate packets are discarded like packets with transport errors
+        skip = error.copy()
+        for duplicate_pid, indices in duplicates.iteritems():
+            self.duplicate_packets[duplicate_pid] += len(indices)
+            skip[indices] = True
+
+        pes_header_bytes = collections.defaultdict(int)
+        pes_starts = []
+        pos = 0
+        while pos < nr_packets:
+            state = self._demux_state()
+            psi = ~skip & self._psi_mask(pid)
+            base = pos
+            for index in (np.flatnonzero(psi[base:]) + base).tolist():
+                self._demux_pes(data, headers, skip, pos, index, pes_header_bytes, pes_starts)
+                self._handle_psi_packet(data[index * 188:(index + 1) * 188])
+                pos = index + 1
+                if self._demux_state() != state:
+                    break
+            else:
+                self._demux_pes(data, headers, skip, pos, nr_packets, pes_header_bytes, pes_starts)
+                pos = nr_packets
+
+        if pes_starts:
+            pes_starts.sort()
+            for index, pts in pes_starts:
+                if self.first_pts != 0:
+                    break
+                self.first_pts = pts
+            self.last_pts = pes_starts[-1][1]
+
+        counts = np.bincount(pid, minlength=STUFFING_PID + 1)
+        header_bytes = np.bincount(pid, weights=headers.payload_start, minlength=STUFFING_PID + 1)
+        for packet_pid in np.flatnonzero(counts).tolist():
+            counter = self._get_pid_counter(packet_pid)
+            num_packets = int(counts[packet_pid])
+            ts_header_bytes = int(header_bytes[packet_pid])
+            counter['num_packets'] += num_packets
+            counter['num_bytes'] += 188 * num_packets
+            counter['ts_header_bytes'] += ts_header_bytes
+            counter['payload_bytes'] += 188 * num_packets - ts_header_bytes - pes_header_bytes[packet_pid]
+        self.num_packets += nr_packets
+        self.num_bytes += 188 * nr_packets
+
+    def _get_pid_counter(self, pid):
+        if not self.pid_counter.has_key(pid):
+            self.pid_counter[pid] = {'num_packets': 0,
+                                     'num_bytes': 0,
+                                     'ts_header_bytes': 0,
+                                     'pes_header_bytes': 0,
+                                     'payload_bytes': 0}
+        return self.pid_counter[pid]
+
+    def _add_cc_errors(self, pid, indices):
+        """Count CC errors of pid at the packet indices of the current data and
+        keep the byte positions of the first CC_ERROR_POSITIONS."""
+        self.cc_errors[pid] += len(indices)
+        kept = self.cc_error_positions[pid]
+        kept.extend(self._packet_positions(indices[:CC_ERROR_POSITIONS - len(kept)]))
+
+    def _packet_positions(self, indices):
+        "Return the file or stream byte positions of the packets at indices of the current data."
+        firsts = [run[0] for run in self.runs]
+        positions = []
+        for index in indices:
+            first, position, packet_size = self.runs[bisect.bisect_right(firsts, index) - 1]
+            positions.append(position + (index - first) * packet_size)
+        return positions
+
+    def _demux_state(self):
+        "The importer state that decides how a packet is handled."
+        return (self.pmt_pid, self.nit_pid, frozenset(self.scte35_pids), frozenset(self.pids))
+
+    def _psi_mask(self, pid):
+        "Mask of packets handled by the PAT, PMT, NIT and SCTE-35 handlers."
+        mask = (pid == PAT_PID) | (pid == self.nit_pid) | np.in1d(pid, list(self.scte35_pids))
+        if self.pmt_pid not in (CA_PID, STUFFING_PID):
+            mask |= pid == self.pmt_pid
+        return mask
+
+    def _handle_psi_packet(self, data):
+        packet = ts_packet(data, display=False)
+        if packet.pid == PAT_PID:
+            self._handle_pat(packet)
+        elif packet.pid == self.pmt_pid:
+            self._handle_pmt(packet)
+        elif packet.pid == self.nit_pid:
+            self._handle_nit(packet)
+        elif packet.pid in self.scte35_pids:
+            self._handle_scte35(packet)
+
+    def _demux_pes(self, data, headers, skip, start, end, pes_header_bytes, pes_starts):
+        "Assemble PES packets from the observed PIDs in packets start to end."
+        if start >= end or not self.pids:
+            return
+        pid = headers.pid[start:end]
+        es_mask = ~skip[start:end] & np.in1d(pid, self.pids.keys())
+        es_mask &= ~self._psi_mask(pid) & (pid != CA_PID) & (pid != STUFFING_PID)
+        indices = np.flatnonzero(es_mask) + start
+        if not len(indices):
+            return
+        es_pids = headers.pid[indices]
+        order = np.argsort(es_pids, kind='mergesort')  # Stable, keeps stream order per PID
+        indices = indices[order]
+        es_pids = es_pids[order]
+        splits = np.flatnonzero(np.diff(es_pids)) + 1
+        events = []
+        for pid_indices in np.split(indices, splits):
+            self._assemble_pes(int(headers.pid[pid_indices[0]]), data, headers, pid_indices,
+                               pes_header_bytes, pes_starts, events)
+        # Back to stream order. The sort is stable, so two PES finished by
+        # the same packet stay in order.
+        events.sort(key=lambda event: event[0])
+        for index, pid, p in events:
+            if p is None:
+                log('Zero data (00 00 01 BE) for pid {0}'.format(pid))
+                continue
+            if p.pes_packet_length:
+                if p.pes_packet_length != p.size:
+                    log('LENGTH ERROR, pid={0} should be {1} but is {2}'.format(pid, p.pes_packet_length, p.size))
+            self.observer.on_pes(pid, p)
+
+    def _assemble_pes(self, pid, data, headers, indices, pes_header_bytes, pes_starts, events):
+        """Add the payloads of the packets at indices (all of one PID) to PES packets.
+
+        Finished PES packets are appended to events as (packet index, pid,
+        pes), and zero data packets as (packet index, pid, None)."""
+        zero_data = headers.zero_data[indices]
+        if zero_data.any():
+            for index in indices[zero_data].tolist():
+                events.append((index, pid, None))
+            indices = indices[~zero_data]
+        starts = (indices * 188 + headers.payload_start[indices]).tolist()
+        ends = (indices * 188 + 188).tolist()
+        unit_starts = np.flatnonzero(headers.payload_unit_start_indicator[indices]).tolist()
+        bounds = [0] + unit_starts + [len(starts)]
+        for k in range(len(bounds) - 1):
+            first, last = bounds[k], bounds[k + 1]
+            if first == last:
+                continue
+            if k > 0:
+                index = int(indices[first])
+                # Send old pes if any
+                if self.pids[pid]:
+                    events.append((index, pid, self.pids[pid]))
+
+                # Create new pes
+                p = pes(data[starts[first]:ends[first]], display=False)
+                pes_header_bytes[pid] += p.header_len
+                self._get_pid_counter(pid)['pes_header_bytes'] += p.header_len
+                pes_starts.append((index, p.pts))
+                if p.pes_packet_length:
+                    if p.pes_packet_length == p.size:
+                        events.append((index, pid, p))
+                        p = None
+                self.pids[pid] = p
+                first += 1
+            if self.pids[pid] and first < last:
+                self.pids[pid].add_data(''.join([data[starts[i]:ends[i]] for i in xrange(first, last)]))
+
     def flush(self):
+        data = self.packet_sync.flush()
+        self.runs = self.packet_sync.runs
+        self._add_packets(data)
         for pid in self.pids:
             pes = self.pids[pid]
             if pes:
@@ -1163,6 +1820,9 @@ class ts_importer(object):
         log('First PTS: %.2f sec' % self.first_pts)
         log('Last PTS: %.2f sec' % self.last_pts)
         log('Transport errors: %s' % self.packet_errors)
+        log('Continuity counter errors: %s' % sum(self.cc_errors.itervalues()))
+        log('Packet size: %s' % (self.packet_size or self.packet_sync.packet_size))
+        log('Lost sync: %d' % (self.lost_sync + self.packet_sync.lost_sync))
 
         log('')
         log('pids found:')
@@ -1187,15 +1847,25 @@ class ts_importer(object):
                     bytes = self.pid_counter[pid]['payload_bytes']
                     log('Bitrate for pid {0}: {1:.2f} kbps'.format(pid, bytes * 8.0 / duration / 1000.0))
             log('Total bitrate: {0:.2f} kbps'.format(tot_bytes * 8.0 / duration / 1000.0))
+            for pid in sorted(self.cc_errors):
+                log('CC errors for pid {0}: {1} at bytes {2}'.format(pid, self.cc_errors[pid],
+                                                                    self.cc_error_positions[pid]))
+            for pid in sorted(self.duplicate_packets):
+                log('Duplicate packets for pid {0}: {1}'.format(pid, self.duplicate_packets[pid]))
+            for pid in sorted(self.transport_errors):
+                log('Transport errors for pid {0}: {1}'.format(pid, self.transport_errors[pid]))
+            frame_counts = self.observer.get_frame_counts()
+            for pid in sorted(frame_counts):
+                log('Frames for pid {0}: {1}'.format(pid, frame_counts[pid]))
             log('############################################')
 
+        if self.timing is not None:
+            self.timing.report()
+
         if self.log_cc:
-            mpeg_video_cc = self.observer.mpeg_video_parser.get_cc_summary()
-            h264_cc = self.observer.h264_parser.get_cc_summary()
-            if mpeg_video_cc:
-                self.print_cc_summary("MPEG2", mpeg_video_cc)
-            if h264_cc:
-                self.print_cc_summary("H.264", h264_cc)
+            for video, cc_summary in self.observer.get_cc_summaries():
+                if cc_summary:
+                    self.print_cc_summary(video, cc_summary)
 
     def _handle_pat(self, packet):
         if self.has_pat:
@@ -1706,28 +2376,32 @@ class h264_parser(object):
     def __init__(self, display=False, cc_basename=None):
         self.display = display
         self.construction_frame = None
-        self.data = ''
+        self.data = bytearray()
+        self.consumed = 0       # start of the data not yet split into NAL units
+        self.scan_pos = 0       # where the next start code search begins
+        self.start_codes = []   # [offset, length] of start codes not yet consumed
         self.times = []
+        self.sps = None         # last SPS and PPS, without start code
+        self.pps = None
         self.sei_parser = SEIParser(display, cc_basename)
 
     def get_cc_summary(self):
         return self.sei_parser.ATSC_parser.get_cc_summary()
 
     def next_start_code(self, data, offset):
-        while offset + 5 < len(data):
-            code = (ord(data[offset]) == 0x00) and \
-                   (ord(data[offset + 1]) == 0x00) and \
-                   (ord(data[offset + 2]) == 0x00) and \
-                   (ord(data[offset + 3]) == 0x01)
-            code2 = (ord(data[offset]) == 0x00) and \
-                    (ord(data[offset + 1]) == 0x00) and \
-                    (ord(data[offset + 2]) == 0x01)
-            if code == 1:
-                return offset, 4
-            elif code2 == 1:
-                return offset, 3
-            offset += 1
-        return -1, 0
+        """Return (offset, length) of the first 3 or 4 byte start code at or after
+        offset, or (-1, 0). Start codes closer than 6 bytes to the end are not
+        reported since the NAL header may not be available yet."""
+        pos = data.find('\x00\x00\x01', offset)
+        if pos < 0:
+            return -1, 0
+        if pos > offset and data[pos - 1:pos] == '\x00':
+            pos, length = pos - 1, 4
+        else:
+            length = 3
+        if pos + 5 >= len(data):
+            return -1, 0
+        return pos, length
 
     def print_nal_unit_types(self, data):
         offset = 0
@@ -1745,6 +2419,12 @@ class h264_parser(object):
             self.sei_parser.ATSC_parser.set_pts_offset(pts)
         #self.print_nal_unit_types(data)
 
+        if self.consumed > len(self.data) // 2:
+            del self.data[:self.consumed]
+            for start_code in self.start_codes:
+                start_code[0] -= self.consumed
+            self.scan_pos -= self.consumed
+            self.consumed = 0
         self.data += data
         if pts > -1:
             self.times.append([pts, dts])
@@ -1754,12 +2434,14 @@ class h264_parser(object):
         #log('pes size={0} pts={1} times={2}'.format(len(data), pts, len(self.times)))
         #log(dump_hex(data, 16))
 
-        # Calculate offsets to all start codes
-        start_codes = []
-        offset, offset_len = self.next_start_code(self.data, 0)
+        # Find the start codes in the newly added data
+        start_codes = self.start_codes
+        offset, offset_len = self.next_start_code(self.data, self.scan_pos)
         while offset >= 0:
             start_codes.append([offset, offset_len])
-            offset, offset_len = self.next_start_code(self.data, offset + 2)
+            self.scan_pos = offset + 2
+            offset, offset_len = self.next_start_code(self.data, self.scan_pos)
+        self.scan_pos = max(self.scan_pos, len(self.data) - 5)
 
         if len(start_codes) == 0:
             return []
@@ -1778,12 +2460,10 @@ class h264_parser(object):
         # Extract frames
         sps_pps = ''
         frames = []
-        last_pos = 0
         for i in range(len(lengths)):
             tmp = start_codes[i][1]
-            nal_data = self.data[start_codes[i][0] : start_codes[i][0] + lengths[i]]
+            nal_data = str(buffer(self.data, start_codes[i][0], lengths[i]))
             nal_type = ord(nal_data[tmp]) & 0x1f
-            last_pos += len(nal_data)
 
             if tmp == 3:
                 nal_data = nal_data[0] + nal_data
@@ -1797,12 +2477,14 @@ class h264_parser(object):
                 self.sei_parser.parse(nal_data, pts)
             elif nal_type == 7:
                 # SPS
+                self.sps = nal_data[4:]
                 if self.display:
                     text = binascii.b2a_base64(nal_data[4:])
                     log('[SPS]: %s' % text)
                     sps_pps = sps_pps + text.strip() + ' '
             elif nal_type == 8:
                 # PPS
+                self.pps = nal_data[4:]
                 if self.display:
                     text = binascii.b2a_base64(nal_data[4:])
                     log('[PPS]:%s' % text)
@@ -1869,8 +2551,9 @@ class h264_parser(object):
                 log('Unknown NAL type={0}'.format(nal_type))
 
         if len(lengths):
-            pos = last_pos + start_codes[0][0]
-            self.data = self.data[pos:]
+            self.consumed = start_codes[len(lengths) - 1][0] + lengths[-1]
+            self.scan_pos = max(self.scan_pos, self.consumed)
+            del start_codes[:len(lengths)]
 
         if sps_pps:
             print ''
@@ -1905,6 +2588,7 @@ class aac_parser_adts(object):
     def __init__(self, display=False):
         self.display = display
         self.data = ''
+        self.header = None      # last ADTS header
 
     def add_pes(self, data, pts, dts):
         self.data += data
@@ -1925,7 +2609,10 @@ class aac_parser_adts(object):
                 self.parse_frame(frame_data, pts, dts)
                 time_now = datetime.datetime.utcnow()
                 t = time.mktime(time_now.timetuple()) + time_now.microsecond / 1000000.0
-                frames.append(frame(frame_data[7:], True, t, pts, dts, 'audio'))
+                # The header is 9 bytes with CRC (protection_absent == 0)
+                header_length = ord(frame_data[1]) & 0x01 and 7 or 9
+                self.header = frame_data[:7]
+                frames.append(frame(frame_data[header_length:], True, t, pts, dts, 'audio'))
                 self.data = self.data[aac_frame_len:]
             else:
                 break
@@ -2595,6 +3282,7 @@ class parser_observer(observer):
         self.metadata_pid = -1
         self.scte35_pids = set()
         self.options = options
+        self.frame_counter = collections.defaultdict(int)
 
         # If video data should be logged
         if options.has_key('video'):
@@ -2668,30 +3356,15 @@ class parser_observer(observer):
 
     def on_pes(self, pid, pes):
         if pid == self.mpeg_video_pid:
-            frames = self.mpeg_video_parser.add_pes(pes.payload, pes.pts, pes.dts)
-            if self.options['verbose'] > 0:
-                for frame in frames:
-                    log(frame)
+            self._add_frames(pid, self.mpeg_video_parser.add_pes(pes.payload, pes.pts, pes.dts))
         if pid == self.mpeg_audio_pid:
-            frames = self.mpeg_audio_parser.add_pes(pes.payload, pes.pts, pes.dts)
-            if self.options['verbose'] > 0:
-                for frame in frames:
-                    log(frame)
+            self._add_frames(pid, self.mpeg_audio_parser.add_pes(pes.payload, pes.pts, pes.dts))
         if pid == self.h264_pid:
-            frames = self.h264_parser.add_pes(pes.payload, pes.pts, pes.dts)
-            if self.options['verbose'] > 0:
-                for frame in frames:
-                    log(frame)
+            self._add_frames(pid, self.h264_parser.add_pes(pes.payload, pes.pts, pes.dts))
         elif pid == self.aac_pid:
-            frames = self.aac_parser.add_pes(pes.payload, pes.pts, pes.dts)
-            if self.options['verbose'] > 0:
-                for frame in frames:
-                    log(frame)
+            self._add_frames(pid, self.aac_parser.add_pes(pes.payload, pes.pts, pes.dts))
         elif pid == self.ac3_pid:
-            frames = self.ac3_parser.add_pes(pes.payload, pes.pts, pes.dts)
-            if self.options['verbose'] > 0:
-                for frame in frames:
-                    log(frame)
+            self._add_frames(pid, self.ac3_parser.add_pes(pes.payload, pes.pts, pes.dts))
         elif pid == self.teletext_pid:
             frames = parse_teletext_subtitle(pes.payload, display=self.text_display)
             #from cavena import parse_teletext_subtitle_cavena
@@ -2704,12 +3377,23 @@ class parser_observer(observer):
             id3_parser(pes.payload, pes.pts, pes.dts, display=self.text_display)
             #pass
 
-    def flush(self):
-        frames = self.h264_parser.flush()
+    def _add_frames(self, pid, frames):
+        if frames:
+            self.frame_counter[pid] += len(frames)
         if self.options['verbose'] > 0:
             for frame in frames:
                 log(frame)
 
+    def flush(self):
+        self._add_frames(self.h264_pid, self.h264_parser.flush())
+
+    def get_cc_summaries(self):
+        return [('MPEG2', self.mpeg_video_parser.get_cc_summary()),
+                ('H.264', self.h264_parser.get_cc_summary())]
+
+    def get_frame_counts(self):
+        return dict(self.frame_counter)
+
     def get_scte35_pids(self):
         return self.scte35_pids
 
@@ -2745,6 +3429,1180 @@ class key_frame_observer(observer):
                         for key_frame in self.key_frames:
                             file.write(str(key_frame) + '\n')
 
+#
+# Parallel parser observer
+#
+STREAM_PID_ATTRIBUTES = ('mpeg_video_pid', 'mpeg_audio_pid', 'h264_pid', 'aac_pid', 'ac3_pid',
+                         'teletext_pid', 'dvb_pid', 'metadata_pid')
+ES_BATCH_BYTES = 1024 * 1024
+ES_QUEUE_SIZE = 8
+ES_POLL_INTERVAL = 1.0
+
+es_packet = collections.namedtuple('es_packet', 'payload pts dts')
+
+def _es_worker(index, task_queue, result_queue, options, stream_pids):
+    """Worker process of parallel_observer.
+
+    Runs a parser_observer on the PES batches in task_queue until None is
+    received and puts (index, frame counts, CC summaries, error) on
+    result_queue.
+    After an error the queue is still drained so the sender never blocks."""
+    # Line buffered, so that log lines of different workers are not mixed
+    sys.stdout = os.fdopen(os.dup(sys.stdout.fileno()), 'w', 1)
+    obs = parser_observer(options)
+    for name, pid in stream_pids.iteritems():
+        setattr(obs, name, pid)
+    error = None
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        if error is not None:
+            continue
+        kind, value = task
+        try:
+            if kind == 'pids':
+                for name, pid in value.iteritems():
+                    setattr(obs, name, pid)
+            else:
+                for pid, payload, pts, dts in value:
+                    obs.on_pes(pid, es_packet(payload, pts, dts))
+        except Exception as e:
+            error = '%s: %s' % (e.__class__.__name__, e)
+    cc_summaries = []
+    if error is None:
+        try:
+            obs.flush()
+            if scc is not None:
+                cc_summaries = obs.get_cc_summaries()
+        except Exception as e:
+            error = '%s: %s' % (e.__class__.__name__, e)
+    result_queue.put((index, obs.get_frame_counts(), cc_summaries, error))
+
+class parallel_observer(observer):
+    """parser_observer with the codec parsing done in worker processes.
+
+    The importer in the calling process only demultiplexes. The PES packets
+    of each elementary stream are sent in batches to one of the workers, so
+    the streams are parsed on different cores but each one in order. The
+    frame counts and CC summaries of the workers are merged at flush. A
+    worker that dies is recorded in errors and its streams are dropped."""
+    def __init__(self, options={}, processes=None):
+        self.options = options
+        self.processes = processes or multiprocessing.cpu_count()
+        self.routing = parser_observer(options)
+        self.stream_pids = self._get_stream_pids()
+        self.workers = []
+        self.pid_workers = {}
+        self.batches = []
+        self.batch_bytes = []
+        self.result_queue = multiprocessing.Queue()
+        self.frame_counter = {}
+        self.cc_summaries = []
+        self.errors = []
+
+    def _get_stream_pids(self):
+        return dict((name, getattr(self.routing, name)) for name in STREAM_PID_ATTRIBUTES)
+
+    def _start_worker(self):
+        task_queue = multiprocessing.Queue(ES_QUEUE_SIZE)
+        process = multiprocessing.Process(target=_es_worker,
+                                          args=(len(self.workers), task_queue, self.result_queue,
+                                                self.options, self.stream_pids))
+        process.daemon = True
+        sys.stdout.flush()
+        process.start()
+        self.workers.append((process, task_queue))
+        self.batches.append([])
+        self.batch_bytes.append(0)
+
+    def _put(self, index, task):
+        "Put task on the queue of a worker. Tasks for a dead worker are dropped."
+        process, task_queue = self.workers[index]
+        while process.is_alive():
+            try:
+                task_queue.put(task, timeout=ES_POLL_INTERVAL)
+                return
+            except Queue.Full:
+                pass
+        # The feeder thread must not wait for a reader that is gone
+        task_queue.cancel_join_thread()
+
+    def _send_batch(self, index):
+        if self.batches[index]:
+            self._put(index, ('pes', self.batches[index]))
+            self.batches[index] = []
+            self.batch_bytes[index] = 0
+
+    def _get_results(self):
+        """Yield the results of the workers.
+
+        A worker that exits without a result is logged and added to errors.
+        One that exits normally has put its result before, so it is given
+        another poll interval for the result to arrive."""
+        pending = set(range(len(self.workers)))
+        exited = set()
+        while pending:
+            try:
+                result = self.result_queue.get(timeout=ES_POLL_INTERVAL)
+            except Queue.Empty:
+                for index in sorted(pending):
+                    process = self.workers[index][0]
+                    if process.is_alive():
+                        continue
+                    if process.exitcode == 0 and index not in exited:
+                        exited.add(index)
+                        continue
+                    pending.discard(index)
+                    error = 'worker process %d exited with code %s' % (process.pid,
+                                                                       process.exitcode)
+                    self.errors.append(error)
+                    log('ERROR in worker process: %s' % error)
+                continue
+            pending.discard(result[0])
+            yield result[1:]
+
+    def on_pat(self, pat):
+        self.routing.on_pat(pat)
+
+    def on_pmt(self, importer, pmt):
+        self.routing.on_pmt(importer, pmt)
+        stream_pids = self._get_stream_pids()
+        if stream_pids != self.stream_pids:
+            self.stream_pids = stream_pids
+            for index in range(len(self.workers)):
+                self._send_batch(index)
+                self._put(index, ('pids', stream_pids))
+
+    def on_pes(self, pid, pes):
+        index = self.pid_workers.get(pid)
+        if index is None:
+            index = len(self.pid_workers) % self.processes
+            self.pid_workers[pid] = index
+            if index == len(self.workers):
+                self._start_worker()
+        payload = pes.payload
+        self.batches[index].append((pid, payload, pes.pts, pes.dts))
+        self.batch_bytes[index] += len(payload)
+        if self.batch_bytes[index] >= ES_BATCH_BYTES:
+            self._send_batch(index)
+
+    def flush(self):
+        for index in range(len(self.workers)):
+            self._send_batch(index)
+            self._put(index, None)
+        cc_summaries = collections.OrderedDict()
+        for frame_counts, summaries, error in self._get_results():
+            self.frame_counter.update(frame_counts)
+            for video, summary in summaries:
+                cc_summaries.setdefault(video, []).extend(summary)
+            if error is not None:
+                self.errors.append(error)
+                log('ERROR in worker process: %s' % error)
+        for process, task_queue in self.workers:
+            process.join()
+        self.workers = []
+        self.cc_summaries = cc_summaries.items()
+
+    def get_scte35_pids(self):
+        return self.routing.get_scte35_pids()
+
+    def get_cc_summaries(self):
+        return self.cc_summaries
+
+    def get_frame_counts(self):
+        return self.frame_counter
+
+#
+# Consumer dispatch
+#
+CONSUMER_QUEUE_SIZE = 256
+CONSUMERS = collections.OrderedDict()
+
+consumer_type = collections.namedtuple('consumer_type', 'factory stream_types')
+
+def register_consumer(name, factory, stream_types=None):
+    """Register a consumer for create_observer.
+
+    factory(options) returns an observer. It gets the PES packets of the
+    PIDs it observes in on_pmt, and of all streams with one of
+    stream_types."""
+    CONSUMERS[name] = consumer_type(factory, stream_types)
+
+def find_consumer(name):
+    "Return the consumer_type of a registered name or of a module.factory path."
+    if name in CONSUMERS:
+        return CONSUMERS[name]
+    if '.' in name:
+        module_name, attribute = name.rsplit('.', 1)
+        module = __import__(module_name, fromlist=[attribute])
+        return consumer_type(getattr(module, attribute), None)
+    raise ValueError('Unknown observer %s, use one of %s or module.factory' % (name, ', '.join(CONSUMERS)))
+
+class consumer_thread(threading.Thread):
+    """Runs the on_pes calls of one consumer on its own thread.
+
+    PES packets are passed in a bounded queue. When it is full, put blocks
+    the demux until the consumer catches up, or with drop the packet is
+    dropped and counted instead."""
+    def __init__(self, consumer, queue_size=CONSUMER_QUEUE_SIZE, drop=False):
+        threading.Thread.__init__(self, name='consumer-%s' % consumer.__class__.__name__)
+        self.daemon = True
+        self.consumer = consumer
+        self.queue = Queue.Queue(queue_size)
+        self.drop = drop
+        self.dropped = 0
+        self.error = None
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                if self.error is None:
+                    self.consumer.on_pes(*item)
+            except Exception, e:
+                self.error = e
+                log('ERROR in consumer {0}: {1}'.format(self.name, e))
+            finally:
+                self.queue.task_done()
+
+    def put(self, pid, pes):
+        if not self.drop:
+            self.queue.put((pid, pes))
+            return
+        try:
+            self.queue.put_nowait((pid, pes))
+        except Queue.Full:
+            self.dropped += 1
+
+    def wait(self):
+        "Wait until all queued packets are consumed."
+        self.queue.join()
+
+    def stop(self):
+        self.queue.put(None)
+        self.join()
+
+class dispatch_observer(observer):
+    """Observer that fans out the PES packets of each PID to the consumers
+    subscribed to it, so that several consumers can share one demux pass.
+
+    A consumer is an observer. It subscribes to a PID by calling
+    importer.observe_pid in its on_pmt, as a plain observer does, or to
+    all PIDs with one of the stream_types given to add_consumer. A threaded
+    consumer gets the packets through a consumer_thread. Before a PAT, PMT
+    or flush is passed on, its queue is drained so that they stay in order
+    with the packets."""
+    def __init__(self):
+        self.entries = []
+        self.subscriptions = {}
+
+    def add_consumer(self, consumer, stream_types=None, threaded=False,
+                     queue_size=CONSUMER_QUEUE_SIZE, drop=False):
+        thread = None
+        if threaded:
+            thread = consumer_thread(consumer, queue_size, drop)
+            thread.start()
+        self.entries.append((consumer, set(stream_types or ()), thread))
+        return consumer
+
+    def _entries(self):
+        "Generate (consumer, stream types, thread) with the queue of the thread drained."
+        for entry in self.entries:
+            if entry[2] is not None:
+                entry[2].wait()
+            yield entry
+
+    def _subscribe(self, entry, pid, importer):
+        subscribers = self.subscriptions.setdefault(pid, [])
+        if entry not in subscribers:
+            subscribers.append(entry)
+        importer.observe_pid(pid)
+
+    def on_pat(self, pat):
+        for consumer, stream_types, thread in self._entries():
+            consumer.on_pat(pat)
+
+    def on_pmt(self, importer, pmt):
+        for entry in self._entries():
+            consumer, stream_types = entry[:2]
+            consumer.on_pmt(subscription_importer(self, entry, importer), pmt)
+            for stream in pmt.stream_list:
+                if stream.stream_type in stream_types:
+                    self._subscribe(entry, stream.elementary_pid, importer)
+
+    def on_pes(self, pid, pes):
+        for consumer, stream_types, thread in self.subscriptions.get(pid, ()):
+            if thread is not None:
+                thread.put(pid, pes)
+            else:
+                consumer.on_pes(pid, pes)
+
+    def flush(self):
+        for consumer, stream_types, thread in self._entries():
+            consumer.flush()
+            if thread is not None:
+                thread.stop()
+                if thread.dropped:
+                    log('Consumer {0} dropped {1} PES packets'.format(thread.name, thread.dropped))
+
+    def get_dropped(self):
+        return dict((entry[2].name, entry[2].dropped) for entry in self.entries if entry[2] is not None)
+
+    def get_scte35_pids(self):
+        pids = set()
+        for consumer, stream_types, thread in self.entries:
+            pids |= consumer.get_scte35_pids()
+        return pids
+
+    def get_cc_summaries(self):
+        summaries = []
+        for consumer, stream_types, thread in self.entries:
+            summaries.extend(consumer.get_cc_summaries())
+        return summaries
+
+    def get_frame_counts(self):
+        "Frame counts per PID, from the first consumer that has counts for it."
+        frame_counts = {}
+        for consumer, stream_types, thread in reversed(self.entries):
+            frame_counts.update(consumer.get_frame_counts())
+        return frame_counts
+
+class subscription_importer(object):
+    "Importer proxy for dispatch_observer that subscribes a consumer on observe_pid."
+    def __init__(self, dispatcher, entry, importer):
+        self.dispatcher = dispatcher
+        self.entry = entry
+        self.importer = importer
+
+    def observe_pid(self, pid):
+        self.dispatcher._subscribe(self.entry, pid, self.importer)
+
+    def __getattr__(self, name):
+        return getattr(self.importer, name)
+
+def create_observer(names, options, processes=0, threaded=False):
+    """Return the observer for a list of consumer names, see find_consumer.
+
+    One parser runs in worker processes when processes is set. Several
+    consumers are combined in a dispatch_observer, each on its own thread
+    when threaded is set."""
+    if names == ['parser'] and processes > 0:
+        return parallel_observer(options, processes)
+    consumer_types = [find_consumer(name) for name in names]
+    if len(consumer_types) == 1 and not threaded:
+        return consumer_types[0].factory(options)
+    obs = dispatch_observer()
+    for consumer_type_ in consumer_types:
+        obs.add_consumer(consumer_type_.factory(options), consumer_type_.stream_types, threaded)
+    return obs
+
+register_consumer('parser', parser_observer)
+register_consumer('key_frame', lambda options: key_frame_observer())
+
+#
+# Memory-mapped TS file reader
+#
+TIMESTAMP_WRAP = 1 << 33
+READ_CHUNK_PACKETS = 100000
+TIME_SCAN_BYTES = 8 * 1024 * 1024
+
+def packet_pcr(data, offset):
+    "Return (pid, PCR base) of the packet at offset, or None if it has no PCR."
+    header, adaptation_field_length, flags = struct.unpack_from('>xHxBB', data, offset)
+    if not (ord(data[offset + 3]) & 0x20) or adaptation_field_length < 7 or not flags & 0x10:
+        return None
+    high, low = struct.unpack_from('>IB', data, offset + 6)
+    return header & 0x1fff, (high << 1) | (low >> 7)
+
+def packet_pes_times(data, offset):
+    """Return (pid, PTS, DTS) if the packet at offset starts a PES with a PTS,
+    else None. DTS is the PTS if the PES has no DTS."""
+    header, control = struct.unpack_from('>xHB', data, offset)
+    if not header & 0x4000 or not control & 0x10:
+        return None
+    start = offset + 4
+    if control & 0x20:
+        start += 1 + ord(data[start])
+    if start + 14 > offset + TS_PACKET_SIZE or data[start:start + 3] != '\x00\x00\x01':
+        return None
+    pts_dts_indicator = ord(data[start + 7]) >> 6
+    if not pts_dts_indicator & 0x02:
+        return None
+    pts = parse_pes_timestamp(data, start + 9)
+    if pts_dts_indicator == 0x03 and start + 19 <= offset + TS_PACKET_SIZE:
+        return header & 0x1fff, pts, parse_pes_timestamp(data, start + 14)
+    return header & 0x1fff, pts, pts
+
+def packet_pts(data, offset):
+    "Return (pid, PTS) if the packet at offset starts a PES with a PTS, else None."
+    times = packet_pes_times(data, offset)
+    return times and times[:2]
+
+def parse_time(text):
+    "Parse [[HH:]MM:]SS[.fff] into seconds."
+    seconds = 0.0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+class ts_file_reader(object):
+    """Memory-mapped reader of a TS file.
+
+    Data is handed out as zero-copy buffer views of whole packets. The
+    packet size is detected when the file is opened, and 192 or 204-byte
+    packets are handed out as copies of their 188-byte TS packets. Offsets
+    are file offsets of the sync bytes. After a packet without sync byte
+    the reader resyncs on the next offset that has sync bytes in three
+    consecutive packets, and counts lost_sync.
+
+    Times are in seconds relative to the first timestamp in the file. The
+    PCR of the first PCR PID is used, or the PTS of the first PID that has
+    one if there is no PCR, and 33-bit wrap-around is taken into account."""
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = ''
+        self.packet_size = find_sync(self.data, 0, min(self.size, TIME_SCAN_BYTES))[1] or TS_PACKET_SIZE
+        self.lost_sync = 0
+        self.clock = None
+        self.clock_pid = None
+        self.clock_start = None
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def sync(self, offset):
+        """Return the first offset >= offset where three consecutive packets
+        start with a sync byte (fewer at the end of the file), or self.size."""
+        data = self.data
+        while True:
+            offset = data.find(TS_SYNC_BYTE, offset)
+            if offset < 0:
+                return self.size
+            for i in (1, 2):
+                next_offset = offset + i * self.packet_size
+                if next_offset < self.size and data[next_offset] != TS_SYNC_BYTE:
+                    break
+            else:
+                return offset
+            offset += 1
+
+    def chunks(self, start=0, end=None, chunk_size=TS_PACKET_SIZE * READ_CHUNK_PACKETS):
+        "Generate buffer views of the whole packets between the offsets start and end."
+        for offset, data in self.offset_chunks(start, end, chunk_size):
+            yield data
+
+    def offset_chunks(self, start=0, end=None, chunk_size=TS_PACKET_SIZE * READ_CHUNK_PACKETS):
+        "Like chunks, but generate (file offset, buffer view)."
+        if end is None or end > self.size:
+            end = self.size
+        stride = self.packet_size
+        offset = self.sync(start)
+        while offset + TS_PACKET_SIZE <= end:
+            chunk_end = min(end, offset + chunk_size)
+            nr_packets = (chunk_end - offset - TS_PACKET_SIZE) // stride + 1
+            synced = count_synced(self.data, offset, nr_packets, stride)
+            if synced:
+                if stride == TS_PACKET_SIZE:
+                    yield offset, buffer(self.data, offset, synced * stride)
+                else:
+                    yield offset, pack_packets(self.data, offset, synced, stride)
+                offset += synced * stride
+            if synced < nr_packets:
+                self.lost_sync += 1
+                offset = self.sync(offset + 1)
+
+    def _packet_times(self, offset, end):
+        "Generate (offset, pid, timestamp) of the PCRs or PTSs from offset."
+        get_time = self.clock == 'pcr' and packet_pcr or packet_pts
+        offset = self.sync(offset)
+        while offset + TS_PACKET_SIZE <= end:
+            if self.data[offset] != TS_SYNC_BYTE:
+                self.lost_sync += 1
+                offset = self.sync(offset + 1)
+                continue
+            pid_time = get_time(self.data, offset)
+            if pid_time is not None:
+                yield offset, pid_time[0], pid_time[1]
+            offset += self.packet_size
+
+    def _find_clock(self):
+        if self.clock is not None:
+            return
+        end = min(self.size, TIME_SCAN_BYTES)
+        for clock in ('pcr', 'pts'):
+            self.clock = clock
+            for offset, pid, timestamp in self._packet_times(0, end):
+                self.clock_pid = pid
+                self.clock_start = timestamp
+                return
+        self.clock = None
+        raise ValueError('No PCR or PTS found in the first %d bytes' % end)
+
+    def time_at(self, offset, scan_bytes=TIME_SCAN_BYTES):
+        """Return (offset, seconds) of the first clock timestamp at or after
+        offset, or (self.size, None) if there is none within scan_bytes."""
+        self._find_clock()
+        for packet_offset, pid, timestamp in self._packet_times(offset, min(self.size, offset + scan_bytes)):
+            if pid == self.clock_pid:
+                return packet_offset, ((timestamp - self.clock_start) % TIMESTAMP_WRAP) / 90000.0
+        return self.size, None
+
+    def find_time(self, seconds):
+        """Return the offset of the first packet carrying a clock timestamp at
+        or after seconds, found by binary search over the file."""
+        low = 0
+        high = self.size
+        while low < high:
+            middle = (low + high) // 2
+            offset, time_ = self.time_at(middle)
+            if time_ is None or time_ >= seconds:
+                high = middle
+            else:
+                low = middle + 1
+        return self.time_at(low)[0]
+
+#
+# Key frame index
+#
+KEY_FRAME_INDEX_SUFFIX = '.idx'
+KEY_FRAME_INDEX_MAGIC = 'TSKI'
+KEY_FRAME_INDEX_VERSION = 2
+KEY_FRAME_INDEX_HEADER = struct.Struct('<4sHHHBxqQqI')
+KEY_FRAME_INDEX_ENTRY = struct.Struct('<QQqqq')
+VIDEO_STREAM_TYPES = (0x01, 0x02, 0x1b, 0x24)
+
+key_frame_entry = collections.namedtuple('key_frame_entry', 'offset end_offset pts dts pcr')
+
+class pmt_observer(observer):
+    "Observer that only records the streams and PCR PID of the PMT."
+    def __init__(self):
+        self.stream_types = {}
+        self.pcr_pid = None
+
+    def on_pmt(self, importer, pmt):
+        self.pcr_pid = pmt.pcr_pid
+        for stream in pmt.stream_list:
+            self.stream_types[stream.elementary_pid] = stream.stream_type
+
+def is_key_frame_packet(data, offset, stream_type):
+    """Return True if the PES starting in the packet at offset is a random
+    access point.
+
+    That is when the random_access_indicator is set, or when the payload
+    of the packet has an H.264 IDR or HEVC IRAP NAL unit or an MPEG-2 I
+    picture header. Slice headers are not parsed."""
+    control = ord(data[offset + 3])
+    start = offset + 4
+    end = offset + TS_PACKET_SIZE
+    if control & 0x20:
+        adaptation_field_length = ord(data[start])
+        if adaptation_field_length and ord(data[start + 1]) & 0x40:
+            return True
+        start += 1 + adaptation_field_length
+    if start + 9 > end:
+        return False
+    payload = data[start + 9 + ord(data[start + 8]):end]
+    pos = payload.find('\x00\x00\x01')
+    while 0 <= pos < len(payload) - 3:
+        header = ord(payload[pos + 3])
+        if stream_type == 0x1b:
+            if header & 0x1f == 5:
+                return True
+        elif stream_type == 0x24:
+            if 16 <= (header >> 1) & 0x3f <= 21:
+                return True
+        elif header == 0x00 and pos + 5 < len(payload):
+            return (ord(payload[pos + 5]) >> 3) & 0x07 == 1
+        pos = payload.find('\x00\x00\x01', pos + 3)
+    return False
+
+def _index_candidates(data, pids):
+    "Return the indices of the packets in data on pids that start a PES or have a PCR."
+    if np is not None:
+        packets = packet_array(data)
+        pid = ((packets[:, 1].astype(np.uint16) & 0x1f) << 8) | packets[:, 2]
+        has_pcr = ((packets[:, 3] & 0x20) != 0) & (packets[:, 4] >= 7) & ((packets[:, 5] & 0x10) != 0)
+        unit_start = (packets[:, 1] & 0x40) != 0
+        mask = np.in1d(pid, list(pids)) & (has_pcr | unit_start) & ((packets[:, 1] & 0x80) == 0)
+        return np.flatnonzero(mask).tolist()
+    candidates = []
+    for i in xrange(len(data) // TS_PACKET_SIZE):
+        if data[i * TS_PACKET_SIZE] != TS_SYNC_BYTE:
+            break
+        header = struct.unpack_from('>H', data, i * TS_PACKET_SIZE + 1)[0]
+        if header & 0x1fff in pids and not header & 0x8000 and \
+           (header & 0x4000 or packet_pcr(data, i * TS_PACKET_SIZE) is not None):
+            candidates.append(i)
+    return candidates
+
+def file_mtime_us(filename):
+    "Modification time of filename in microseconds."
+    return int(round(os.path.getmtime(filename) * 1000000))
+
+class key_frame_index(object):
+    """Random access index of the key frames of one video PID in a TS file.
+
+    Each entry has the byte offset of the packet that starts the key frame
+    PES, the offset of the packet that starts the next PES of the PID, and
+    the PTS, DTS and last PCR base before it (90 kHz, -1 if there is none).
+    The index is stored as a struct packed sidecar file, by default the TS
+    file name with KEY_FRAME_INDEX_SUFFIX appended.
+
+    The size and modification time (in microseconds) of the TS file are
+    stored to detect a stale index. pmt_pid is stored so that the PMT can
+    be copied along with the key frames. Times are seconds from clock_start, the first PCR base of the file (or
+    the first PTS of the PID if there are no PCRs), as in ts_file_reader."""
+    def __init__(self, pid, pmt_pid, stream_type, clock_start, file_size, file_mtime, entries):
+        self.pid = pid
+        self.pmt_pid = pmt_pid
+        self.stream_type = stream_type
+        self.clock_start = clock_start
+        self.file_size = file_size
+        self.file_mtime = file_mtime
+        self.entries = entries
+        self._times = None
+
+    @classmethod
+    def build(cls, filename, pid=None):
+        """Index filename in one pass. Without pid the first video stream of
+        the PMT is used."""
+        file_mtime = file_mtime_us(filename)
+        with ts_file_reader(filename) as reader:
+            importer = ts_importer(pmt_observer(), {'verbose': 0})
+            for data in reader.chunks(0):
+                try:
+                    importer.preflight(data)
+                    break
+                except Exception:
+                    pass
+            streams = importer.observer.stream_types
+            if pid is None:
+                video_pids = [p for p in sorted(streams) if streams[p] in VIDEO_STREAM_TYPES]
+                if not video_pids:
+                    raise ValueError('No video stream found in %s' % filename)
+                pid = video_pids[0]
+            stream_type = streams.get(pid)
+            pcr_pid = importer.observer.pcr_pid
+
+            entries = []
+            current = None
+            first_pcr = first_pts = None
+            pcr = -1
+            for offset, data in reader.offset_chunks(0):
+                for i in _index_candidates(data, set([pid, pcr_pid])):
+                    packet_offset = i * TS_PACKET_SIZE
+                    file_offset = offset + i * reader.packet_size
+                    pid_pcr = packet_pcr(data, packet_offset)
+                    if pid_pcr is not None and pid_pcr[0] == pcr_pid:
+                        pcr = pid_pcr[1]
+                        if first_pcr is None:
+                            first_pcr = pcr
+                    times = packet_pes_times(data, packet_offset)
+                    if times is None or times[0] != pid:
+                        continue
+                    if first_pts is None:
+                        first_pts = times[1]
+                    if current is not None:
+                        entries.append(key_frame_entry(current[0], file_offset, *current[1:]))
+                        current = None
+                    if is_key_frame_packet(data, packet_offset, stream_type):
+                        current = (file_offset, times[1], times[2], pcr)
+            if current is not None:
+                entries.append(key_frame_entry(current[0], reader.size, *current[1:]))
+            clock_start = first_pcr if first_pcr is not None else first_pts
+            pmt_pid = importer.has_pat and importer.pmt_pid or STUFFING_PID
+            return cls(pid, pmt_pid, stream_type, clock_start or 0, reader.size, file_mtime, entries)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(KEY_FRAME_INDEX_HEADER.pack(KEY_FRAME_INDEX_MAGIC, KEY_FRAME_INDEX_VERSION, self.pid,
+                                                self.pmt_pid, self.stream_type or 0, self.clock_start,
+                                                self.file_size, self.file_mtime, len(self.entries)))
+            f.write(''.join(KEY_FRAME_INDEX_ENTRY.pack(*entry) for entry in self.entries))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if len(data) < KEY_FRAME_INDEX_HEADER.size:
+            raise ValueError('%s is not a key frame index' % filename)
+        magic, version, pid, pmt_pid, stream_type, clock_start, file_size, file_mtime, count = \
+            KEY_FRAME_INDEX_HEADER.unpack_from(data)
+        if magic != KEY_FRAME_INDEX_MAGIC or version != KEY_FRAME_INDEX_VERSION:
+            raise ValueError('%s is not a key frame index' % filename)
+        if len(data) != KEY_FRAME_INDEX_HEADER.size + count * KEY_FRAME_INDEX_ENTRY.size:
+            raise ValueError('%s is truncated' % filename)
+        entries = [key_frame_entry(*KEY_FRAME_INDEX_ENTRY.unpack_from(
+                       data, KEY_FRAME_INDEX_HEADER.size + i * KEY_FRAME_INDEX_ENTRY.size))
+                   for i in xrange(count)]
+        return cls(pid, pmt_pid, stream_type, clock_start, file_size, file_mtime, entries)
+
+    @classmethod
+    def open(cls, ts_filename, index_filename=None):
+        """Load the index of ts_filename, or build and save it if the index
+        file is missing, damaged or was made for a file of another size or
+        modification time."""
+        index_filename = index_filename or ts_filename + KEY_FRAME_INDEX_SUFFIX
+        if os.path.exists(index_filename):
+            try:
+                index = cls.load(index_filename)
+                if (index.file_size, index.file_mtime) == (os.path.getsize(ts_filename),
+                                                          file_mtime_us(ts_filename)):
+                    return index
+                log('Rebuilding key frame index: {0} has changed'.format(ts_filename))
+            except ValueError, e:
+                log('Rebuilding key frame index: {0}'.format(e))
+        index = cls.build(ts_filename)
+        index.save(index_filename)
+        return index
+
+    @property
+    def times(self):
+        "Seconds from clock_start of the entries, with PTS wrap-around unwrapped."
+        if self._times is None:
+            self._times = []
+            seconds = 0.0
+            previous = self.clock_start
+            for entry in self.entries:
+                seconds += timestamp_delta(entry.pts, previous)
+                previous = entry.pts
+                self._times.append(seconds)
+        return self._times
+
+    def find_time(self, seconds):
+        "Return the first entry at or after seconds, or None."
+        i = bisect.bisect_left(self.times, seconds)
+        if i < len(self.entries):
+            return self.entries[i]
+        return None
+
+#
+# Live stream monitor
+#
+MONITOR_INTERVAL = 10
+MONITOR_WINDOW = 60
+PCR_RESYNC_OFFSET = 1.0
+
+def timestamp_delta(later, earlier):
+    "Return later - earlier in seconds for 90 kHz timestamps that may wrap."
+    delta = (later - earlier) % TIMESTAMP_WRAP
+    if delta >= TIMESTAMP_WRAP // 2:
+        delta -= TIMESTAMP_WRAP
+    return delta / 90000.0
+
+class monitor_bucket(object):
+    "Statistics of one second of a monitored stream, per PID."
+    def __init__(self, start):
+        self.start = start
+        self.packets = collections.defaultdict(int)
+        self.cc_errors = collections.defaultdict(int)
+        self.pcr_offset_min = {}
+        self.pcr_offset_max = {}
+        self.pcr_interval_max = {}
+        self.pts_offsets = {}
+
+class ts_monitor(object):
+    """Rolling statistics of a live TS stream.
+
+    Data passed to add_data is counted in one second buckets, of which the
+    last window are kept, so memory use does not grow with uptime. Every
+    interval seconds a snapshot of the window is written to output as a JSON
+    line with per PID bitrate, continuity counter errors, PCR interval and
+    jitter, and the drift of PTS against PCR. Data is passed on to importer
+    if one is given, so ts_monitor can stand in for it in handle_udp.
+
+    PCR jitter is the peak to peak variation of PCR time minus arrival
+    time, where all packets in one add_data call arrive at the same time."""
+    def __init__(self, importer=None, interval=MONITOR_INTERVAL, window=MONITOR_WINDOW,
+                 output=sys.stdout, clock=time.time):
+        if np is None:
+            raise RuntimeError('ts_monitor needs NumPy')
+        self.importer = importer
+        self.interval = interval
+        self.window = window
+        self.output = output
+        self.clock = clock
+        self.buckets = collections.deque(maxlen=window)
+        self.cc_map = {}
+        self.pcr_origin = {}
+        self.last_pcr = {}
+        self.pcr = None
+        self.next_snapshot = None
+        self.num_packets = 0
+        self.num_snapshots = 0
+
+    def add_data(self, data):
+        now = self.clock()
+        self._add_packets(data, now)
+        if self.importer is not None:
+            self.importer.add_data(data)
+        if self.next_snapshot is None:
+            self.next_snapshot = now + self.interval
+        elif now >= self.next_snapshot:
+            self.write_snapshot(now)
+            while self.next_snapshot <= now:
+                self.next_snapshot += self.interval
+
+    def _get_bucket(self, now):
+        start = int(now)
+        while self.buckets and self.buckets[0].start <= start - self.window:
+            self.buckets.popleft()
+        if not self.buckets or self.buckets[-1].start != start:
+            self.buckets.append(monitor_bucket(start))
+        return self.buckets[-1]
+
+    def _add_packets(self, data, now):
+        packets = packet_array(data)
+        if not len(packets):
+            return
+        self.num_packets += len(packets)
+        bucket = self._get_bucket(now)
+        headers = packet_headers(packets)
+        valid = headers.transport_error_indicator == 0
+
+        pids, counts = np.unique(headers.pid, return_counts=True)
+        for pid, count in zip(pids.tolist(), counts.tolist()):
+            bucket.packets[pid] += count
+        for pid, nr_errors in count_cc_errors(headers, self.cc_map, valid).iteritems():
+            bucket.cc_errors[pid] += nr_errors
+
+        has_pcr = valid & (headers.pid != STUFFING_PID) & ((headers.adaptation_field_exist & 0x02) != 0) & \
+                  (packets[:, 4] >= 7) & ((packets[:, 5] & 0x10) != 0)
+        indices = np.flatnonzero(has_pcr)
+        if len(indices):
+            pcr = packets[indices, 6:11].astype(np.int64)
+            pcr_base = (pcr[:, 0] << 25) | (pcr[:, 1] << 17) | (pcr[:, 2] << 9) | \
+                       (pcr[:, 3] << 1) | (pcr[:, 4] >> 7)
+            for pid, pcr_value in zip(headers.pid[indices].tolist(), pcr_base.tolist()):
+                self._add_pcr(bucket, pid, pcr_value, now)
+
+        starts = valid & (headers.payload_unit_start_indicator == 1) & \
+                 ((headers.adaptation_field_exist & 0x01) != 0)
+        for index in np.flatnonzero(starts).tolist():
+            pid_pts = packet_pts(data, index * TS_PACKET_SIZE)
+            if pid_pts is not None and self.pcr is not None:
+                offset = timestamp_delta(pid_pts[1], self.pcr)
+                if pid_pts[0] in bucket.pts_offsets:
+                    bucket.pts_offsets[pid_pts[0]][1] = offset
+                else:
+                    bucket.pts_offsets[pid_pts[0]] = [offset, offset]
+
+    def _add_pcr(self, bucket, pid, pcr, now):
+        if pid in self.last_pcr:
+            interval = timestamp_delta(pcr, self.last_pcr[pid])
+            bucket.pcr_interval_max[pid] = max(interval, bucket.pcr_interval_max.get(pid, interval))
+        self.last_pcr[pid] = pcr
+        self.pcr = pcr
+
+        if pid not in self.pcr_origin:
+            self.pcr_origin[pid] = (pcr, now)
+        origin_pcr, origin_time = self.pcr_origin[pid]
+        offset = timestamp_delta(pcr, origin_pcr) - (now - origin_time)
+        if abs(offset) > PCR_RESYNC_OFFSET:
+            # PCR discontinuity, start over
+            self.pcr_origin[pid] = (pcr, now)
+            offset = 0.0
+        bucket.pcr_offset_min[pid] = min(offset, bucket.pcr_offset_min.get(pid, offset))
+        bucket.pcr_offset_max[pid] = max(offset, bucket.pcr_offset_max.get(pid, offset))
+
+    def snapshot(self, now=None):
+        "Return a dict with the statistics of the current window."
+        if now is None:
+            now = self.clock()
+        duration = self.buckets and max(now - self.buckets[0].start, 1.0) or 1.0
+        pids = {}
+        total_packets = 0
+        for bucket in self.buckets:
+            for pid, count in bucket.packets.iteritems():
+                stats = pids.setdefault(pid, {'packets': 0, 'cc_errors': 0})
+                stats['packets'] += count
+                total_packets += count
+            for pid, nr_errors in bucket.cc_errors.iteritems():
+                pids[pid]['cc_errors'] += nr_errors
+            for pid, offset in bucket.pcr_offset_min.iteritems():
+                stats = pids[pid]
+                stats['pcr_offset_min'] = min(offset, stats.get('pcr_offset_min', offset))
+                stats['pcr_offset_max'] = max(bucket.pcr_offset_max[pid], stats.get('pcr_offset_max', offset))
+            for pid, interval in bucket.pcr_interval_max.iteritems():
+                pids[pid]['pcr_interval_max'] = max(interval, pids[pid].get('pcr_interval_max', interval))
+            for pid, (first, last) in bucket.pts_offsets.iteritems():
+                pids[pid].setdefault('pts_pcr_first', first)
+                pids[pid]['pts_pcr_offset'] = last
+
+        for stats in pids.itervalues():
+            stats['bitrate'] = stats['packets'] * TS_PACKET_SIZE * 8 / duration
+            stats['cc_error_rate'] = float(stats['cc_errors']) / stats['packets']
+            if 'pcr_offset_min' in stats:
+                stats['pcr_jitter'] = stats.pop('pcr_offset_max') - stats.pop('pcr_offset_min')
+            if 'pts_pcr_first' in stats:
+                stats['pts_drift'] = stats['pts_pcr_offset'] - stats.pop('pts_pcr_first')
+
+        return {'time': now,
+                'window': duration,
+                'packets': total_packets,
+                'bitrate': total_packets * TS_PACKET_SIZE * 8 / duration,
+                'total_packets': self.num_packets,
+                'pids': dict((str(pid), stats) for pid, stats in pids.iteritems())}
+
+    def write_snapshot(self, now=None):
+        self.output.write(json.dumps(self.snapshot(now), sort_keys=True) + '\n')
+        self.output.flush()
+        self.num_snapshots += 1
+
+#
+# Timing analysis
+#
+SYSTEM_CLOCK = 27000000.0
+PCR_WRAP = TIMESTAMP_WRAP * 300
+PCR_MAX_INTERVAL = 0.04
+PCR_MAX_INACCURACY = 500e-9
+PCR_RATE_TOLERANCE = 1e-3
+PCR_DISCONTINUITY_INTERVAL = 1.0
+
+def unwrap_timestamps(values, wrap):
+    """Unwrap a sequence of timestamps that wrap at wrap.
+
+    Return (unwrapped values, deltas). Steps back are kept as negative
+    deltas instead of being taken as a wrap."""
+    deltas = np.diff(values) % wrap
+    deltas[deltas >= wrap // 2] -= wrap
+    unwrapped = np.empty(len(values), np.int64)
+    if len(values):
+        unwrapped[0] = values[0]
+        np.cumsum(deltas, out=unwrapped[1:])
+        unwrapped[1:] += values[0]
+    return unwrapped, deltas
+
+class timing_analyzer(object):
+    """PCR and PTS/DTS timing analysis of a TS stream.
+
+    add_data extracts the PCRs and, per PID, the position, size and PTS/DTS
+    of every PES with NumPy, so only compact arrays are kept. analyze()
+    then computes:
+
+    * PCR intervals per PCR PID, and their repetition errors (> 40 ms).
+    * Mux rate from PCR and byte position, and the PCR accuracy: the
+      deviation of each PCR from the value interpolated between its
+      neighbours at its byte position (limit 500 ns). Interpolating by
+      byte position needs a constant mux rate, so the accuracy is only
+      checked when the rate between all PCRs is within 0.1% of the mean.
+    * Per PES PID a simple decoder buffer model: bytes arrive at the
+      system time given by their byte position and the last PCR before
+      it, and leave at the DTS of their PES. This gives the maximum buffer
+      level, the decode delay, and the number of PES that are not complete
+      at their DTS (underflows).
+
+    33-bit wrap-around of PCR, PTS and DTS is handled by unwrapping."""
+    def __init__(self):
+        if np is None:
+            raise RuntimeError('timing_analyzer needs NumPy')
+        self.position = 0
+        self.pcr_chunks = []
+        self.pes_chunks = []
+        self.open_pes = {}
+        self.pes_records = []
+
+    def add_data(self, data):
+        packets = packet_array(data)
+        nr_packets = len(packets)
+        if not nr_packets:
+            return
+        headers = packet_headers(packets)
+        valid = headers.transport_error_indicator == 0
+        positions = self.position + np.arange(nr_packets, dtype=np.int64) * TS_PACKET_SIZE
+
+        has_pcr = valid & (headers.pid != STUFFING_PID) & ((headers.adaptation_field_exist & 0x02) != 0) & \
+                  (packets[:, 4] >= 7) & ((packets[:, 5] & 0x10) != 0)
+        indices = np.flatnonzero(has_pcr)
+        if len(indices):
+            pcr = packets[indices, 6:12].astype(np.int64)
+            base = (pcr[:, 0] << 25) | (pcr[:, 1] << 17) | (pcr[:, 2] << 9) | \
+                   (pcr[:, 3] << 1) | (pcr[:, 4] >> 7)
+            extension = ((pcr[:, 4] & 0x01) << 8) | pcr[:, 5]
+            self.pcr_chunks.append((headers.pid[indices], positions[indices], base * 300 + extension))
+
+        has_payload = valid & (headers.payload_start < TS_PACKET_SIZE) & (headers.pid != STUFFING_PID)
+        indices = np.flatnonzero(has_payload)
+        if len(indices):
+            self._add_pes_packets(data, headers, indices, positions)
+        self.position += nr_packets * TS_PACKET_SIZE
+
+    def _add_pes_packets(self, data, headers, indices, positions):
+        order = indices[np.argsort(headers.pid[indices], kind='mergesort')]
+        pids = headers.pid[order]
+        payload_bytes = TS_PACKET_SIZE - headers.payload_start[order]
+        unit_start = headers.payload_unit_start_indicator[order] == 1
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(pids)) + 1, [len(order)])).tolist()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            pid = int(pids[start])
+            starts = (np.flatnonzero(unit_start[start:end]) + start).tolist()
+            if pid not in self.open_pes and not starts:
+                continue
+            segment_starts = [start] + starts if not starts or starts[0] != start else starts
+            sizes = np.add.reduceat(payload_bytes[start:end], np.array(segment_starts) - start).tolist()
+            segment_ends = segment_starts[1:] + [end]
+            for first, last, size in zip(segment_starts, segment_ends, sizes):
+                last_position = int(positions[order[last - 1]])
+                if first in starts:
+                    self._close_pes(pid)
+                    times = packet_pes_times(data, int(order[first]) * TS_PACKET_SIZE)
+                    if times is None:
+                        continue
+                    self.open_pes[pid] = [int(positions[order[first]]), last_position, size, times[1], times[2]]
+                elif pid in self.open_pes:
+                    record = self.open_pes[pid]
+                    record[1] = last_position
+                    record[2] += size
+        if len(self.pes_records) > 4096:
+            self._flush_pes_records()
+
+    def _close_pes(self, pid):
+        record = self.open_pes.pop(pid, None)
+        if record is not None:
+            self.pes_records.append([pid] + record)
+
+    def _flush_pes_records(self):
+        if self.pes_records:
+            self.pes_chunks.append(np.array(self.pes_records, np.int64))
+            self.pes_records = []
+
+    def _pcr_arrays(self):
+        if not self.pcr_chunks:
+            return None
+        return [np.concatenate([chunk[i] for chunk in self.pcr_chunks]) for i in range(3)]
+
+    def analyze(self):
+        "Return a dict with the results for the data added so far."
+        for pid in self.open_pes.keys():
+            self._close_pes(pid)
+        self._flush_pes_records()
+        results = {'pcr': {}, 'pes': {}}
+        pcr_arrays = self._pcr_arrays()
+        if pcr_arrays is None:
+            return results
+        pcr_pids, pcr_positions, pcr_values = pcr_arrays
+        clock = None
+        for pid in np.unique(pcr_pids).tolist():
+            mask = pcr_pids == pid
+            positions = pcr_positions[mask]
+            values, deltas = unwrap_timestamps(pcr_values[mask], PCR_WRAP)
+            results['pcr'][pid] = self._analyze_pcr(positions, values, deltas)
+            if clock is None or len(positions) > len(clock[0]):
+                clock = (positions, values, deltas)
+        if self.pes_chunks:
+            records = np.concatenate(self.pes_chunks)
+            for pid in np.unique(records[:, 0]).tolist():
+                results['pes'][pid] = self._analyze_pes(records[records[:, 0] == pid], clock)
+        return results
+
+    def _analyze_pcr(self, positions, values, deltas):
+        intervals = deltas / SYSTEM_CLOCK
+        discontinuities = (intervals < 0) | (intervals > PCR_DISCONTINUITY_INTERVAL)
+        intervals = intervals[~discontinuities]
+        byte_deltas = np.diff(positions)[~discontinuities]
+        result = {'count': len(values),
+                  'discontinuities': int(discontinuities.sum()),
+                  'interval_max': intervals.max() if len(intervals) else 0.0,
+                  'interval_mean': intervals.mean() if len(intervals) else 0.0,
+                  'interval_errors': int((intervals > PCR_MAX_INTERVAL).sum()),
+                  'mux_rate': intervals.sum() and byte_deltas.sum() * 8 / intervals.sum() or 0.0}
+
+        # Accuracy against the PCR interpolated from its neighbours
+        result['constant_rate'] = bool(len(intervals)) and bool(
+            (np.abs(byte_deltas * 8 - result['mux_rate'] * intervals) <=
+             PCR_RATE_TOLERANCE * result['mux_rate'] * intervals).all())
+        if len(values) > 2 and result['constant_rate']:
+            ok = ~(discontinuities[:-1] | discontinuities[1:])
+            span = (positions[2:] - positions[:-2]).astype(np.float64)
+            expected = values[:-2] + (positions[1:-1] - positions[:-2]) * (values[2:] - values[:-2]) / span
+            inaccuracy = np.abs(values[1:-1] - expected)[ok] / SYSTEM_CLOCK
+            result['accuracy_max'] = inaccuracy.max() if len(inaccuracy) else 0.0
+            result['accuracy_errors'] = int((inaccuracy > PCR_MAX_INACCURACY).sum())
+        return result
+
+    def _stc_at(self, clock, positions):
+        """System time (27 MHz) at byte positions.
+
+        The time is extrapolated from the last PCR before each position. The
+        rate after a PCR is that to the next PCR, or the median rate across
+        discontinuities and after the last PCR."""
+        pcr_positions, pcr_values, deltas = clock
+        rates = deltas / np.diff(pcr_positions).astype(np.float64)
+        valid = (deltas >= 0) & (deltas <= PCR_DISCONTINUITY_INTERVAL * SYSTEM_CLOCK)
+        rate = np.median(rates[valid]) if valid.any() else 0.0
+        rates = np.append(np.where(valid, rates, rate), rate)
+        indices = np.maximum(np.searchsorted(pcr_positions, positions, 'right') - 1, 0)
+        return pcr_values[indices] + (positions - pcr_positions[indices]) * rates[indices]
+
+    def _analyze_pes(self, records, clock):
+        first_positions, last_positions, sizes = records[:, 1], records[:, 2], records[:, 3]
+        arrival_start = self._stc_at(clock, first_positions)
+        arrival_end = self._stc_at(clock, last_positions + TS_PACKET_SIZE)
+
+        # PTS and DTS in 27 MHz, unwrapped against the system time of the PES
+        stc_90k = np.floor(arrival_start / 300).astype(np.int64)
+        half_wrap = TIMESTAMP_WRAP // 2
+        pts = arrival_start + ((records[:, 4] - stc_90k + half_wrap) % TIMESTAMP_WRAP - half_wrap) * 300.0
+        dts = arrival_start + ((records[:, 5] - stc_90k + half_wrap) % TIMESTAMP_WRAP - half_wrap) * 300.0
+
+        # Bytes arrive linearly between the first and last packet of a PES
+        # and are removed at its DTS
+        arrived = np.cumsum(sizes)
+        arrival_times = np.column_stack((arrival_start, arrival_end)).ravel()
+        arrival_bytes = np.column_stack((arrived - sizes, arrived)).ravel()
+        order = np.argsort(dts, kind='mergesort')
+        removal_times = dts[order]
+        removed_before = np.cumsum(sizes[order]) - sizes[order]
+        levels = np.interp(removal_times, arrival_times, arrival_bytes) - removed_before
+        decode_delay = (dts - arrival_end) / SYSTEM_CLOCK
+
+        return {'count': len(records),
+                'bytes': int(sizes.sum()),
+                'buffer_max': int(levels.max()),
+                'underflows': int((decode_delay < 0).sum()),
+                'decode_delay_min': decode_delay.min(),
+                'decode_delay_max': decode_delay.max(),
+                'pts_pcr_min': ((pts - arrival_start) / SYSTEM_CLOCK).min(),
+                'pts_pcr_max': ((pts - arrival_start) / SYSTEM_CLOCK).max(),
+                'pts_dts_max': ((pts - dts) / SYSTEM_CLOCK).max()}
+
+    def report(self):
+        results = self.analyze()
+        log('')
+        log('Timing:')
+        for pid, result in sorted(results['pcr'].iteritems()):
+            log(' PCR pid={0}: {1} PCRs, interval max {2:.1f} ms mean {3:.1f} ms, {4} interval errors, '
+                '{5} discontinuities, mux rate {6:.0f} bps'.format(
+                    pid, result['count'], result['interval_max'] * 1000, result['interval_mean'] * 1000,
+                    result['interval_errors'], result['discontinuities'], result['mux_rate']))
+            if 'accuracy_max' in result:
+                log('  accuracy max {0:.0f} ns, {1} accuracy errors'.format(
+                    result['accuracy_max'] * 1e9, result['accuracy_errors']))
+            elif not result['constant_rate']:
+                log('  accuracy not checked, the mux rate is not constant')
+        for pid, result in sorted(results['pes'].iteritems()):
+            log(' PES pid={0}: {1} PES, buffer max {2} bytes, {3} underflows, decode delay '
+                '{4:.3f}-{5:.3f} s, PTS-PCR {6:.3f}-{7:.3f} s'.format(
+                    pid, result['count'], result['buffer_max'], result['underflows'],
+                    result['decode_delay_min'], result['decode_delay_max'],
+                    result['pts_pcr_min'], result['pts_pcr_max']))
+        return results
+
 def handle_http(url, importer):
     parts = urlparse.urlsplit(url)
     conn = httplib.HTTPConnection(parts.netloc, timeout=10)
@@ -2753,59 +4611,220 @@ def handle_http(url, importer):
     conn.request('GET', parts.path)
     data = conn.getresponse().read()
     importer.preflight(data)
-    global cc_map
-    cc_map.clear()
     importer.add_data(data)
     importer.flush()
 
-def handle_file(filename, nr_bytes_to_read, importer):
-    with open(filename, 'rb') as f:
-        bytes = 188*100000
-        #f.read(24)
-        if nr_bytes_to_read > 0:
+def handle_stream(f, nr_bytes_to_read, importer):
+    bytes = 188*100000
+    #f.read(24)
+    if nr_bytes_to_read > 0:
+        bytes = min(bytes, nr_bytes_to_read)
+    data = f.read(bytes)
+    if nr_bytes_to_read > 0:
+        # The limit counts 188-byte packets, so scale it to the packet size
+        packet_size = find_sync(data)[1] or TS_PACKET_SIZE
+        nr_bytes_to_read = nr_bytes_to_read // TS_PACKET_SIZE * packet_size
+    nr_bytes_to_read -= len(data)
+    try:
+        importer.preflight(data)
+    except Exception, e:
+        print 'preflight error:', e
+        importer.report()
+        return
+
+    num_bytes = len(data)
+    importer.add_data(data)
+
+    done = False
+    while not done:
+        if nr_bytes_to_read >= 0:
             bytes = min(bytes, nr_bytes_to_read)
         data = f.read(bytes)
+        num_bytes += len(data)
         nr_bytes_to_read -= len(data)
-        try:
-            importer.preflight(data)
-        except Exception, e:
-            print 'preflight error:', e
-            importer.report()
-            return
-
-        num_bytes = len(data)
         importer.add_data(data)
+        if nr_bytes_to_read == 0 or len(data) != bytes:
+            done = True
+    importer.flush()
+    #print 'bytes read=', num_bytes, 'packets read=', num_bytes / 188
+
+def handle_file(filename, nr_bytes_to_read, importer, start=0, end=None, start_time=None, end_time=None,
+                index=None):
+    """Parse a TS file, or the part between the byte offsets start and end.
+
+    start_time and end_time (seconds from the first PCR or PTS) are looked
+    up with ts_file_reader.find_time and override start and end. With a
+    key_frame_index they are looked up in the index instead, so parsing
+    starts and stops at a key frame without scanning the file. The PAT
+    and PMT are taken from the start of the file. Regular files are memory
+    mapped; other files such as pipes are read in chunks from the start.
+    A positive nr_bytes_to_read limits the parsing to that many bytes of
+    188-byte packets, whatever the packet size of the file."""
+    if not os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            handle_stream(f, nr_bytes_to_read, importer)
+        return
 
-        done = False
-        while not done:
-            if nr_bytes_to_read >= 0:
-                bytes = min(bytes, nr_bytes_to_read)
-            data = f.read(bytes)
-            num_bytes += len(data)
-            nr_bytes_to_read -= len(data)
-            importer.add_data(data)
-            if nr_bytes_to_read == 0 or len(data) != bytes:
-                done = True
+    with ts_file_reader(filename) as reader:
+        if index is not None:
+            if start_time is not None:
+                entry = index.find_time(start_time)
+                start = entry.offset if entry is not None else reader.size
+            if end_time is not None:
+                entry = index.find_time(end_time)
+                end = entry.offset if entry is not None else reader.size
+        else:
+            if start_time is not None:
+                start = reader.find_time(start_time)
+            if end_time is not None:
+                end = reader.find_time(end_time)
+        start = reader.sync(start)
+
+        # PAT and PMT are looked up from the start of the file, continuing
+        # after a loss of sync
+        error = 'no TS packets found'
+        for data in reader.chunks(0):
+            try:
+                importer.preflight(data)
+                break
+            except Exception, e:
+                error = e
+        else:
+            print 'preflight error:', error
+            importer.report()
+            return
+        reader.lost_sync = 0
+
+        importer.packet_size = reader.packet_size
+        remaining = nr_bytes_to_read // TS_PACKET_SIZE * TS_PACKET_SIZE
+        for offset, data in reader.offset_chunks(start, end):
+            if nr_bytes_to_read > 0:
+                if len(data) > remaining:
+                    data = data[:remaining]
+                remaining -= len(data)
+            importer.add_data(data, offset)
+            if nr_bytes_to_read > 0 and not remaining:
+                break
         importer.flush()
-        #print 'bytes read=', num_bytes, 'packets read=', num_bytes / 188
-
-def handle_udp(host, port, importer):
+        importer.lost_sync += reader.lost_sync
+
+UDP_DATAGRAM_SIZE = 1500
+UDP_RING_SLOTS = 16384
+
+class udp_receiver(threading.Thread):
+    """Thread that receives datagrams from sock into a ring of fixed size slots.
+
+    All datagrams that are ready are drained at every wakeup. When the ring
+    is full, datagrams are received and dropped and counted in overruns,
+    and get_kernel_drops() returns the datagrams dropped by the kernel when
+    the socket receive buffer was full. get() returns the data of all received
+    datagrams, so the parsing can be done in another thread."""
+    def __init__(self, sock, slots=UDP_RING_SLOTS, datagram_size=UDP_DATAGRAM_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.sock.setblocking(0)
+        self.slots = slots
+        self.datagram_size = datagram_size
+        self.ring = bytearray(slots * datagram_size)
+        self.lengths = [0] * slots
+        self.scratch = bytearray(datagram_size)
+        self.head = 0           # number of datagrams written
+        self.tail = 0           # number of datagrams read
+        self.ready = threading.Condition()
+        self.running = True
+        self.num_datagrams = 0
+        self.num_bytes = 0
+        self.overruns = 0
+        self.kernel_drops_start = socket_drops(sock)
+
+    def get_kernel_drops(self):
+        drops = socket_drops(self.sock)
+        if drops is None or self.kernel_drops_start is None:
+            return None
+        return drops - self.kernel_drops_start
+
+    def run(self):
+        view = memoryview(self.ring)
+        while self.running:
+            if not select.select([self.sock], [], [], 0.2)[0]:
+                continue
+            received = 0
+            while True:
+                full = self.head - self.tail >= self.slots
+                if full:
+                    target = self.scratch
+                else:
+                    slot = self.head % self.slots
+                    target = view[slot * self.datagram_size:(slot + 1) * self.datagram_size]
+                try:
+                    length = self.sock.recv_into(target)
+                except socket.error as e:
+                    if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        break
+                    raise
+                if full:
+                    self.overruns += 1
+                    continue
+                self.lengths[slot] = length
+                self.num_datagrams += 1
+                self.num_bytes += length
+                self.head += 1
+                received += 1
+            if received:
+                with self.ready:
+                    self.ready.notify()
+
+    def get(self, timeout=None):
+        "Return the data of all datagrams received since the last call, or ''."
+        with self.ready:
+            if self.head == self.tail:
+                self.ready.wait(timeout)
+            head = self.head
+        size = self.datagram_size
+        data = []
+        for i in xrange(self.tail, head):
+            slot = i % self.slots
+            data.append(str(buffer(self.ring, slot * size, self.lengths[slot])))
+        self.tail = head
+        return ''.join(data)
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+def handle_udp(host, port, importer, duration=None):
+    """Parse the TS stream received on host:port until interrupted or for
+    duration seconds. Datagrams are received on a separate thread."""
     sock = create_socket(int(port), host)
-    in_list = [sock]
-    out_list = []
-    except_list = []
-    log('Start sampling on host={0} port={1}'.format(host, port))
-    while True:
-        (in_, out_, exc_) = select.select(in_list, out_list, except_list, 1.0)
-        for fd in in_:
-            if fd == sock:
-                data = sock.recv(1500)
+    log('Start sampling on host={0} port={1} receive buffer={2}'.format(
+        host, port, sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)))
+    receiver = udp_receiver(sock)
+    receiver.start()
+    end_time = duration and time.time() + duration
+    try:
+        while not end_time or time.time() < end_time:
+            data = receiver.get(1.0)
+            if data:
                 importer.add_data(data)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        kernel_drops = receiver.get_kernel_drops()
+        sock.close()
+    data = receiver.get(0)
+    if data:
+        importer.add_data(data)
+    log('Received {0} datagrams, {1} bytes, ring overruns: {2}, kernel drops: {3}'.format(
+        receiver.num_datagrams, receiver.num_bytes, receiver.overruns, kernel_drops))
+    return receiver
 
 def main():
     parser = optparse.OptionParser(usage='%prog [options] <file path>|<http url>|<multicast address> <multicast port>')
     parser.add_option('-v', '--verbose', help='increase verbosity', action='count', default=0)
-    parser.add_option('-o', '--observer', help='type of observer [default: %default]', default='parser')
+    parser.add_option('-o', '--observer', help='comma separated observers, %s or module.factory [default: %%default]' % ', '.join(CONSUMERS), default='parser')
+    parser.add_option('-t', '--threaded', help='run each observer on its own thread with a bounded queue', action='store_true', default=False, dest='threaded')
     if scc:
         parser.add_option('-C', help="log CC statistics", action='store_true', default=False, dest='log_cc')
         parser.add_option('-c', '--CC', help='extract CEA-608 captions to file, and turns on logging - => auto filename.', action="store", dest="cc", default="")
@@ -2814,6 +4833,15 @@ def main():
     parser.add_option('-T', '--text', help='display text/metadata details', action='store_true', default=False, dest='text')
     parser.add_option('-s', '--silent', help='silent (suppress log printout)', action='store_true', default=False, dest='silent')
     parser.add_option('-p', '--packets', help='max nr TS packets to parse [default: %default]', action='store', default=-1, dest='max_nr_packets')
+    parser.add_option('-m', '--monitor', help='write rolling statistics as JSON lines every N seconds, 0 to disable [default: %default]', type='int', default=0, dest='monitor')
+    parser.add_option('--monitor-window', help='length in seconds of the rolling statistics window [default: %default]', type='int', default=MONITOR_WINDOW, dest='monitor_window')
+    parser.add_option('--start-offset', help='byte offset to start parsing at [default: %default]', type='int', default=0, dest='start_offset')
+    parser.add_option('--end-offset', help='byte offset to stop parsing at', type='int', default=None, dest='end_offset')
+    parser.add_option('--start-time', help='time [[HH:]MM:]SS from the first PCR/PTS to start parsing at', default=None, dest='start_time')
+    parser.add_option('--end-time', help='time [[HH:]MM:]SS from the first PCR/PTS to stop parsing at', default=None, dest='end_time')
+    parser.add_option('--index', help='look up --start-time and --end-time in the key frame index <file path>%s, which is built if missing' % KEY_FRAME_INDEX_SUFFIX, action='store_true', default=False, dest='index')
+    parser.add_option('--timing', help='analyze PCR intervals and accuracy, and PTS/DTS against PCR', action='store_true', default=False, dest='timing')
+    parser.add_option('-j', '--processes', help='parse the elementary streams in this many worker processes, 0 to parse in the main process [default: %default]', type='int', default=0, dest='processes')
 
     # parse and validate options
     (opts, args) = parser.parse_args()
@@ -2840,11 +4868,10 @@ def main():
     else:
         nr_bytes_to_read = -1
 
-    if opts.observer == 'parser':
-        obs = parser_observer(options)
-    else:
-        obs = key_frame_observer()
+    obs = create_observer(opts.observer.split(','), options, opts.processes, opts.threaded)
     importer = ts_importer(obs, options, log_cc)
+    if opts.timing:
+        importer.timing = timing_analyzer()
 
     logger.silent = opts.silent
 
@@ -2856,7 +4883,10 @@ def main():
             handle_http(uri, importer)
             importer.report()
         else:
-            handle_file(uri, nr_bytes_to_read, importer)
+            handle_file(uri, nr_bytes_to_read, importer, opts.start_offset, opts.end_offset,
+                        opts.start_time and parse_time(opts.start_time),
+                        opts.end_time and parse_time(opts.end_time),
+                        opts.index and key_frame_index.open(uri) or None)
             importer.report()
 
     # Socket
@@ -2867,7 +4897,10 @@ def main():
         if len(args) == 3:
             data_file = args[2]
             obs.data_file = data_file
-        handle_udp(host, port, importer)
+        if opts.monitor > 0:
+            handle_udp(host, port, ts_monitor(importer, opts.monitor, opts.monitor_window))
+        else:
+            handle_udp(host, port, importer)
         importer.report()
 
 if __name__=='__main__':
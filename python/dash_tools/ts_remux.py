@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+
+"""
+Remux MPEG-2 TS to fragmented MP4 (CMAF) without external tools.
+
+A remux_observer on ts_importer turns the frames of h264_parser and
+aac_parser_adts into one CMAF track per PID. Each track writes its init
+segment and then one moof/mdat fragment at a time, starting at a sync
+sample once the fragment duration is reached. The tfdt is the DTS of the
+first sample (video, 90 kHz) or the PTS in samples (audio), with 33-bit
+wrap-around unwrapped. Several input files, such as the renditions of a
+bitrate ladder, are remuxed in parallel processes.
+"""
+
+# The copyright in this software is being made available under the BSD License,
+# included below. This software may be subject to other third party and contributor
+# rights, including patent rights, and no such rights are granted under this license.
+#
+# Copyright (c) 2016, Dash Industry Forum.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice, this
+#  list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright notice,
+#  this list of conditions and the following disclaimer in the documentation and/or
+#  other materials provided with the distribution.
+#  * Neither the name of Dash Industry Forum nor the names of its
+#  contributors may be used to endorse or promote products derived from this software
+#  without specific prior written permission.
+#
+#  THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS AS IS AND ANY
+#  EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+#  WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+#  IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+#  INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+#  NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+#  PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+#  WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+#  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+#  POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+import time
+import struct
+import multiprocessing
+from argparse import ArgumentParser
+
+import ts
+from mp4_writer import BoxWriter
+
+FRAGMENT_DURATION = 2.0
+VIDEO_TIMESCALE = 90000
+AAC_FRAME_SAMPLES = 1024
+MOVIE_TIMESCALE = 1000
+
+SYNC_SAMPLE_FLAGS = 0x02000000      # sample_depends_on = 2
+NON_SYNC_SAMPLE_FLAGS = 0x01010000  # sample_depends_on = 1, sample_is_non_sync_sample
+TRUN_FLAGS = 0x000001 | 0x000100 | 0x000200 | 0x000400  # offset, duration, size, flags
+TRUN_CTO_FLAG = 0x000800
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+MATRIX = (0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000)
+
+
+def remove_emulation_prevention(data):
+    "Return the RBSP of a NAL unit."
+    return data.replace('\x00\x00\x03', '\x00\x00')
+
+
+def sps_dimensions(sps):
+    "Return (width, height) in pixels from an H.264 SPS NAL unit."
+    reader = ts.bitreader(remove_emulation_prevention(sps[1:]))
+    profile_idc = reader.read_u8()
+    reader.skip_bits(16)  # constraint flags, level_idc
+    reader.read_ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in HIGH_PROFILES:
+        chroma_format_idc = reader.read_ue()
+        if chroma_format_idc == 3:
+            reader.skip_bits(1)  # separate_colour_plane_flag
+        reader.read_ue()  # bit_depth_luma_minus8
+        reader.read_ue()  # bit_depth_chroma_minus8
+        reader.skip_bits(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.get_bits(1):  # seq_scaling_matrix_present_flag
+            for i in range(chroma_format_idc != 3 and 8 or 12):
+                if reader.get_bits(1):
+                    last_scale = next_scale = 8
+                    for j in range(i < 6 and 16 or 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.read_se()) % 256
+                        last_scale = next_scale or last_scale
+    reader.read_ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.read_ue()
+    if pic_order_cnt_type == 0:
+        reader.read_ue()  # log2_max_pic_order_cnt_lsb_minus4
+    elif pic_order_cnt_type == 1:
+        reader.skip_bits(1)  # delta_pic_order_always_zero_flag
+        reader.read_se()  # offset_for_non_ref_pic
+        reader.read_se()  # offset_for_top_to_bottom_field
+        for i in range(reader.read_ue()):
+            reader.read_se()  # offset_for_ref_frame
+    reader.read_ue()  # max_num_ref_frames
+    reader.skip_bits(1)  # gaps_in_frame_num_value_allowed_flag
+    width_in_mbs = reader.read_ue() + 1
+    height_in_map_units = reader.read_ue() + 1
+    frame_mbs_only = reader.get_bits(1)
+    if not frame_mbs_only:
+        reader.skip_bits(1)  # mb_adaptive_frame_field_flag
+    reader.skip_bits(1)  # direct_8x8_inference_flag
+    width = width_in_mbs * 16
+    height = (2 - frame_mbs_only) * height_in_map_units * 16
+    if reader.get_bits(1):  # frame_cropping_flag
+        left, right, top, bottom = [reader.read_ue() for i in range(4)]
+        crop_x = chroma_format_idc in (1, 2) and 2 or 1
+        crop_y = (chroma_format_idc == 1 and 2 or 1) * (2 - frame_mbs_only)
+        width -= crop_x * (left + right)
+        height -= crop_y * (top + bottom)
+    return width, height
+
+
+def adts_config(header):
+    """Return (AudioSpecificConfig, sample rate, channels) from an ADTS header."""
+    object_type = (ord(header[2]) >> 6) + 1
+    frequency_index = (ord(header[2]) >> 2) & 0x0f
+    channels = ((ord(header[2]) & 0x01) << 2) | (ord(header[3]) >> 6)
+    config = struct.pack('>H', (object_type << 11) | (frequency_index << 7) | (channels << 3))
+    return config, ts.SampleRates[frequency_index], channels
+
+
+def length_prefixed_nal_units(data):
+    "Convert Annex B NAL units with start codes to 4-byte length prefixed ones."
+    units = [unit.rstrip('\x00') for unit in data.split('\x00\x00\x01')]
+    return ''.join(struct.pack('>I', len(unit)) + unit for unit in units if unit)
+
+
+class fmp4_track(object):
+    """A CMAF track that collects samples and writes fragments to sink.
+
+    sink.on_init(track, data) is called once before the first fragment and
+    sink.on_fragment(track, data) for every fragment. Samples are
+    [decode time, composition offset, data, sync] in the track timescale.
+    A sample is held back until the next one gives its duration."""
+
+    handler = None
+
+    def __init__(self, track_id, pid, sink, fragment_duration):
+        self.track_id = track_id
+        self.pid = pid
+        self.sink = sink
+        self.fragment_duration = fragment_duration
+        self.timescale = None
+        self.samples = []
+        self.sequence_number = 0
+        self.has_init = False
+        self.last_duration = 0
+        self.timestamp_offset = 0
+        self.last_timestamp = None
+        self.num_samples = 0
+
+    @property
+    def name(self):
+        return '%s_%d' % (self.handler == 'vide' and 'video' or 'audio', self.pid)
+
+    def unwrap(self, timestamp):
+        "Unwrap a 90 kHz PTS or DTS."
+        if self.last_timestamp is not None:
+            if timestamp < self.last_timestamp - ts.TIMESTAMP_WRAP // 2:
+                self.timestamp_offset += ts.TIMESTAMP_WRAP
+            elif timestamp > self.last_timestamp + ts.TIMESTAMP_WRAP // 2:
+                self.timestamp_offset -= ts.TIMESTAMP_WRAP
+        self.last_timestamp = timestamp
+        return timestamp + self.timestamp_offset
+
+    def add_sample(self, decode_time, composition_offset, data, sync):
+        if sync and len(self.samples) > 1 and \
+           decode_time - self.samples[0][0] >= self.fragment_duration * self.timescale:
+            self.write_fragment(decode_time)
+        self.samples.append([decode_time, composition_offset, data, sync])
+        self.num_samples += 1
+
+    def flush(self):
+        if self.samples:
+            self.write_fragment(None)
+
+    def write_fragment(self, next_decode_time):
+        """Write the collected samples as one fragment. next_decode_time is
+        the decode time of the next sample, or None at the end."""
+        if not self.has_init:
+            self.sink.on_init(self, self.init_segment())
+            self.has_init = True
+        samples = self.samples
+        durations = [b[0] - a[0] for a, b in zip(samples[:-1], samples[1:])]
+        if next_decode_time is not None:
+            durations.append(next_decode_time - samples[-1][0])
+        else:
+            durations.append(durations and durations[-1] or self.last_duration)
+        self.last_duration = durations[-1]
+        self.sequence_number += 1
+        self.sink.on_fragment(self, self.fragment(samples, durations))
+        self.samples = []
+
+    def fragment(self, samples, durations):
+        "Return styp, moof and mdat of one fragment."
+        has_cto = any(sample[1] for sample in samples)
+        data_size = sum(len(sample[2]) for sample in samples)
+        writer = BoxWriter(256 + 16 * len(samples) + data_size)
+        with writer.box('styp'):
+            writer.write('msdh')
+            writer.uint32(0)
+            writer.write('msdhmsixcmfs')
+        moof_start = writer.begin_box('moof')
+        with writer.full_box('mfhd', 0, 0):
+            writer.uint32(self.sequence_number)
+        with writer.box('traf'):
+            with writer.full_box('tfhd', 0, TFHD_DEFAULT_BASE_IS_MOOF):
+                writer.uint32(self.track_id)
+            with writer.full_box('tfdt', 1, 0):
+                writer.uint64(samples[0][0])
+            with writer.full_box('trun', 1, TRUN_FLAGS | (has_cto and TRUN_CTO_FLAG)):
+                writer.uint32(len(samples))
+                data_offset_pos = writer.tell()
+                writer.uint32(0)
+                for sample, duration in zip(samples, durations):
+                    flags = sample[3] and SYNC_SAMPLE_FLAGS or NON_SYNC_SAMPLE_FLAGS
+                    writer.pack('>III', duration, len(sample[2]), flags)
+                    if has_cto:
+                        writer.sint32(sample[1])
+        moof_size = writer.end_box(moof_start)
+        writer.patch_uint32(data_offset_pos, moof_size + 8)
+        with writer.box('mdat'):
+            for sample in samples:
+                writer.write(sample[2])
+        return writer.getvalue()
+
+    def init_segment(self):
+        "Return ftyp and moov."
+        writer = BoxWriter(1024)
+        with writer.box('ftyp'):
+            writer.write('cmfc')
+            writer.uint32(0)
+            writer.write('iso6cmfcdash')
+        with writer.box('moov'):
+            with writer.full_box('mvhd', 0, 0):
+                writer.pack('>IIII', 0, 0, MOVIE_TIMESCALE, 0)
+                writer.pack('>IH', 0x00010000, 0x0100)  # rate, volume
+                writer.zeros(10)
+                writer.pack('>9I', *MATRIX)
+                writer.zeros(24)
+                writer.uint32(self.track_id + 1)  # next_track_ID
+            with writer.box('trak'):
+                self.write_tkhd(writer)
+                with writer.box('mdia'):
+                    with writer.full_box('mdhd', 0, 0):
+                        writer.pack('>IIIIHH', 0, 0, self.timescale, 0, 0x55c4, 0)  # 'und'
+                    with writer.full_box('hdlr', 0, 0):
+                        writer.uint32(0)
+                        writer.write(self.handler)
+                        writer.zeros(12)
+                        writer.write('ts_remux\x00')
+                    with writer.box('minf'):
+                        self.write_media_header(writer)
+                        with writer.box('dinf'):
+                            with writer.full_box('dref', 0, 0):
+                                writer.uint32(1)
+                                with writer.full_box('url ', 0, 1):
+                                    pass
+                        with writer.box('stbl'):
+                            with writer.full_box('stsd', 0, 0):
+                                writer.uint32(1)
+                                self.write_sample_entry(writer)
+                            for box_type in ('stts', 'stsc', 'stco'):
+                                with writer.full_box(box_type, 0, 0):
+                                    writer.uint32(0)
+                            with writer.full_box('stsz', 0, 0):
+                                writer.pack('>II', 0, 0)
+            with writer.box('mvex'):
+                with writer.full_box('trex', 0, 0):
+                    writer.pack('>IIIII', self.track_id, 1, 0, 0, 0)
+        return writer.getvalue()
+
+    def write_tkhd(self, writer, volume=0, width=0, height=0):
+        with writer.full_box('tkhd', 0, 0x000007):
+            writer.pack('>IIIII', 0, 0, self.track_id, 0, 0)
+            writer.zeros(8)
+            writer.pack('>HHHH', 0, 0, volume, 0)
+            writer.pack('>9I', *MATRIX)
+            writer.pack('>II', width << 16, height << 16)
+
+
+class h264_track(fmp4_track):
+    "H.264 track in the 90 kHz timescale of the PES, with avc1 sample entry."
+
+    handler = 'vide'
+
+    def __init__(self, track_id, pid, sink, fragment_duration):
+        fmp4_track.__init__(self, track_id, pid, sink, fragment_duration)
+        self.timescale = VIDEO_TIMESCALE
+        self.parser = ts.h264_parser()
+
+    def add_pes(self, pes):
+        self.add_frames(self.parser.add_pes(pes.payload, pes.pts, pes.dts))
+
+    def add_frames(self, frames):
+        for frame in frames:
+            if not self.num_samples and not (frame.sync and self.parser.sps and self.parser.pps):
+                continue  # Start at the first IDR frame with parameter sets
+            decode_time = self.unwrap(frame.dts)
+            self.add_sample(decode_time, (frame.pts - frame.dts) % ts.TIMESTAMP_WRAP,
+                            length_prefixed_nal_units(frame.data), frame.sync)
+
+    def flush(self):
+        self.add_frames(self.parser.flush())
+        fmp4_track.flush(self)
+
+    def write_tkhd(self, writer):
+        width, height = sps_dimensions(self.parser.sps)
+        fmp4_track.write_tkhd(self, writer, 0, width, height)
+
+    def write_media_header(self, writer):
+        with writer.full_box('vmhd', 0, 1):
+            writer.zeros(8)
+
+    def write_sample_entry(self, writer):
+        sps = self.parser.sps
+        pps = self.parser.pps
+        width, height = sps_dimensions(sps)
+        with writer.box('avc1'):
+            writer.zeros(6)
+            writer.uint16(1)  # data_reference_index
+            writer.zeros(16)
+            writer.pack('>HHIIIH', width, height, 0x00480000, 0x00480000, 0, 1)
+            writer.zeros(32)  # compressorname
+            writer.pack('>Hh', 0x0018, -1)
+            with writer.box('avcC'):
+                writer.write(struct.pack('>B3sBBH', 1, sps[1:4], 0xff, 0xe1, len(sps)))
+                writer.write(sps)
+                writer.pack('>BH', 1, len(pps))
+                writer.write(pps)
+
+
+class aac_track(fmp4_track):
+    """AAC track in the timescale of the sample rate, with mp4a sample entry.
+
+    The frames of a PES share its PTS, so decode times are counted in
+    frames from the first PTS and only resynced when they differ from the
+    PTS by more than a frame."""
+
+    handler = 'soun'
+
+    def __init__(self, track_id, pid, sink, fragment_duration):
+        fmp4_track.__init__(self, track_id, pid, sink, fragment_duration)
+        self.parser = ts.aac_parser_adts()
+        self.next_decode_time = None
+
+    def add_pes(self, pes):
+        frames = self.parser.add_pes(pes.payload, pes.pts, pes.dts)
+        if not frames:
+            return
+        if self.timescale is None:
+            self.config, self.timescale, self.channels = adts_config(self.parser.header)
+        pes_time = self.unwrap(pes.pts) * self.timescale // 90000
+        if self.next_decode_time is None or abs(pes_time - self.next_decode_time) > AAC_FRAME_SAMPLES:
+            self.next_decode_time = pes_time
+        for frame in frames:
+            self.add_sample(self.next_decode_time, 0, frame.data, True)
+            self.next_decode_time += AAC_FRAME_SAMPLES
+
+    def write_fragment(self, next_decode_time):
+        fmp4_track.write_fragment(self, next_decode_time or self.next_decode_time)
+
+    def write_tkhd(self, writer):
+        fmp4_track.write_tkhd(self, writer, 0x0100)
+
+    def write_media_header(self, writer):
+        with writer.full_box('smhd', 0, 0):
+            writer.uint32(0)
+
+    def write_sample_entry(self, writer):
+        with writer.box('mp4a'):
+            writer.zeros(6)
+            writer.uint16(1)  # data_reference_index
+            writer.zeros(8)
+            writer.pack('>HHHHI', self.channels, 16, 0, 0, self.timescale << 16)
+            with writer.full_box('esds', 0, 0):
+                config_length = len(self.config)
+                writer.pack('>BBHB', 0x03, 23 + config_length, 0, 0)  # ES_Descriptor
+                writer.pack('>BBBB', 0x04, 15 + config_length, 0x40, 0x15)  # DecoderConfigDescriptor
+                writer.zeros(11)  # bufferSizeDB, maxBitrate, avgBitrate
+                writer.pack('>BB', 0x05, config_length)  # DecoderSpecificInfo
+                writer.write(self.config)
+                writer.pack('>BBB', 0x06, 1, 0x02)  # SLConfigDescriptor
+
+
+class remux_observer(ts.observer):
+    """Observer that remuxes the H.264 and ADTS AAC streams of the PMT to
+    CMAF tracks, see fmp4_track for sink."""
+
+    def __init__(self, sink, fragment_duration=FRAGMENT_DURATION):
+        self.sink = sink
+        self.fragment_duration = fragment_duration
+        self.tracks = {}
+
+    def on_pmt(self, importer, pmt):
+        for stream in pmt.stream_list:
+            pid = stream.elementary_pid
+            if pid in self.tracks:
+                continue
+            if stream.stream_type == ts.STREAM_TYPE_H264:
+                track_class = h264_track
+            elif stream.stream_type in (ts.STREAM_TYPE_AAC, ts.STREAM_TYPE_AUDIO_ADTS):
+                track_class = aac_track
+            else:
+                continue
+            self.tracks[pid] = track_class(len(self.tracks) + 1, pid, self.sink, self.fragment_duration)
+            importer.observe_pid(pid)
+
+    def on_pes(self, pid, pes):
+        track = self.tracks.get(pid)
+        if track is not None:
+            track.add_pes(pes)
+
+    def flush(self):
+        for track in self.tracks.values():
+            track.flush()
+
+    def get_frame_counts(self):
+        return dict((pid, track.num_samples) for pid, track in self.tracks.iteritems())
+
+
+class segment_writer(object):
+    """Sink that writes each track to output_dir/<track name>/ as init.mp4
+    and one <sequence number>.m4s file per fragment."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.num_bytes = 0
+
+    def track_dir(self, track):
+        path = os.path.join(self.output_dir, track.name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def write(self, path, data):
+        with open(path, 'wb') as ofh:
+            ofh.write(data)
+        self.num_bytes += len(data)
+
+    def on_init(self, track, data):
+        self.write(os.path.join(self.track_dir(track), 'init.mp4'), data)
+
+    def on_fragment(self, track, data):
+        self.write(os.path.join(self.track_dir(track), '%d.m4s' % track.sequence_number), data)
+
+
+def remux_file(path, output_dir, fragment_duration=FRAGMENT_DURATION):
+    """Remux the TS file at path to segments in output_dir. Return a dict
+    with the number of samples per track name and the time it took."""
+    start = time.time()
+    sink = segment_writer(output_dir)
+    obs = remux_observer(sink, fragment_duration)
+    importer = ts.ts_importer(obs, {'verbose': 0})
+    ts.handle_file(path, -1, importer)
+    return {'path': path,
+            'samples': dict((track.name, track.num_samples) for track in obs.tracks.values()),
+            'bytes': sink.num_bytes,
+            'seconds': time.time() - start}
+
+
+def output_names(paths):
+    """Return the output directory name of each path.
+
+    The name is the file name without extension, prefixed with as many
+    parent directories as needed to tell it apart from the other paths, so
+    1080p/index.ts and 720p/index.ts go to 1080p/index and 720p/index.
+    Raise ValueError if two paths cannot be told apart, as for H1.ts and
+    H1.m2ts in the same directory."""
+    stems = []
+    for path in paths:
+        parts = os.path.abspath(path).split(os.sep)
+        stems.append(parts[:-1] + [os.path.splitext(parts[-1])[0]])
+    names = []
+    for i, stem in enumerate(stems):
+        others = stems[:i] + stems[i + 1:]
+        for depth in range(1, len(stem) + 1):
+            if all(other[-depth:] != stem[-depth:] for other in others):
+                break
+        else:
+            duplicate = [paths[j] for j, other in enumerate(stems) if j != i and other == stem][0]
+            raise ValueError('%s and %s would be written to the same output directory' %
+                             (duplicate, paths[i]))
+        names.append(os.path.join(*[part for part in stem[-depth:] if part]))
+    return names
+
+
+def _remux_worker(args):
+    "Pool worker. Return (result, error) so one bad file does not stop the run."
+    try:
+        return remux_file(*args), None
+    except Exception as e:
+        return {'path': args[0]}, '%s: %s' % (e.__class__.__name__, e)
+
+
+def main():
+    parser = ArgumentParser(usage='%(prog)s [options] file.ts [file.ts ...]')
+    parser.add_argument('paths', nargs='+', help='TS files, for example the renditions of a ladder')
+    parser.add_argument('-o', '--output-dir', default='.', help='output directory [default: %(default)s]')
+    parser.add_argument('-d', '--fragment-duration', type=float, default=FRAGMENT_DURATION,
+                        help='minimum fragment duration in seconds [default: %(default)s]')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: one per core)')
+    args = parser.parse_args()
+
+    try:
+        names = output_names(args.paths)
+    except ValueError as e:
+        parser.error(str(e))
+    ts.logger.silent = True
+    tasks = [(path, os.path.join(args.output_dir, name), args.fragment_duration)
+             for path, name in zip(args.paths, names)]
+    if len(tasks) == 1 or args.processes == 1:
+        results = [_remux_worker(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(args.processes)
+        try:
+            results = pool.map(_remux_worker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    errors = 0
+    for result, error in results:
+        if error is not None:
+            print 'ERROR %s: %s' % (result['path'], error)
+            errors += 1
+            continue
+        print '%s: %s, %d bytes in %.2f s' % (
+            result['path'], ', '.join('%s %d samples' % item for item in sorted(result['samples'].items())),
+            result['bytes'], result['seconds'])
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()